@@ -1,198 +1,2551 @@
 import os
 import shutil
 import logging
+import gzip
+import json
+import hashlib
+import random
+import queue
+import threading
+import tarfile
+import lzma
+import io
+import struct
+import zlib
+import errno
+import functools
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from datetime import datetime
 from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.executors.pool import ThreadPoolExecutor as SchedulerThreadPool
+from watchdog.observers import Observer
+from watchdog.events import FileSystemEventHandler
+try:
+    import fcntl
+except ImportError:  # не Linux/Unix: reflink недоступен
+    fcntl = None
 import time
 import argparse
+import sys
+import math
+import multiprocessing
+import tempfile
 
 # Конфигурация
 config = {
+    # Строка — директория общего задания с методом и расписанием ниже; словарь
+    # {'path': ..., 'method': ..., 'interval': ..., 'time': ...} — отдельное задание со своими настройками
     'backup_directories': ['/path/to/directory1', '/path/to/directory2'],
     'backup_destination': '/path/to/backup_destination',  # Укажите абсолютный путь
-    'backup_method': 'incremental',  # варианты: 'incremental', 'differential', 'full'
+    'backup_method': 'incremental',  # варианты: 'incremental', 'differential', 'full', 'dedup', 'snapshot'
     'schedule': {
         'interval': 'daily',  # варианты: 'daily', 'weekly', 'monthly' или число секунд
         'time': '02:00',  # время в формате 'HH:MM' для выполнения бэкапа
     },
     'log_file': 'backup.log',
+    'scheduler': {
+        'max_concurrent_jobs': 2,  # сколько заданий бэкапа выполняются одновременно
+        'misfire_grace_time': 3600,  # пропущенный запуск выполняется, если опоздал не больше чем на N секунд
+    },
+    'throttle': {
+        'bytes_per_sec': None,  # предел скорости чтения данных при бэкапе на все задания (None — без ограничения)
+        'files_per_sec': None,  # предел числа файлов в секунду
+    },
+    'output_format': 'directory',  # варианты: 'directory', 'archive'
+    'archive': {
+        'compression': 'gzip',  # варианты: 'gzip', 'xz'
+        'level': 6,
+        'workers': os.cpu_count() or 1,  # процессы сжатия
+        'chunk_size': 4 * 1024 * 1024,  # размер независимо сжимаемого фрагмента tar-потока
+    },
+    'delta': {
+        'threshold': 64 * 1024 * 1024,  # файлы от этого размера хранятся блочной дельтой (None — отключено)
+        'block_size': 1024 * 1024,
+    },
+    'journal': {
+        'path': '.journal',  # журнал изменений режима --daemon внутри backup_destination
+        'max_entries': 100000,  # при переполнении следующий бэкап выполнит полное сканирование
+    },
+    'retention': {
+        'enabled': False,  # удалять устаревшие бэкапы после каждого успешного бэкапа
+        'keep_last': 3,  # последние N бэкапов хранятся всегда (не меньше одного)
+        'daily': 7,  # последний бэкап каждого из N последних дней
+        'weekly': 4,  # последний бэкап каждой из N последних недель
+        'monthly': 6,  # последний бэкап каждого из N последних месяцев
+    },
+    'hash_algorithm': 'sha256',  # контрольные суммы файлов в манифесте (None — не вычислять)
+    'parallel': {
+        'workers': 8,  # число потоков копирования файлов
+        'queue_depth': 1024,  # максимальная длина очереди между сканерами и копировщиками
+        'scanners': 4,  # число одновременно сканируемых директорий из backup_directories
+    },
+    'dedup': {
+        'chunk_store': '.chunks',  # каталог хранилища блоков внутри backup_destination
+        'min_chunk_size': 16 * 1024,
+        'avg_chunk_size': 64 * 1024,  # должен быть степенью двойки
+        'max_chunk_size': 256 * 1024,
+    },
 }
 
+MANIFEST_NAME = 'manifest.json.gz'
+MANIFEST_VERSION = 1
+COPY_BUFFER_SIZE = 1024 * 1024
+ARCHIVE_EXTENSIONS = {'gzip': 'tar.gz', 'xz': 'tar.xz'}
+ARCHIVE_INDEX_NAME = 'archive.index.json.gz'
+FICLONE = 0x40049409  # ioctl клонирования файла на CoW-системах (btrfs, XFS, ...)
+DELTA_DIR = '.delta'
+SIGNATURE_MAGIC = b'BKSIG001'
+PATCH_MAGIC = b'BKPATCH1'
+CATALOG_NAME = '.catalog.json'
+CATALOG_VERSION = 2
+VERIFY_CACHE_NAME = '.verify_cache.json.gz'
+THROTTLE_STEP = 4 * 1024 * 1024  # при ограничении скорости ядро копирует файл участками такого размера
+
+# Таблица случайных 64-битных значений для gear-хеша (FastCDC).
+# Генератор с фиксированным зерном: границы блоков должны совпадать между запусками.
+_GEAR = [random.Random(0x5EED + i).getrandbits(64) for i in range(256)]
+# Байтовые плоскости таблицы: _GEAR_PLANES[j][b] — j-й байт _GEAR[b]. bytes.translate
+# по ним раскладывает значения gear для целого участка данных без цикла по байтам
+_GEAR_PLANES = [bytes((value >> (8 * j)) & 0xFF for value in _GEAR) for j in range(8)]
+# Дорожка одной позиции в упакованном числе: сумма 64 слагаемых gear << k меньше 2**128
+GEAR_LANE = 16
+GEAR_BLOCK = 2048  # позиций за один проход find_chunk_boundary
+
 # Настройка логирования
 logging.basicConfig(filename=config['log_file'], level=logging.INFO,
                     format='%(asctime)s %(levelname)s %(message)s')
 
-def get_last_backup():
+# Каталог бэкапов изменяется после бэкапа и при очистке по политике хранения
+_catalog_lock = threading.RLock()
+
+# apply_retention: все задания (None в списке заданий — общее задание)
+ALL_JOBS = object()
+
+def get_backup_paths():
+    """
+    Пути всех директорий из backup_directories.
+    """
+    return [entry if isinstance(entry, str) else entry['path'] for entry in config['backup_directories']]
+
+def get_backup_jobs():
+    """
+    Задания бэкапа. Директории-строки образуют общее задание без имени с методом
+    и расписанием из config; каждая директория-словарь — отдельное задание,
+    названное по имени директории, со своими методом и расписанием.
+    """
+    schedule = config['schedule']
+    shared = [entry for entry in config['backup_directories'] if isinstance(entry, str)]
+    jobs = []
+    if shared:
+        jobs.append({'name': None, 'directories': shared, 'method': config['backup_method'],
+                     'interval': schedule['interval'], 'time': schedule['time']})
+    for entry in config['backup_directories']:
+        if isinstance(entry, str):
+            continue
+        jobs.append({
+            'name': os.path.basename(os.path.normpath(entry['path'])),
+            'directories': [entry['path']],
+            'method': entry.get('method', config['backup_method']),
+            'interval': entry.get('interval', schedule['interval']),
+            'time': entry.get('time', schedule['time']),
+        })
+    return jobs
+
+def default_job():
+    # Задание по всем директориям: для запуска без планировщика заданий
+    return {'name': None, 'directories': get_backup_paths(), 'method': config['backup_method']}
+
+def backup_folder_name(timestamp, method, job_name=None):
+    if job_name:
+        return f'backup_{timestamp}_{job_name}_{method}'
+    return f'backup_{timestamp}_{method}'
+
+def parse_backup_name(name):
+    """
+    Разбирает имя папки бэкапа на время, имя задания (None для общего) и метод.
+    """
+    parts = name.split('_', 2)
+    if len(parts) < 3:
+        return None, None, parts[-1]
+    job_name, _, method = parts[2].rpartition('_')
+    return parts[1], job_name or None, method
+
+def get_catalog_path():
+    return os.path.join(config['backup_destination'], CATALOG_NAME)
+
+def load_catalog():
+    """
+    Загружает каталог бэкапов. Возвращает None, если каталога нет или он повреждён.
+    """
+    try:
+        with open(get_catalog_path(), encoding='utf-8') as f:
+            catalog = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logging.warning(f"Не удалось прочитать каталог бэкапов: {e}")
+        return None
+    if catalog.get('version') != CATALOG_VERSION:
+        return None
+    return catalog
+
+def write_catalog(backups):
+    """
+    Атомарно записывает каталог: список бэкапов по времени и последний бэкап
+    каждого метода, чтобы поиск последнего бэкапа не требовал обхода директории.
+    """
+    backups = sorted(backups, key=lambda backup: backup['name'])
+    # Для каждого задания ('' — общее): последний бэкап и последний бэкап каждого метода
+    latest = {}
+    for backup in backups:
+        job_latest = latest.setdefault(backup['job'] or '', {})
+        job_latest['backup'] = backup['name']
+        job_latest[backup['method']] = backup['name']
+    catalog = {'version': CATALOG_VERSION, 'backups': backups, 'latest': latest}
+    catalog_path = get_catalog_path()
+    tmp_path = catalog_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(catalog, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, catalog_path)
+    return catalog
+
+def rebuild_catalog():
+    """
+    Строит каталог заново по содержимому backup_destination.
+    """
     backup_dest = config['backup_destination']
-    backups = [os.path.join(backup_dest, d) for d in os.listdir(backup_dest)
-               if os.path.isdir(os.path.join(backup_dest, d)) and d.startswith('backup_')]
+    backups = []
+    for d in os.listdir(backup_dest):
+        if os.path.isdir(os.path.join(backup_dest, d)) and d.startswith('backup_'):
+            _, job_name, method = parse_backup_name(d)
+            backups.append({'name': d, 'method': method, 'job': job_name})
+    logging.info(f"Каталог бэкапов перестроен: бэкапов {len(backups)}")
+    return write_catalog(backups)
+
+def record_backup(folder_name, method, job_name=None):
+    """
+    Добавляет успешно завершённый бэкап в каталог.
+    """
+    with _catalog_lock:
+        catalog = load_catalog()
+        if catalog is None:
+            catalog = rebuild_catalog()
+        backups = [backup for backup in catalog['backups'] if backup['name'] != folder_name]
+        backups.append({'name': folder_name, 'method': method, 'job': job_name})
+        write_catalog(backups)
+
+def _catalog_lookup(key, exclude=None, job_name=None):
+    """
+    Ищет последний бэкап в каталоге. Возвращает (True, путь или None), если
+    каталогу можно верить, и (False, None), если нужен обход директории.
+    """
+    catalog = load_catalog()
+    if catalog is None:
+        return False, None
+    name = catalog['latest'].get(job_name or '', {}).get(key)
+    if name is None:
+        return True, None
+    folder = os.path.join(config['backup_destination'], name)
+    # Папку удалили вручную или её нужно исключить: каталог не годится
+    if folder == exclude or not os.path.isdir(folder):
+        return False, None
+    return True, folder
+
+def _list_job_backups(job_name=None, exclude=None):
+    """
+    Обходит backup_destination и возвращает пути бэкапов задания job_name.
+    """
+    backup_dest = config['backup_destination']
+    return [os.path.join(backup_dest, d) for d in os.listdir(backup_dest)
+            if os.path.isdir(os.path.join(backup_dest, d)) and d.startswith('backup_') and
+            parse_backup_name(d)[1] == job_name and os.path.join(backup_dest, d) != exclude]
+
+def get_last_backup(exclude=None, job_name=None):
+    found, folder = _catalog_lookup('backup', exclude, job_name)
+    if found:
+        return folder
+    backups = _list_job_backups(job_name, exclude)
     backups.sort(reverse=True)
     if backups:
         return backups[0]
     else:
         return None
 
-def get_last_full_backup():
-    backup_dest = config['backup_destination']
-    backups = [os.path.join(backup_dest, d) for d in os.listdir(backup_dest)
-               if os.path.isdir(os.path.join(backup_dest, d)) and
-               d.startswith('backup_') and '_full' in d]
+def get_last_full_backup(exclude=None, job_name=None):
+    found, folder = _catalog_lookup('full', exclude, job_name)
+    if found:
+        return folder
+    backups = [folder for folder in _list_job_backups(job_name, exclude)
+               if parse_backup_name(os.path.basename(folder))[2] == 'full']
     backups.sort(reverse=True)
     if backups:
         return backups[0]
     else:
         return None
 
-def full_backup(backup_folder):
-    for directory in config['backup_directories']:
-        directory_name = os.path.basename(os.path.normpath(directory))
-        dest = os.path.join(backup_folder, directory_name)
-        shutil.copytree(directory, dest)
-    logging.info(f"Полный бэкап выполнен в {backup_folder}")
+def get_last_backup_by_method(method, exclude=None, job_name=None):
+    found, folder = _catalog_lookup(method, exclude, job_name)
+    if found and (folder is None or os.path.exists(os.path.join(folder, MANIFEST_NAME))):
+        return folder
+    backups = [folder for folder in _list_job_backups(job_name, exclude)
+               if parse_backup_name(os.path.basename(folder))[2] == method and
+               os.path.exists(os.path.join(folder, MANIFEST_NAME))]
+    backups.sort(reverse=True)
+    if backups:
+        return backups[0]
+    else:
+        return None
 
-def incremental_backup(backup_folder):
-    last_backup = get_last_backup()
-    if not last_backup:
-        # Если предыдущих бэкапов нет, выполнить полный бэкап
-        full_backup(backup_folder)
-        return
+def write_manifest(backup_folder, manifest):
+    """
+    Атомарно записывает манифест бэкапа (сжатый JSON) в папку бэкапа.
+    """
+    manifest_path = os.path.join(backup_folder, MANIFEST_NAME)
+    tmp_path = manifest_path + '.tmp'
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp_path, manifest_path)
+
+def load_manifest(backup_folder):
+    """
+    Загружает манифест бэкапа. Возвращает None, если манифеста нет или он повреждён.
+    """
+    manifest_path = os.path.join(backup_folder, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return None
+    try:
+        with gzip.open(manifest_path, 'rt', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        logging.warning(f"Не удалось прочитать манифест {manifest_path}: {e}")
+        return None
+    if manifest.get('version') != MANIFEST_VERSION:
+        logging.warning(f"Неподдерживаемая версия манифеста {manifest_path}")
+        return None
+    return manifest
+
+def get_chunk_store():
+    return os.path.join(config['backup_destination'], config['dedup']['chunk_store'])
+
+def chunk_path(chunk_store, digest):
+    return os.path.join(chunk_store, digest[:2], digest)
+
+@functools.lru_cache(maxsize=None)
+def _mask_columns(mask):
+    # Байты 64-битного хеша, которые проверяет маска, и таблицы, оставляющие в них биты маски
+    mask_bytes = mask.to_bytes(8, 'little')
+    return [(j, bytes(value & mask_bytes[j] for value in range(256))) for j in range(8) if mask_bytes[j]]
 
-    for directory in config['backup_directories']:
+def find_chunk_boundary(data, start, min_size, max_size, mask):
+    """
+    Ищет границу блока в data начиная с позиции start с помощью gear-хеша
+    (content-defined chunking): h = (h << 1) + gear[байт] по модулю 2**64,
+    граница — первая позиция после min_size, где h & mask == 0. Возвращает
+    позицию конца блока. Граница зависит только от содержимого, поэтому
+    вставка данных в файл сдвигает лишь соседние блоки.
+
+    Хеш в позиции i равен сумме gear[data[i - k]] << k по k < 64, поэтому он
+    считается сразу для участка из GEAR_BLOCK позиций: значения gear
+    укладываются в дорожки по GEAR_LANE байт одного большого числа, и шесть
+    сдвигов со сложением (удвоение k = 1, 2, ..., 32) дают в каждой дорожке
+    её хеш. Нулевые под маской дорожки ищутся операциями над bytes.
+    """
+    length = len(data) - start
+    if length <= min_size:
+        return len(data)
+    end = start + min(length, max_size)
+    columns = _mask_columns(mask)
+    lane_bits = GEAR_LANE * 8
+    first = start + min_size
+    pos = first
+    while pos < end:
+        stop = min(pos + GEAR_BLOCK, end)
+        # Окно хеша — 64 последних байта, но не раньше first: там хеш начинается с нуля
+        head = max(first, pos - 63)
+        count = stop - head
+        block = data[head:stop]
+        lanes = bytearray(count * GEAR_LANE)
+        for j, plane in enumerate(_GEAR_PLANES):
+            lanes[j::GEAR_LANE] = block.translate(plane)
+        packed = int.from_bytes(lanes, 'little')
+        shift = lane_bits + 1
+        for _ in range(6):
+            packed += packed << shift
+            shift *= 2
+        hashes = packed.to_bytes((count + 64) * GEAR_LANE, 'little')
+        # Ненулевой байт флага — в позиции под маской есть единичные биты
+        flags = 0
+        for j, table in columns:
+            flags |= int.from_bytes(hashes[j:count * GEAR_LANE:GEAR_LANE].translate(table), 'little')
+        hit = flags.to_bytes(count, 'little').find(0, pos - head)
+        if hit >= 0:
+            return head + hit + 1
+        pos = stop
+    return end
+
+def iter_chunks(file_path):
+    """
+    Читает файл потоком и отдаёт блоки переменной длины.
+    """
+    dedup_config = config['dedup']
+    min_size = dedup_config['min_chunk_size']
+    max_size = dedup_config['max_chunk_size']
+    bits = dedup_config['avg_chunk_size'].bit_length() - 1
+    # Используем старшие биты хеша: они зависят от последних 64 байт окна
+    mask = ((1 << bits) - 1) << (64 - bits)
+
+    buffer = b''
+    with open(file_path, 'rb') as f:
+        while True:
+            data = f.read(max_size * 16)
+            buffer += data
+            pos = 0
+            while len(buffer) - pos >= max_size or (not data and pos < len(buffer)):
+                cut = find_chunk_boundary(buffer, pos, min_size, max_size, mask)
+                yield buffer[pos:cut]
+                pos = cut
+            buffer = buffer[pos:]
+            if not data:
+                break
+
+# Хранилище блоков общее для всех заданий. Блоки, на которые ссылаются выполняющиеся
+# бэкапы с дедупликацией, ещё не записавшие манифест, закреплены в _pinned_chunks:
+# сборка мусора их не удаляет. Блокировка защищает только закрепления и проверку
+# наличия блока, поэтому задания с дедупликацией выполняются параллельно.
+_chunk_store_lock = threading.Lock()
+_pinned_chunks = Counter()
+
+def _pin_chunks(pinned, digests):
+    # Вызывается под _chunk_store_lock
+    for digest in digests:
+        pinned[digest] += 1
+        _pinned_chunks[digest] += 1
+
+def _unpin_chunks(pinned):
+    with _chunk_store_lock:
+        for digest, count in pinned.items():
+            _pinned_chunks[digest] -= count
+            if _pinned_chunks[digest] <= 0:
+                del _pinned_chunks[digest]
+    pinned.clear()
+
+def store_chunk(chunk_store, chunk, pinned):
+    """
+    Сохраняет блок в хранилище по его SHA-256, если такого блока ещё нет, и
+    закрепляет его за бэкапом (pinned). Возвращает хеш блока и количество
+    реально записанных байт.
+    """
+    digest = hashlib.sha256(chunk).hexdigest()
+    path = chunk_path(chunk_store, digest)
+    with _chunk_store_lock:
+        # Закрепление до проверки: найденный блок не будет удалён до записи манифеста
+        _pin_chunks(pinned, (digest,))
+        if os.path.exists(path):
+            return digest, 0
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Один блок могут одновременно записывать несколько заданий
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(chunk)
+    os.replace(tmp_path, path)
+    return digest, len(chunk)
+
+def dedup_backup(backup_folder, job=None):
+    """
+    Бэкап с дедупликацией: файлы режутся на блоки по содержимому, каждый блок
+    хранится один раз в общем хранилище, а папка бэкапа содержит только манифест.
+    """
+    job = job or default_job()
+    pinned = Counter()
+    try:
+        _dedup_backup(backup_folder, job, pinned)
+    finally:
+        _unpin_chunks(pinned)
+
+def _dedup_backup(backup_folder, job, pinned):
+    chunk_store = get_chunk_store()
+    os.makedirs(chunk_store, exist_ok=True)
+    throttle = get_throttle()
+
+    previous = None
+    last_dedup_backup = get_last_backup_by_method('dedup', exclude=backup_folder, job_name=job['name'])
+    if last_dedup_backup:
+        with _chunk_store_lock:
+            # Пока манифест на месте, его блоки целы; закреплённые, они переживут удаление бэкапа
+            previous = load_manifest(last_dedup_backup)
+            if previous is not None:
+                for directory_info in previous['directories'].values():
+                    for entry in directory_info['files'].values():
+                        _pin_chunks(pinned, entry['chunks'])
+
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'method': 'dedup',
+        'directories': {},
+    }
+    files_total = 0
+    files_reused = 0
+    bytes_written = 0
+
+    for directory in job['directories']:
         directory_name = os.path.basename(os.path.normpath(directory))
-        for root, dirs, files in os.walk(directory):
-            for file in files:
+        previous_files = {}
+        if previous and directory_name in previous['directories']:
+            previous_files = previous['directories'][directory_name]['files']
+
+        files = {}
+        dirs = []
+        for root, subdirs, filenames in os.walk(directory):
+            for subdir in subdirs:
+                dirs.append(os.path.relpath(os.path.join(root, subdir), directory))
+            for file in filenames:
                 source_file = os.path.join(root, file)
                 rel_path = os.path.relpath(source_file, directory)
-                dest_file = os.path.join(backup_folder, directory_name, rel_path)
+                st = os.stat(source_file)
+                files_total += 1
+
+                # Неизменённый файл: берём список блоков из прошлого манифеста без чтения
+                old = previous_files.get(rel_path)
+                if old and old['size'] == st.st_size and old['mtime_ns'] == st.st_mtime_ns:
+                    files[rel_path] = dict(old, mode=st.st_mode & 0o7777)
+                    files_reused += 1
+                    continue
+
+                if throttle is not None:
+                    throttle.file()
+                chunks = []
+                for chunk in iter_chunks(source_file):
+                    if throttle is not None:
+                        throttle.data(len(chunk))
+                    digest, written = store_chunk(chunk_store, chunk, pinned)
+                    chunks.append(digest)
+                    bytes_written += written
+                files[rel_path] = {
+                    'size': st.st_size,
+                    'mtime_ns': st.st_mtime_ns,
+                    'mode': st.st_mode & 0o7777,
+                    'chunks': chunks,
+                }
+
+        manifest['directories'][directory_name] = {
+            'source': directory,
+            'files': files,
+            'dirs': dirs,
+        }
+
+    write_manifest(backup_folder, manifest)
+    logging.info(f"Бэкап с дедупликацией выполнен в {backup_folder}: файлов {files_total}, "
+                 f"без изменений {files_reused}, записано новых данных {bytes_written} байт")
+
+def scan_directory(directory):
+    """
+    Обходит дерево директории через os.scandir (без лишних stat для каталогов).
+    Для каждого каталога отдаёт его относительный путь и список записей-файлов.
+    """
+    stack = ['']
+    while stack:
+        rel_dir = stack.pop()
+        files = []
+        with os.scandir(os.path.join(directory, rel_dir)) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(os.path.join(rel_dir, entry.name))
+                elif entry.is_file():
+                    files.append(entry)
+        yield rel_dir, files
+
+class CopyStats:
+    """
+    Какими способами копировались файлы за один запуск (конвейер бэкапа или
+    восстановление). У каждого запуска свой счётчик: задания идут параллельно.
+    """
+
+    def __init__(self):
+        self.counts = Counter()
+        self.lock = threading.Lock()
+
+    def add(self, strategy):
+        with self.lock:
+            self.counts[strategy] += 1
+
+    def log(self, operation):
+        with self.lock:
+            if self.counts:
+                summary = ', '.join(f'{strategy}: {count}' for strategy, count in sorted(self.counts.items()))
+                logging.info(f"Способы копирования файлов ({operation}): {summary}")
+
+class TokenBucket:
+    """
+    Ограничитель скорости «ведро с токенами»: rate единиц в секунду, запас
+    не больше burst. Запрос сверх запаса выполняется в долг, и вызывающий
+    поток спит, пока долг не будет погашен, поэтому порции любого размера
+    дают заданную среднюю скорость.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or rate
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, amount):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+class Throttle:
+    """
+    Общие для всех заданий ограничения скорости бэкапа по байтам и по файлам.
+    """
+
+    def __init__(self, bytes_per_sec, files_per_sec):
+        self.bytes = TokenBucket(bytes_per_sec) if bytes_per_sec else None
+        self.files = TokenBucket(files_per_sec) if files_per_sec else None
+
+    def data(self, size):
+        if self.bytes is not None and size:
+            self.bytes.consume(size)
+
+    def file(self):
+        if self.files is not None:
+            self.files.consume(1)
+
+_throttle = None
+_throttle_lock = threading.Lock()
+
+def get_throttle():
+    """
+    Возвращает общий ограничитель скорости или None, если ограничений нет.
+    """
+    global _throttle
+    throttle_config = config['throttle']
+    if not throttle_config['bytes_per_sec'] and not throttle_config['files_per_sec']:
+        return None
+    with _throttle_lock:
+        if _throttle is None:
+            _throttle = Throttle(throttle_config['bytes_per_sec'], throttle_config['files_per_sec'])
+        return _throttle
+
+def _data_segments(fd, size):
+    """
+    Отдаёт участки файла с данными (смещение, длина), пропуская дыры
+    разреженного файла через SEEK_DATA/SEEK_HOLE.
+    """
+    if not hasattr(os, 'SEEK_DATA') or os.fstat(fd).st_blocks * 512 >= size:
+        yield 0, size
+        return
+    offset = 0
+    while offset < size:
+        try:
+            start = os.lseek(fd, offset, os.SEEK_DATA)
+        except OSError as e:
+            if e.errno == errno.ENXIO:  # дальше только дыра
+                return
+            raise
+        end = os.lseek(fd, start, os.SEEK_HOLE)
+        yield start, end - start
+        offset = end
+
+def _copy_range(src_fd, dst_fd, offset, length, strategy, throttle=None):
+    """
+    Копирует участок файла выбранным способом. Возвращает способ, которым
+    участок скопирован на самом деле (при ошибке переходит к следующему).
+    С ограничителем скорости участок копируется порциями по THROTTLE_STEP.
+    """
+    step = THROTTLE_STEP if throttle is not None else length
+    if strategy == 'copy_file_range':
+        try:
+            copied = 0
+            while copied < length:
+                n = os.copy_file_range(src_fd, dst_fd, min(step, length - copied),
+                                       offset + copied, offset + copied)
+                if n == 0:
+                    break
+                copied += n
+                if throttle is not None:
+                    throttle.data(n)
+            return strategy
+        except OSError:
+            # Ядро или пара файловых систем не поддерживают: пробуем sendfile
+            strategy = 'sendfile'
+    if strategy == 'sendfile':
+        try:
+            os.lseek(dst_fd, offset, os.SEEK_SET)
+            copied = 0
+            while copied < length:
+                n = os.sendfile(dst_fd, src_fd, offset + copied, min(step, length - copied))
+                if n == 0:
+                    break
+                copied += n
+                if throttle is not None:
+                    throttle.data(n)
+            return strategy
+        except OSError:
+            strategy = 'userspace'
+    copied = 0
+    while copied < length:
+        buffer = os.pread(src_fd, min(COPY_BUFFER_SIZE, length - copied), offset + copied)
+        if not buffer:
+            break
+        os.pwrite(dst_fd, buffer, offset + copied)
+        copied += len(buffer)
+        if throttle is not None:
+            throttle.data(len(buffer))
+    return 'userspace'
+
+def copy_file_data(source_file, dest_file, throttle=None):
+    """
+    Копирует содержимое файла с помощью ядра, пробуя по порядку: клонирование
+    (FICLONE) на CoW-системах, os.copy_file_range, os.sendfile и, в крайнем
+    случае, копирование через буфер. Дыры разреженных файлов сохраняются.
+    Клонирование не читает и не пишет данные, поэтому ограничитель скорости
+    по байтам его не учитывает. Возвращает название использованного способа.
+    """
+    with open(source_file, 'rb') as src, open(dest_file, 'wb') as dst:
+        src_fd, dst_fd = src.fileno(), dst.fileno()
+        if fcntl is not None:
+            try:
+                fcntl.ioctl(dst_fd, FICLONE, src_fd)
+                return 'reflink'
+            except OSError:
+                pass
+        size = os.fstat(src_fd).st_size
+        strategy = 'copy_file_range' if hasattr(os, 'copy_file_range') else 'sendfile'
+        if not hasattr(os, 'sendfile') and strategy == 'sendfile':
+            strategy = 'userspace'
+        sparse = False
+        for offset, length in _data_segments(src_fd, size):
+            if offset != 0 or length != size:
+                sparse = True
+            strategy = _copy_range(src_fd, dst_fd, offset, length, strategy, throttle)
+        # Длина файла с хвостовой дырой задаётся усечением
+        os.ftruncate(dst_fd, size)
+    return f'{strategy}+sparse' if sparse else strategy
+
+def copy_file_fast(source_file, dest_file, throttle=None, stats=None):
+    """
+    Аналог shutil.copy2 на основе copy_file_data: копирует данные и метаданные
+    и учитывает способ копирования в статистике запуска stats.
+    """
+    strategy = copy_file_data(source_file, dest_file, throttle)
+    shutil.copystat(source_file, dest_file)
+    if stats is not None:
+        stats.add(strategy)
+
+def hash_file(file_path, algorithm=None):
+    with open(file_path, 'rb') as f:
+        return hash_stream(f, algorithm)
+
+def hash_stream(fileobj, algorithm=None):
+    file_hash = hashlib.new(algorithm or config['hash_algorithm'])
+    while True:
+        buffer = fileobj.read(COPY_BUFFER_SIZE)
+        if not buffer:
+            break
+        file_hash.update(buffer)
+    return file_hash.hexdigest()
+
+def copy_file(source_file, dest_file, throttle=None, stats=None):
+    """
+    Копирует файл с метаданными и считает его контрольную сумму для
+    манифеста. Возвращает хеш или None, если hash_algorithm не задан.
+    """
+    copy_file_fast(source_file, dest_file, throttle, stats)
+    if not config['hash_algorithm']:
+        return None
+    # Хеш считаем по копии: её страницы уже в кеше, а источник мог измениться
+    return hash_file(dest_file)
+
+def _block_checksums(block):
+    # Слабая контрольная сумма (adler32, как в rsync) для быстрого поиска
+    # и сильная (blake2b-128) для подтверждения совпадения
+    return zlib.adler32(block), hashlib.blake2b(block, digest_size=16).digest()
+
+def load_signature(signature_path):
+    """
+    Загружает сигнатуру файла: размер блока и словарь
+    слабая сумма -> [(номер блока, сильная сумма), ...].
+    """
+    with open(signature_path, 'rb') as f:
+        if f.read(len(SIGNATURE_MAGIC)) != SIGNATURE_MAGIC:
+            raise ValueError(f"Неверный формат сигнатуры {signature_path}")
+        block_size, = struct.unpack('>Q', f.read(8))
+        blocks = {}
+        index = 0
+        while True:
+            record = f.read(20)
+            if len(record) < 20:
+                break
+            weak, strong = struct.unpack('>I', record[:4])[0], record[4:]
+            blocks.setdefault(weak, []).append((index, strong))
+            index += 1
+    return block_size, blocks
+
+def backup_large_file(source_file, dest_file, patch_path, signature_path, base_signature_path,
+                      throttle=None):
+    """
+    Сохраняет большой файл. Если есть сигнатура предыдущей версии, записывает
+    только патч: ссылки на совпавшие блоки базы и новые данные. Иначе копирует
+    файл целиком. В обоих случаях пишет сигнатуру новой версии, чтобы следующий
+    запуск мог построить дельту, не читая предыдущий бэкап.
+    Возвращает хеш файла, число записанных байт данных и признак дельты.
+    """
+    block_size = config['delta']['block_size']
+    base_blocks = None
+    if base_signature_path and os.path.exists(base_signature_path):
+        base_block_size, base_blocks = load_signature(base_signature_path)
+        if base_block_size != block_size:
+            base_blocks = None
+
+    algorithm = config['hash_algorithm']
+    file_hash = hashlib.new(algorithm) if algorithm else None
+    written = 0
+    os.makedirs(os.path.dirname(signature_path), exist_ok=True)
+    if base_blocks is not None:
+        os.makedirs(os.path.dirname(patch_path), exist_ok=True)
+        out = open(patch_path, 'wb')
+        out.write(PATCH_MAGIC + struct.pack('>Q', block_size))
+    else:
+        out = open(dest_file, 'wb')
+    try:
+        with open(source_file, 'rb') as src, open(signature_path, 'wb') as sig:
+            sig.write(SIGNATURE_MAGIC + struct.pack('>Q', block_size))
+            while True:
+                block = src.read(block_size)
+                if not block:
+                    break
+                if throttle is not None:
+                    throttle.data(len(block))
+                if file_hash is not None:
+                    file_hash.update(block)
+                weak, strong = _block_checksums(block)
+                sig.write(struct.pack('>I', weak) + strong)
+                if base_blocks is None:
+                    out.write(block)
+                    written += len(block)
+                    continue
+                match = None
+                if len(block) == block_size:
+                    for index, candidate in base_blocks.get(weak, ()):
+                        if candidate == strong:
+                            match = index
+                            break
+                if match is not None:
+                    out.write(b'C' + struct.pack('>Q', match))
+                else:
+                    out.write(b'L' + struct.pack('>I', len(block)) + block)
+                    written += len(block)
+            if base_blocks is not None:
+                out.write(b'E')
+    finally:
+        out.close()
+    if base_blocks is None:
+        shutil.copystat(source_file, dest_file)
+    return (file_hash.hexdigest() if file_hash else None), written, base_blocks is not None
+
+def apply_patch(base_path, patch_path, target):
+    """
+    Восстанавливает файл из базовой версии и патча.
+    """
+    with open(patch_path, 'rb') as patch, open(base_path, 'rb') as base, open(target, 'wb') as out:
+        if patch.read(len(PATCH_MAGIC)) != PATCH_MAGIC:
+            raise ValueError(f"Неверный формат патча {patch_path}")
+        block_size, = struct.unpack('>Q', patch.read(8))
+        while True:
+            op = patch.read(1)
+            if op == b'C':
+                index, = struct.unpack('>Q', patch.read(8))
+                base.seek(index * block_size)
+                out.write(base.read(block_size))
+            elif op == b'L':
+                length, = struct.unpack('>I', patch.read(4))
+                out.write(patch.read(length))
+            elif op == b'E':
+                break
+            else:
+                raise ValueError(f"Повреждённый патч {patch_path}")
+
+def delta_paths(backup_folder, directory_name, rel_path):
+    base = os.path.join(backup_folder, DELTA_DIR, directory_name, rel_path)
+    return base + '.patch', base + '.sig'
+
+class CopyPipeline:
+    """
+    Конвейер копирования: сканеры кладут задания в ограниченную очередь,
+    пул потоков-копировщиков забирает их и копирует файлы.
+    """
+
+    _STOP = object()
+
+    def __init__(self, workers, queue_depth, copy_function=copy_file, throttle=None):
+        self.copy_function = copy_function
+        self.throttle = throttle
+        self.stats = CopyStats()
+        self.queue = queue.Queue(maxsize=queue_depth)
+        self.threads = [threading.Thread(target=self._worker, name=f'backup-copy-{i}', daemon=True)
+                        for i in range(workers)]
+        self.lock = threading.Lock()
+        self.files_copied = 0
+        self.bytes_copied = 0
+        self.files_linked = 0
+        self.errors = []
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def make_dir(self, source_dir, dest_dir):
+        os.makedirs(dest_dir, exist_ok=True)
+
+    def submit(self, source_file, dest_file, manifest_entry, link_source=None, delta=None):
+        # Блокируется, если очередь заполнена: сканер не убегает вперёд копировщиков
+        self.queue.put((source_file, dest_file, manifest_entry, link_source, delta))
+
+    def close(self):
+        """
+        Дожидается завершения всех заданий и останавливает потоки.
+        """
+        for _ in self.threads:
+            self.queue.put(self._STOP)
+        for thread in self.threads:
+            thread.join()
+        if self.errors:
+            raise RuntimeError(f"Не удалось скопировать файлов: {len(self.errors)}; "
+                               f"первая ошибка: {self.errors[0]}")
+
+    def _worker(self):
+        while True:
+            task = self.queue.get()
+            if task is self._STOP:
+                return
+            source_file, dest_file, manifest_entry, link_source, delta = task
+            if self.throttle is not None:
+                self.throttle.file()
+            if delta:
+                try:
+                    manifest_entry['hash'], written, is_delta = backup_large_file(
+                        source_file, dest_file, delta['patch'], delta['signature'],
+                        delta['base_signature'], self.throttle)
+                except Exception as e:
+                    logging.error(f"Ошибка сохранения {source_file}: {e}")
+                    with self.lock:
+                        self.errors.append(f"{source_file}: {e}")
+                    continue
+                if not is_delta:
+                    manifest_entry.pop('delta_base', None)
+                with self.lock:
+                    self.files_copied += 1
+                    self.bytes_copied += written
+                continue
+            if link_source:
+                try:
+                    os.link(link_source, dest_file)
+                    with self.lock:
+                        self.files_linked += 1
+                    continue
+                except OSError as e:
+                    # Другая файловая система, предел ссылок или копия пропала: копируем файл
+                    logging.warning(f"Не удалось создать жёсткую ссылку на {link_source}: {e}")
+            try:
+                manifest_entry['hash'] = self.copy_function(source_file, dest_file, self.throttle, self.stats)
+            except Exception as e:
+                logging.error(f"Ошибка копирования {source_file}: {e}")
+                with self.lock:
+                    self.errors.append(f"{source_file}: {e}")
+                continue
+            with self.lock:
+                self.files_copied += 1
+                self.bytes_copied += manifest_entry['size']
+
+def _compress_chunk(data, compression, level):
+    # Выполняется в отдельном процессе. Каждый фрагмент — самостоятельный поток
+    # gzip/xz; их конкатенация читается обычными tar/gzip/xz.
+    if compression == 'xz':
+        return lzma.compress(data, format=lzma.FORMAT_XZ, preset=level)
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+def _decompress_chunk(data, compression):
+    if compression == 'xz':
+        return lzma.decompress(data, format=lzma.FORMAT_XZ)
+    return gzip.decompress(data)
+
+class _HashingReader:
+    """
+    Обёртка над файлом, считающая контрольную сумму прочитанных данных
+    и ограничивающая скорость чтения.
+    """
+
+    def __init__(self, fileobj, algorithm, throttle=None):
+        self.fileobj = fileobj
+        self.hash = hashlib.new(algorithm) if algorithm else None
+        self.throttle = throttle
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        if self.throttle is not None:
+            self.throttle.data(len(data))
+        if self.hash is not None:
+            self.hash.update(data)
+        return data
+
+class ChunkedCompressor(io.RawIOBase):
+    """
+    Файлоподобный приёмник tar-потока. Поток режется на фрагменты chunk_size,
+    которые сжимаются параллельно в пуле процессов и дописываются в архив
+    строго по порядку. Для каждого фрагмента запоминается его смещение
+    в несжатом потоке и в файле архива — это индекс для произвольного доступа.
+    """
+
+    def __init__(self, output, compression, level, workers, chunk_size):
+        self.output = output
+        self.compression = compression
+        self.level = level
+        self.chunk_size = chunk_size
+        # Процесс уже многопоточный (сканеры, копировщики, планировщик, watchdog): fork
+        # унаследовал бы чужие захваченные блокировки, в том числе блокировку logging
+        start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        self.executor = ProcessPoolExecutor(max_workers=workers,
+                                            mp_context=multiprocessing.get_context(start_method))
+        self.max_pending = workers * 2
+        self.pending = []
+        self.buffer = bytearray()
+        self.position = 0
+        self.flushed_offset = 0
+        self.compressed_offset = 0
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def write(self, data):
+        self.buffer += data
+        self.position += len(data)
+        while len(self.buffer) >= self.chunk_size:
+            self._submit(bytes(self.buffer[:self.chunk_size]))
+            del self.buffer[:self.chunk_size]
+        return len(data)
+
+    def _submit(self, data):
+        future = self.executor.submit(_compress_chunk, data, self.compression, self.level)
+        self.pending.append((len(data), future))
+        # Ограничиваем число фрагментов в памяти
+        while len(self.pending) > self.max_pending:
+            self._write_oldest()
+
+    def _write_oldest(self):
+        size, future = self.pending.pop(0)
+        compressed = future.result()
+        self.output.write(compressed)
+        self.chunks.append([self.flushed_offset, size, self.compressed_offset, len(compressed)])
+        self.flushed_offset += size
+        self.compressed_offset += len(compressed)
+
+    def finish(self):
+        if self.buffer:
+            self._submit(bytes(self.buffer))
+            self.buffer.clear()
+        while self.pending:
+            self._write_oldest()
+        self.executor.shutdown()
+        return self.chunks
+
+class ArchivePipeline:
+    """
+    Приёмник конвейера, который вместо копирования файлов пишет их
+    в потоковый tar-архив с многопроцессным сжатием. Интерфейс совпадает
+    с CopyPipeline, сканеры работают с ним так же.
+    """
+
+    _STOP = object()
+
+    def __init__(self, backup_folder, queue_depth, throttle=None):
+        archive_config = config['archive']
+        self.backup_folder = backup_folder
+        self.throttle = throttle
+        self.compression = archive_config['compression']
+        self.archive_path = os.path.join(
+            backup_folder, f"archive.{ARCHIVE_EXTENSIONS[self.compression]}")
+        self.output = open(self.archive_path, 'wb')
+        self.compressor = ChunkedCompressor(self.output, self.compression, archive_config['level'],
+                                            archive_config['workers'], archive_config['chunk_size'])
+        self.tar = tarfile.open(fileobj=self.compressor, mode='w|', format=tarfile.PAX_FORMAT,
+                                dereference=True)
+        self.queue = queue.Queue(maxsize=queue_depth)
+        self.thread = threading.Thread(target=self._writer, name='backup-archive', daemon=True)
+        self.members = {}
+        self.files_copied = 0
+        self.bytes_copied = 0
+        self.files_linked = 0
+        self.errors = []
+
+    def start(self):
+        self.thread.start()
+
+    def make_dir(self, source_dir, dest_dir):
+        self.queue.put((source_dir, dest_dir, None))
 
-                last_backup_file = os.path.join(last_backup, directory_name, rel_path)
-                if not os.path.exists(last_backup_file) or os.path.getmtime(source_file) > os.path.getmtime(last_backup_file):
-                    os.makedirs(os.path.dirname(dest_file), exist_ok=True)
-                    shutil.copy2(source_file, dest_file)
-    logging.info(f"Инкрементальный бэкап выполнен в {backup_folder}")
+    def submit(self, source_file, dest_file, manifest_entry, link_source=None, delta=None):
+        self.queue.put((source_file, dest_file, manifest_entry))
 
-def differential_backup(backup_folder):
-    last_full_backup = get_last_full_backup()
+    def close(self):
+        self.queue.put(self._STOP)
+        self.thread.join()
+        self.tar.close()
+        chunks = self.compressor.finish()
+        self.output.close()
+        index = {
+            'compression': self.compression,
+            'chunks': chunks,
+            'members': self.members,
+        }
+        with gzip.open(os.path.join(self.backup_folder, ARCHIVE_INDEX_NAME), 'wt', encoding='utf-8') as f:
+            json.dump(index, f, ensure_ascii=False, separators=(',', ':'))
+        if self.errors:
+            raise RuntimeError(f"Не удалось заархивировать файлов: {len(self.errors)}; "
+                               f"первая ошибка: {self.errors[0]}")
+
+    def _writer(self):
+        while True:
+            task = self.queue.get()
+            if task is self._STOP:
+                return
+            source_path, dest_path, manifest_entry = task
+            arcname = os.path.relpath(dest_path, self.backup_folder)
+            try:
+                tarinfo = self.tar.gettarinfo(source_path, arcname)
+                # Как и shutil.copy2, сохраняем время модификации с точностью до наносекунд
+                mtime_ns = os.stat(source_path).st_mtime_ns
+                tarinfo.mtime = mtime_ns / 1e9
+                tarinfo.pax_headers['mtime'] = f'{mtime_ns // 10**9}.{mtime_ns % 10**9:09d}'
+                header_offset = self.tar.offset
+                if tarinfo.isdir():
+                    self.tar.addfile(tarinfo)
+                else:
+                    if self.throttle is not None:
+                        self.throttle.file()
+                    with open(source_path, 'rb') as f:
+                        reader = _HashingReader(f, config['hash_algorithm'], self.throttle)
+                        self.tar.addfile(tarinfo, reader)
+                    if reader.hash is not None:
+                        manifest_entry['hash'] = reader.hash.hexdigest()
+                    self.files_copied += 1
+                    self.bytes_copied += tarinfo.size
+                self.members[arcname] = [header_offset, tarinfo.size]
+            except Exception as e:
+                logging.error(f"Ошибка архивирования {source_path}: {e}")
+                self.errors.append(f"{source_path}: {e}")
+
+def archive_file_path(backup_folder):
+    for extension in ARCHIVE_EXTENSIONS.values():
+        path = os.path.join(backup_folder, f'archive.{extension}')
+        if os.path.exists(path):
+            return path
+    return os.path.join(backup_folder, f"archive.{ARCHIVE_EXTENSIONS['gzip']}")
+
+def _tar_mtime_ns(tarinfo):
+    mtime = tarinfo.pax_headers.get('mtime')
+    if mtime and '.' in mtime:
+        seconds, fraction = mtime.split('.', 1)
+        return int(seconds) * 10**9 + int(fraction[:9].ljust(9, '0'))
+    return int(tarinfo.mtime * 10**9)
+
+class ArchiveReader(io.RawIOBase):
+    """
+    Чтение несжатого tar-потока архива по индексу: при seek/read
+    распаковываются только фрагменты, покрывающие запрошенный диапазон.
+    """
+
+    def __init__(self, backup_folder):
+        with gzip.open(os.path.join(backup_folder, ARCHIVE_INDEX_NAME), 'rt', encoding='utf-8') as f:
+            self.index = json.load(f)
+        self.compression = self.index['compression']
+        self.chunks = self.index['chunks']
+        self.members = self.index['members']
+        self.archive = open(os.path.join(
+            backup_folder, f"archive.{ARCHIVE_EXTENSIONS[self.compression]}"), 'rb')
+        self.size = sum(chunk[1] for chunk in self.chunks)
+        self.position = 0
+        self.cached_chunk = None
+        self.cached_data = b''
+        self.chunks_read = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self.position = offset
+        return self.position
+
+    def _load_chunk(self, number):
+        if self.cached_chunk != number:
+            _, _, compressed_offset, compressed_size = self.chunks[number]
+            self.archive.seek(compressed_offset)
+            self.cached_data = _decompress_chunk(self.archive.read(compressed_size), self.compression)
+            self.cached_chunk = number
+            self.chunks_read += 1
+        return self.cached_data
+
+    def _find_chunk(self, position):
+        low, high = 0, len(self.chunks) - 1
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.chunks[middle][0] <= position:
+                low = middle
+            else:
+                high = middle - 1
+        return low
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.size - self.position
+        result = bytearray()
+        while size > 0 and self.position < self.size:
+            number = self._find_chunk(self.position)
+            start = self.chunks[number][0]
+            data = self._load_chunk(number)
+            piece = data[self.position - start:self.position - start + size]
+            result += piece
+            self.position += len(piece)
+            size -= len(piece)
+        return bytes(result)
+
+    def close(self):
+        self.archive.close()
+        super().close()
+
+class ArchiveExtractor:
+    """
+    Извлечение отдельных файлов из архива бэкапа по индексу.
+    """
+
+    def __init__(self, backup_folder):
+        self.backup_folder = backup_folder
+        self.reader = ArchiveReader(backup_folder)
+        self.tar = tarfile.open(fileobj=self.reader, mode='r:')
+
+    def open(self, name):
+        """
+        Возвращает описание члена архива и файловый объект для чтения его содержимого.
+        """
+        header_offset = self.reader.members[name][0]
+        self.reader.seek(header_offset)
+        self.tar.offset = header_offset
+        tarinfo = tarfile.TarInfo.fromtarfile(self.tar)
+        return tarinfo, self.tar.extractfile(tarinfo)
+
+    def extract(self, name, target):
+        tarinfo, member = self.open(name)
+        with member as src, open(target, 'wb') as dst:
+            shutil.copyfileobj(src, dst, COPY_BUFFER_SIZE)
+        os.chmod(target, tarinfo.mode)
+        mtime_ns = _tar_mtime_ns(tarinfo)
+        os.utime(target, ns=(mtime_ns, mtime_ns))
+
+    def close(self):
+        logging.info(f"Из архива {self.backup_folder} распаковано фрагментов: "
+                     f"{self.reader.chunks_read} из {len(self.reader.chunks)}")
+        self.reader.close()
+
+def _plan_file(directory_name, rel_path, st, previous_entry, backup_folder, link_dest, use_delta):
+    """
+    Решает, что делать с файлом источника. Возвращает запись манифеста и
+    задание для конвейера (link_source, delta) или None, если файл не изменился
+    относительно previous_entry и копировать его не нужно.
+    """
+    backup_folder_name = os.path.basename(backup_folder)
+    if (previous_entry and previous_entry['size'] == st.st_size and
+            previous_entry['mtime_ns'] == st.st_mtime_ns and
+            previous_entry['inode'] == st.st_ino):
+        if link_dest is None:
+            return previous_entry, None
+        # Связанная копия — целый файл: дельта и сигнатура предыдущего снимка к ней не относятся
+        manifest_entry = {key: value for key, value in previous_entry.items()
+                          if key not in ('signature', 'delta_base')}
+        manifest_entry['origin'] = backup_folder_name
+        return manifest_entry, (os.path.join(link_dest, directory_name, rel_path), None)
+
+    manifest_entry = {
+        'size': st.st_size,
+        'mtime_ns': st.st_mtime_ns,
+        'inode': st.st_ino,
+        'hash': None,
+        'origin': backup_folder_name,
+    }
+    delta = None
+    threshold = config['delta']['threshold']
+    if use_delta and threshold is not None and st.st_size >= threshold:
+        patch_path, signature_path = delta_paths(backup_folder, directory_name, rel_path)
+        delta = {'patch': patch_path, 'signature': signature_path, 'base_signature': None}
+        manifest_entry['signature'] = backup_folder_name
+        manifest_entry['mode'] = st.st_mode & 0o7777
+        if previous_entry and previous_entry.get('signature'):
+            delta['base_signature'] = delta_paths(
+                os.path.join(config['backup_destination'], previous_entry['signature']),
+                directory_name, rel_path)[1]
+            # Базой дельты служит версия файла, записанная в манифесте папки origin
+            manifest_entry['delta_base'] = previous_entry['origin']
+    return manifest_entry, (None, delta)
+
+def _scan_into_pipeline(pipeline, directory, backup_folder, baseline, create_empty_dirs,
+                        link_dest=None, use_delta=False):
+    """
+    Сканирует одну директорию и возвращает её раздел манифеста. Файл копируется,
+    если его размер, mtime или inode отличаются от записи в манифесте baseline;
+    иначе запись переносится из baseline вместе с папкой, где лежит копия (origin).
+    Если задан link_dest (полный снимок), неизменённые файлы не пропускаются,
+    а связываются жёсткой ссылкой с копией в link_dest.
+    При use_delta большие файлы сохраняются блочной дельтой к предыдущей версии.
+    """
+    directory_name = os.path.basename(os.path.normpath(directory))
+    previous_files = {}
+    if baseline and directory_name in baseline['directories']:
+        previous_files = baseline['directories'][directory_name]['files']
+
+    files = {}
+    dirs = []
+    for rel_dir, entries in scan_directory(directory):
+        if rel_dir:
+            dirs.append(rel_dir)
+        selected = []
+        for entry in entries:
+            rel_path = os.path.join(rel_dir, entry.name)
+            manifest_entry, task = _plan_file(directory_name, rel_path, entry.stat(),
+                                              previous_files.get(rel_path), backup_folder,
+                                              link_dest, use_delta)
+            files[rel_path] = manifest_entry
+            if task is not None:
+                selected.append((entry, manifest_entry) + task)
+        if not selected and not create_empty_dirs:
+            continue
+        # Каталог назначения создаётся один раз для всех его файлов
+        dest_dir = os.path.join(backup_folder, directory_name, rel_dir)
+        pipeline.make_dir(os.path.join(directory, rel_dir), dest_dir)
+        for entry, manifest_entry, link_source, delta in selected:
+            pipeline.submit(entry.path, os.path.join(dest_dir, entry.name), manifest_entry,
+                            link_source, delta)
+
+    return directory_name, {'source': directory, 'files': files, 'dirs': dirs}
+
+def _scan_changes_into_pipeline(pipeline, directory, backup_folder, baseline, changed_paths,
+                                use_delta=False):
+    """
+    Как _scan_into_pipeline, но вместо обхода всего дерева берёт состояние
+    из манифеста baseline и перепроверяет только пути из журнала изменений.
+    Изменённый каталог (создан, перемещён, удалён) пересканируется целиком.
+    """
+    directory_name = os.path.basename(os.path.normpath(directory))
+    previous = baseline['directories'][directory_name]
+    previous_files = previous['files']
+    files = dict(previous_files)
+    dirs = set(previous['dirs'])
+
+    # Сначала убираем всё, что лежало по изменённым путям, затем добавляем то, что есть на диске
+    prefixes = tuple(rel_path + os.sep for rel_path in changed_paths)
+    for rel_path in changed_paths:
+        files.pop(rel_path, None)
+        dirs.discard(rel_path)
+    if prefixes:
+        files = {rel_path: entry for rel_path, entry in files.items() if not rel_path.startswith(prefixes)}
+        dirs = {rel_dir for rel_dir in dirs if not rel_dir.startswith(prefixes)}
+
+    created_dirs = set()
+
+    def submit(rel_path, source_file, st):
+        manifest_entry, task = _plan_file(directory_name, rel_path, st, previous_files.get(rel_path),
+                                          backup_folder, None, use_delta)
+        files[rel_path] = manifest_entry
+        if task is None:
+            return
+        rel_dir = os.path.dirname(rel_path)
+        dest_dir = os.path.join(backup_folder, directory_name, rel_dir)
+        if rel_dir not in created_dirs:
+            pipeline.make_dir(os.path.join(directory, rel_dir), dest_dir)
+            created_dirs.add(rel_dir)
+        pipeline.submit(source_file, os.path.join(dest_dir, os.path.basename(rel_path)),
+                        manifest_entry, *task)
+
+    scanned_dirs = ()
+    for rel_path in sorted(changed_paths):
+        # Путь внутри уже пересканированного каталога обработан вместе с ним
+        if rel_path.startswith(scanned_dirs):
+            continue
+        source_path = os.path.join(directory, rel_path)
+        try:
+            st = os.stat(source_path)
+        except FileNotFoundError:
+            continue
+        if os.path.isfile(source_path):
+            submit(rel_path, source_path, st)
+        elif os.path.isdir(source_path):
+            scanned_dirs += (rel_path + os.sep,)
+            dirs.add(rel_path)
+            for rel_dir, entries in scan_directory(source_path):
+                if rel_dir:
+                    dirs.add(os.path.join(rel_path, rel_dir))
+                for entry in entries:
+                    submit(os.path.join(rel_path, rel_dir, entry.name), entry.path, entry.stat())
+        # Родительские каталоги нового пути тоже должны быть в манифесте
+        parent = os.path.dirname(rel_path)
+        while parent and parent not in dirs and os.path.isdir(os.path.join(directory, parent)):
+            dirs.add(parent)
+            parent = os.path.dirname(parent)
+
+    return directory_name, {'source': directory, 'files': files, 'dirs': sorted(dirs)}
+
+def run_copy_pipeline(backup_folder, method, baseline=None, link_dest=None, changes=None,
+                      directories=None):
+    """
+    Параллельно сканирует директории directories (по умолчанию все из backup_directories), копирует
+    в backup_folder изменившиеся относительно манифеста baseline файлы
+    (все файлы, если baseline нет) и записывает манифест нового бэкапа.
+    Если задан changes (имя директории -> изменённые относительные пути из
+    журнала), директории из baseline не сканируются, а проверяются только эти пути.
+    Возвращает число скопированных файлов и байт.
+    """
+    if directories is None:
+        directories = get_backup_paths()
+    parallel_config = config['parallel']
+    throttle = get_throttle()
+    # Снимок всегда пишется деревом: следующему снимку нужны файлы для жёстких ссылок
+    if config['output_format'] == 'archive' and method != 'snapshot':
+        pipeline = ArchivePipeline(backup_folder, parallel_config['queue_depth'], throttle)
+    else:
+        pipeline = CopyPipeline(parallel_config['workers'], parallel_config['queue_depth'],
+                                throttle=throttle)
+    # Дельты имеют смысл только для копий в папках: в архиве и снимке (включая первый,
+    # от которого связываются следующие) файл должен быть целиком
+    use_delta = isinstance(pipeline, CopyPipeline) and method != 'snapshot'
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'method': method,
+        'hash_algorithm': config['hash_algorithm'],
+        'directories': {},
+    }
+    pipeline.start()
+    try:
+        with ThreadPoolExecutor(max_workers=parallel_config['scanners'],
+                                thread_name_prefix='backup-scan') as scanners:
+            futures = []
+            for directory in directories:
+                directory_name = os.path.basename(os.path.normpath(directory))
+                if changes is not None and baseline and directory_name in baseline['directories']:
+                    futures.append(scanners.submit(
+                        _scan_changes_into_pipeline, pipeline, directory, backup_folder, baseline,
+                        changes.get(directory_name, set()), use_delta))
+                else:
+                    futures.append(scanners.submit(
+                        _scan_into_pipeline, pipeline, directory, backup_folder, baseline,
+                        baseline is None or link_dest is not None, link_dest, use_delta))
+            for future in futures:
+                directory_name, directory_manifest = future.result()
+                manifest['directories'][directory_name] = directory_manifest
+    finally:
+        pipeline.close()
+    write_manifest(backup_folder, manifest)
+    if isinstance(pipeline, CopyPipeline):
+        pipeline.stats.log('бэкап')
+    if link_dest is not None:
+        logging.info(f"Жёстких ссылок на {link_dest} создано: {pipeline.files_linked}")
+    return pipeline.files_copied, pipeline.bytes_copied
+
+def load_baseline(backup_folder):
+    """
+    Загружает манифест бэкапа, относительно которого ищутся изменения.
+    Бэкапы без манифеста (созданные старыми версиями) или с дедупликацией
+    не годятся как база: тогда копируются все файлы.
+    """
+    manifest = load_manifest(backup_folder)
+    if manifest is None or manifest['method'] not in ('full', 'incremental', 'differential', 'snapshot'):
+        logging.warning(f"В бэкапе {backup_folder} нет подходящего манифеста, будут скопированы все файлы.")
+        return None
+    return manifest
+
+def full_backup(backup_folder, job=None):
+    job = job or default_job()
+    files, size = run_copy_pipeline(backup_folder, 'full', directories=job['directories'])
+    logging.info(f"Полный бэкап выполнен в {backup_folder}: файлов {files}, байт {size}")
+
+def incremental_backup(backup_folder, changes=None, job=None):
+    job = job or default_job()
+    last_backup = get_last_backup(exclude=backup_folder, job_name=job['name'])
+    if not last_backup:
+        # Если предыдущих бэкапов нет, выполнить полный бэкап
+        full_backup(backup_folder, job)
+        return
+
+    # Манифест последнего бэкапа описывает всё дерево, а не только скопированные в него файлы
+    baseline = load_baseline(last_backup)
+    if changes is not None and baseline is not None:
+        logging.info(f"Инкрементальный бэкап по журналу изменений: путей "
+                     f"{sum(len(paths) for paths in changes.values())}")
+    files, size = run_copy_pipeline(backup_folder, 'incremental', baseline, changes=changes,
+                                    directories=job['directories'])
+    logging.info(f"Инкрементальный бэкап выполнен в {backup_folder}: файлов {files}, байт {size}")
+
+def differential_backup(backup_folder, job=None):
+    job = job or default_job()
+    last_full_backup = get_last_full_backup(exclude=backup_folder, job_name=job['name'])
     if not last_full_backup:
         # Если предыдущих полных бэкапов нет, выполнить полный бэкап
-        full_backup(backup_folder)
+        full_backup(backup_folder, job)
         return
 
-    for directory in config['backup_directories']:
-        directory_name = os.path.basename(os.path.normpath(directory))
-        for root, dirs, files in os.walk(directory):
-            for file in files:
-                source_file = os.path.join(root, file)
-                rel_path = os.path.relpath(source_file, directory)
-                dest_file = os.path.join(backup_folder, directory_name, rel_path)
+    files, size = run_copy_pipeline(backup_folder, 'differential', load_baseline(last_full_backup),
+                                    directories=job['directories'])
+    logging.info(f"Дифференциальный бэкап выполнен в {backup_folder}: файлов {files}, байт {size}")
+
+def snapshot_backup(backup_folder, job=None):
+    """
+    Снимок в стиле rsync --link-dest: неизменённые файлы связываются жёсткими
+    ссылками с предыдущим снимком, изменённые копируются. Каждая папка снимка
+    содержит полное дерево и восстанавливается и удаляется независимо от других.
+    """
+    job = job or default_job()
+    last_snapshot = get_last_backup_by_method('snapshot', exclude=backup_folder, job_name=job['name'])
+    if not last_snapshot:
+        files, size = run_copy_pipeline(backup_folder, 'snapshot', directories=job['directories'])
+    else:
+        files, size = run_copy_pipeline(backup_folder, 'snapshot', load_baseline(last_snapshot),
+                                        link_dest=last_snapshot, directories=job['directories'])
+    logging.info(f"Снимок выполнен в {backup_folder}: скопировано файлов {files}, байт {size}")
+
+class ChangeJournal:
+    """
+    Журнал изменённых путей между запусками бэкапа в режиме --daemon.
+    Пути дописываются в файл в backup_destination; перед бэкапом журнал
+    забирается (take) и начинается новый, а после успешного бэкапа
+    забранная часть удаляется (done). Если журнал переполнен или велся
+    не с момента последнего бэкапа, take сообщает о необходимости полного сканирования.
+    """
 
-                last_full_backup_file = os.path.join(last_full_backup, directory_name, rel_path)
-                if not os.path.exists(last_full_backup_file) or os.path.getmtime(source_file) > os.path.getmtime(last_full_backup_file):
-                    os.makedirs(os.path.dirname(dest_file), exist_ok=True)
-                    shutil.copy2(source_file, dest_file)
-    logging.info(f"Дифференциальный бэкап выполнен в {backup_folder}")
+    FULL_SCAN = '#FULL_SCAN'
+    OVERFLOW = '#OVERFLOW'
 
-def perform_backup():
+    def __init__(self, path, max_entries, directories=None):
+        self.path = path
+        self.processing_path = path + '.processing'
+        self.max_entries = max_entries
+        self.directories = directories if directories is not None else get_backup_paths()
+        self.lock = threading.Lock()
+        self.file = None
+        self.paths = set()
+        self.overflowed = False
+
+    def start(self):
+        """
+        Начинает новый журнал. Пока демон не работал, изменения не записывались,
+        поэтому первый бэкап после запуска всегда сканирует директории полностью.
+        """
+        with self.lock:
+            for path in (self.path, self.processing_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            self._open()
+            self.file.write(self.FULL_SCAN + '\n')
+            self.file.flush()
+
+    def _open(self):
+        self.file = open(self.path, 'a', encoding='utf-8', errors='surrogateescape')
+        self.paths = set()
+        self.overflowed = False
+
+    def record(self, path):
+        with self.lock:
+            if self.overflowed or path in self.paths:
+                return
+            if len(self.paths) >= self.max_entries:
+                self.file.write(self.OVERFLOW + '\n')
+                self.overflowed = True
+                self.paths.clear()
+            else:
+                self.file.write(path + '\n')
+                self.paths.add(path)
+            self.file.flush()
+
+    def sync(self):
+        with self.lock:
+            if self.file:
+                os.fsync(self.file.fileno())
+
+    def take(self):
+        """
+        Забирает накопленные изменения и начинает новый журнал. Возвращает
+        словарь имя директории -> множество относительных путей либо None,
+        если нужно полное сканирование.
+        """
+        with self.lock:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+            if os.path.exists(self.processing_path):
+                # Предыдущий бэкап не завершился: объединяем его пути с новыми
+                with open(self.processing_path, 'a', encoding='utf-8', errors='surrogateescape') as dst, \
+                        open(self.path, encoding='utf-8', errors='surrogateescape') as src:
+                    shutil.copyfileobj(src, dst)
+                os.remove(self.path)
+            else:
+                os.replace(self.path, self.processing_path)
+            self._open()
+
+        directories = {os.path.normpath(directory): os.path.basename(os.path.normpath(directory))
+                       for directory in self.directories}
+        changes = {name: set() for name in directories.values()}
+        with open(self.processing_path, encoding='utf-8', errors='surrogateescape') as f:
+            for line in f:
+                path = line.rstrip('\n')
+                if path in (self.FULL_SCAN, self.OVERFLOW):
+                    return None
+                for directory, name in directories.items():
+                    if path.startswith(directory + os.sep):
+                        changes[name].add(os.path.relpath(path, directory))
+                        break
+                    if path == directory:
+                        # Изменился сам корень (например, переименован): нужен полный обход
+                        return None
+        return changes
+
+    def done(self):
+        if os.path.exists(self.processing_path):
+            os.remove(self.processing_path)
+
+    def close(self):
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+
+class JournalEventHandler(FileSystemEventHandler):
+    """
+    Записывает в журнал пути, затронутые событиями файловой системы.
+    """
+
+    def __init__(self, journal):
+        super().__init__()
+        self.journal = journal
+        self.ignored_prefix = os.path.normpath(config['backup_destination']) + os.sep
+
+    def on_any_event(self, event):
+        if event.event_type not in ('created', 'modified', 'deleted', 'moved'):
+            return
+        # Изменение каталога (mtime) без изменения его состава не требует пересканирования
+        if event.is_directory and event.event_type == 'modified':
+            return
+        for path in (event.src_path, getattr(event, 'dest_path', '')):
+            if path and not path.startswith(self.ignored_prefix):
+                self.journal.record(os.path.normpath(path))
+
+def perform_backup(journal=None, job=None):
+    """
+    Выполняет бэкап задания job (по умолчанию — всех директорий методом из
+    config). Если передан журнал изменений (режим --daemon) и метод
+    инкрементальный, проверяются только пути из журнала; иначе, а также при
+    переполнении или потере журнала, директории сканируются полностью.
+    """
+    job = job or default_job()
+    changes = None
+    if journal is not None:
+        changes = journal.take()
+        if changes is None:
+            logging.info("Журнал изменений неполон, выполняется полное сканирование.")
     try:
-        backup_method = config['backup_method']
+        backup_method = job['method']
         backup_dest = config['backup_destination']
         timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-        backup_folder_name = f'backup_{timestamp}_{backup_method}'
-        backup_folder = os.path.join(backup_dest, backup_folder_name)
+        folder_name = backup_folder_name(timestamp, backup_method, job['name'])
+        backup_folder = os.path.join(backup_dest, folder_name)
 
         os.makedirs(backup_folder, exist_ok=True)
 
         if backup_method == 'full':
-            full_backup(backup_folder)
+            full_backup(backup_folder, job)
         elif backup_method == 'incremental':
-            incremental_backup(backup_folder)
+            incremental_backup(backup_folder, changes, job)
         elif backup_method == 'differential':
-            differential_backup(backup_folder)
+            differential_backup(backup_folder, job)
+        elif backup_method == 'dedup':
+            dedup_backup(backup_folder, job)
+        elif backup_method == 'snapshot':
+            snapshot_backup(backup_folder, job)
         else:
             # По умолчанию выполняем полный бэкап
-            full_backup(backup_folder)
+            full_backup(backup_folder, job)
 
         logging.info(f'Успешно выполнен {backup_method} бэкап.')
+        record_backup(folder_name, backup_method, job['name'])
+        if journal is not None:
+            journal.done()
     except Exception as e:
         logging.error(f'Ошибка во время выполнения бэкапа: {str(e)}')
+        return
+
+    if config['retention']['enabled']:
+        try:
+            apply_retention([job['name']])
+        except Exception as e:
+            logging.error(f'Ошибка применения политики хранения: {str(e)}')
+
+# Состояние заданий планировщика: выполняется ли задание и ждёт ли повторного запуска
+_job_states = {}
+_job_states_lock = threading.Lock()
 
-def restore_backup():
+def run_backup_job(job, journal=None):
+    """
+    Запускает задание из планировщика. Запуск, пришедшийся на время работы
+    того же задания, не выполняется параллельно, а сливается с ним: после
+    окончания текущего выполняется ровно один повторный запуск, сколько бы
+    срабатываний ни пришлось на это время.
+    """
+    label = job['name'] or 'общее'
+    with _job_states_lock:
+        state = _job_states.setdefault(job['name'], {'running': False, 'pending': False})
+        if state['running']:
+            state['pending'] = True
+            logging.info(f"Задание {label} ещё выполняется, запуск объединён с текущим")
+            return
+        state['running'] = True
+    while True:
+        try:
+            perform_backup(journal, job)
+        finally:
+            with _job_states_lock:
+                rerun = state['pending']
+                state['pending'] = False
+                state['running'] = rerun
+        if not rerun:
+            return
+        logging.info(f"Задание {label}: повторный запуск для объединённых срабатываний")
+
+def run_all_jobs():
+    """
+    Немедленно выполняет все задания, не больше max_concurrent_jobs одновременно.
+    """
+    with ThreadPoolExecutor(max_workers=config['scheduler']['max_concurrent_jobs'],
+                            thread_name_prefix='backup-job') as executor:
+        for future in [executor.submit(run_backup_job, job) for job in get_backup_jobs()]:
+            future.result()
+
+def get_backup_chain(backup_folder):
+    """
+    Возвращает цепочку папок, необходимых для восстановления бэкапа без
+    манифеста: базовый полный бэкап, затем (для incremental) все бэкапы
+    между ним и выбранным, либо (для differential) только выбранный.
+    """
+    backup_dest = config['backup_destination']
+    name = os.path.basename(backup_folder)
+    method = name.rsplit('_', 1)[-1]
+    if method not in ('incremental', 'differential'):
+        return [backup_folder]
+    earlier = sorted(d for d in os.listdir(backup_dest)
+                     if os.path.isdir(os.path.join(backup_dest, d)) and
+                     d.startswith('backup_') and d < name)
+    fulls = [i for i, d in enumerate(earlier) if d.endswith('_full')]
+    # Без полного бэкапа цепочка начинается с самого первого: он был выполнен как полный
+    base = fulls[-1] if fulls else 0
+    if method == 'differential':
+        chain = earlier[base:base + 1]
+    else:
+        chain = earlier[base:]
+    return [os.path.join(backup_dest, d) for d in chain] + [backup_folder]
+
+def _entry_source(directory_name, rel_path, entry, manifests, archive_origins):
+    """
+    Определяет, откуда взять содержимое файла по записи манифеста: копия
+    в папке origin, член архива или патч к версии из манифеста delta_base.
+    """
+    backup_dest = config['backup_destination']
+    source = {'size': entry['size'], 'mtime_ns': entry['mtime_ns']}
+    # Манифест описывает всё дерево: каждый файл берём из папки, где лежит его копия
+    origin = os.path.join(backup_dest, entry['origin'])
+    if entry.get('delta_base'):
+        base_name = entry['delta_base']
+        if base_name not in manifests:
+            manifests[base_name] = load_manifest(os.path.join(backup_dest, base_name))
+        base_manifest = manifests[base_name]
+        if base_manifest is None:
+            raise RuntimeError(f"Нет манифеста базового бэкапа {base_name} для {rel_path}")
+        base_entry = base_manifest['directories'][directory_name]['files'][rel_path]
+        source.update(kind='delta', mode=entry['mode'],
+                      patch=delta_paths(origin, directory_name, rel_path)[0],
+                      base=_entry_source(directory_name, rel_path, base_entry,
+                                         manifests, archive_origins))
+        return source
+    if origin not in archive_origins:
+        archive_origins[origin] = os.path.exists(os.path.join(origin, ARCHIVE_INDEX_NAME))
+    if archive_origins[origin]:
+        source.update(kind='archive', folder=origin, name=f'{directory_name}/{rel_path}')
+    else:
+        source.update(kind='file', path=os.path.join(origin, directory_name, rel_path))
+    return source
+
+def resolve_backup_state(backup_folder, directory_name):
+    """
+    Определяет состояние директории на момент бэкапа: словарь файлов
+    (относительный путь -> откуда взять содержимое) и множество каталогов.
+    Возвращает None, если бэкап не содержит эту директорию.
+    """
+    manifest = load_manifest(backup_folder)
+    if manifest is not None:
+        if directory_name not in manifest['directories']:
+            return None
+        directory_info = manifest['directories'][directory_name]
+        files = {}
+        archive_origins = {}
+        manifests = {os.path.basename(backup_folder): manifest}
+        for rel_path, entry in directory_info['files'].items():
+            if manifest['method'] == 'dedup':
+                files[rel_path] = {'size': entry['size'], 'mtime_ns': entry['mtime_ns'],
+                                   'kind': 'chunks', 'chunks': entry['chunks'], 'mode': entry['mode']}
+            else:
+                files[rel_path] = _entry_source(directory_name, rel_path, entry,
+                                                manifests, archive_origins)
+        return {'files': files, 'dirs': set(directory_info['dirs'])}
+
+    # Бэкапы старого формата: накладываем деревья папок цепочки по порядку
+    files = {}
+    dirs = set()
+    found = False
+    for folder in get_backup_chain(backup_folder):
+        backup_directory = os.path.join(folder, directory_name)
+        if not os.path.isdir(backup_directory):
+            continue
+        found = True
+        for rel_dir, entries in scan_directory(backup_directory):
+            if rel_dir:
+                dirs.add(rel_dir)
+            for entry in entries:
+                st = entry.stat()
+                files[os.path.join(rel_dir, entry.name)] = {
+                    'size': st.st_size,
+                    'mtime_ns': st.st_mtime_ns,
+                    'kind': 'file',
+                    'path': entry.path,
+                }
+    if not found:
+        return None
+    return {'files': files, 'dirs': dirs}
+
+def _materialize_file(source, target, stats=None):
+    """
+    Записывает содержимое файла из бэкапа во временный файл рядом с target
+    и атомарно подменяет target. Способы копирования учитываются в stats.
+    """
+    tmp_path = os.path.join(os.path.dirname(target), f'.{os.path.basename(target)}.restore_tmp')
+    if source['kind'] == 'file':
+        copy_file_fast(source['path'], tmp_path, stats=stats)
+    elif source['kind'] == 'archive':
+        extractor = ArchiveExtractor(source['folder'])
+        try:
+            extractor.extract(source['name'], tmp_path)
+        finally:
+            extractor.close()
+    elif source['kind'] == 'delta':
+        base = source['base']
+        if base['kind'] == 'file':
+            apply_patch(base['path'], source['patch'], tmp_path)
+        else:
+            # База сама собирается из патча или архива: восстанавливаем её во временный файл
+            base_path = tmp_path + '.base'
+            _materialize_file(base, base_path, stats)
+            try:
+                apply_patch(base_path, source['patch'], tmp_path)
+            finally:
+                os.remove(base_path)
+        os.chmod(tmp_path, source['mode'])
+        os.utime(tmp_path, ns=(source['mtime_ns'], source['mtime_ns']))
+    else:
+        chunk_store = get_chunk_store()
+        with open(tmp_path, 'wb') as out:
+            for digest in source['chunks']:
+                with open(chunk_path(chunk_store, digest), 'rb') as chunk_file:
+                    out.write(chunk_file.read())
+        os.chmod(tmp_path, source['mode'])
+        os.utime(tmp_path, ns=(source['mtime_ns'], source['mtime_ns']))
+    os.replace(tmp_path, target)
+
+def _extract_archive_members(archive_sources):
+    """
+    Извлекает файлы из архивов (папка архива -> [(имя члена, путь назначения)])
+    последовательно в порядке их смещения в потоке.
+    """
+    for folder, members in archive_sources.items():
+        extractor = ArchiveExtractor(folder)
+        try:
+            members.sort(key=lambda member: extractor.reader.members[member[0]][0])
+            for name, target in members:
+                tmp_path = os.path.join(os.path.dirname(target),
+                                        f'.{os.path.basename(target)}.restore_tmp')
+                extractor.extract(name, tmp_path)
+                os.replace(tmp_path, target)
+        finally:
+            extractor.close()
+
+def restore_directory(backup_folder, directory, stats=None):
+    """
+    Приводит живую директорию к состоянию на момент бэкапа, записывая только
+    отличающиеся файлы (по размеру и времени модификации) и удаляя лишние.
+    Способы копирования файлов учитываются в stats.
+    Возвращает False, если бэкап не содержит эту директорию.
+    """
+    directory_name = os.path.basename(os.path.normpath(directory))
+    state = resolve_backup_state(backup_folder, directory_name)
+    if state is None:
+        return False
+
+    # Лишние файлы и каталоги живой директории
+    live_files = {}
+    live_dirs = set()
+    if os.path.isdir(directory):
+        for rel_dir, entries in scan_directory(directory):
+            if rel_dir:
+                live_dirs.add(rel_dir)
+            for entry in entries:
+                live_files[os.path.join(rel_dir, entry.name)] = entry
+    removed = 0
+    for rel_path in live_files.keys() - state['files'].keys():
+        os.remove(os.path.join(directory, rel_path))
+        removed += 1
+    for rel_dir in sorted(live_dirs - state['dirs'], key=len, reverse=True):
+        try:
+            os.rmdir(os.path.join(directory, rel_dir))
+        except OSError:
+            # В каталоге остались файлы, не попадающие в обход (например, сокеты)
+            logging.warning(f"Не удалось удалить каталог {os.path.join(directory, rel_dir)}")
+
+    os.makedirs(directory, exist_ok=True)
+    for rel_dir in sorted(state['dirs']):
+        os.makedirs(os.path.join(directory, rel_dir), exist_ok=True)
+
+    to_write = []
+    for rel_path, source in state['files'].items():
+        entry = live_files.get(rel_path)
+        if entry is not None:
+            st = entry.stat()
+            if st.st_size == source['size'] and st.st_mtime_ns == source['mtime_ns']:
+                continue
+        to_write.append((rel_path, source))
+
+    # Файлы из архивов извлекаются последовательно в порядке их смещения в потоке
+    archive_sources = {}
+    with ThreadPoolExecutor(max_workers=config['parallel']['workers'],
+                            thread_name_prefix='backup-restore') as executor:
+        futures = []
+        for rel_path, source in to_write:
+            target = os.path.join(directory, rel_path)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if source['kind'] == 'archive':
+                archive_sources.setdefault(source['folder'], []).append((source['name'], target))
+            else:
+                futures.append(executor.submit(_materialize_file, source, target, stats))
+        _extract_archive_members(archive_sources)
+        for future in futures:
+            future.result()
+
+    logging.info(f"Директория {directory}: записано файлов {len(to_write)}, удалено {removed}, "
+                 f"без изменений {len(state['files']) - len(to_write)}")
+    return True
+
+def restore_backup(backup_name=None):
+    """
+    Восстанавливает директории из бэкапа. Без backup_name бэкап выбирается
+    интерактивно с подтверждением; с backup_name восстановление выполняется
+    без вопросов (для запуска из скриптов).
+    """
     backup_dest = config['backup_destination']
     backups = [d for d in os.listdir(backup_dest)
                if os.path.isdir(os.path.join(backup_dest, d)) and d.startswith('backup_')]
+    # Самые свежие бэкапы в начале списка
+    backups.sort(reverse=True)
     if not backups:
         print("Нет доступных бэкапов для восстановления.")
         return
 
-    print("Доступные бэкапы:")
-    for idx, backup in enumerate(backups, start=1):
-        print(f"{idx}. {backup}")
+    if backup_name:
+        if backup_name not in backups:
+            print(f"Бэкап '{backup_name}' не найден.")
+            logging.error(f"Бэкап {backup_name} для восстановления не найден.")
+            return
+        backup_to_restore = os.path.join(backup_dest, backup_name)
+    else:
+        print("Доступные бэкапы:")
+        for idx, backup in enumerate(backups, start=1):
+            print(f"{idx}. {backup}")
 
-    choice = int(input("Введите номер бэкапа для восстановления: "))
-    if choice < 1 or choice > len(backups):
-        print("Неверный выбор.")
-        return
+        choice = int(input("Введите номер бэкапа для восстановления: "))
+        if choice < 1 or choice > len(backups):
+            print("Неверный выбор.")
+            return
 
-    backup_to_restore = os.path.join(backup_dest, backups[choice - 1])
+        backup_to_restore = os.path.join(backup_dest, backups[choice - 1])
 
-    # Подтверждение восстановления
-    confirm = input(f"Вы уверены, что хотите восстановить бэкап '{backups[choice - 1]}'? Это перезапишет текущие данные. (yes/no): ")
-    if confirm.lower() != 'yes':
-        print("Восстановление отменено.")
-        return
+        # Подтверждение восстановления
+        confirm = input(f"Вы уверены, что хотите восстановить бэкап '{backups[choice - 1]}'? Это перезапишет текущие данные. (yes/no): ")
+        if confirm.lower() != 'yes':
+            print("Восстановление отменено.")
+            return
 
-    for directory in config['backup_directories']:
+    stats = CopyStats()
+    for directory in get_backup_paths():
         directory_name = os.path.basename(os.path.normpath(directory))
-        backup_directory = os.path.join(backup_to_restore, directory_name)
-
-        if os.path.exists(backup_directory):
-            # Удаляем текущую директорию
-            if os.path.exists(directory):
-                shutil.rmtree(directory)
-            # Восстанавливаем из бэкапа
-            shutil.copytree(backup_directory, directory)
+        if restore_directory(backup_to_restore, directory, stats):
             logging.info(f"Успешно восстановлена директория {directory} из бэкапа.")
         else:
             logging.warning(f"Бэкап не содержит директорию {directory_name}.")
+    stats.log('восстановление')
+
+def load_verify_cache():
+    """
+    Загружает кеш проверки: ключ проверяемого объекта -> [размер, mtime_ns,
+    алгоритм, контрольная сумма] файла, по которому она посчитана.
+    """
+    cache_path = os.path.join(config['backup_destination'], VERIFY_CACHE_NAME)
+    try:
+        with gzip.open(cache_path, 'rt', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logging.warning(f"Не удалось прочитать кеш проверки {cache_path}: {e}")
+        return {}
+
+def write_verify_cache(cache):
+    backup_dest = config['backup_destination']
+    # Записи удалённых бэкапов больше не нужны
+    existing = set(os.listdir(backup_dest))
+    cache = {key: value for key, value in cache.items() if key.split(os.sep, 1)[0] in existing}
+    cache_path = os.path.join(backup_dest, VERIFY_CACHE_NAME)
+    tmp_path = cache_path + '.tmp'
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+        json.dump(cache, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp_path, cache_path)
+
+def _verify_items(backup_folder, items):
+    """
+    Добавляет в items (ключ -> объект проверки) данные, необходимые для
+    восстановления бэкапа: копии файлов, члены архивов и патчи с ожидаемыми
+    контрольными суммами из манифеста, а для дедупликации — блоки хранилища.
+    Возвращает число файлов без записанной контрольной суммы.
+    """
+    backup_dest = config['backup_destination']
+    manifest = load_manifest(backup_folder)
+    skipped = 0
+    for directory_name, directory_info in manifest['directories'].items():
+        if manifest['method'] == 'dedup':
+            chunk_store = get_chunk_store()
+            for entry in directory_info['files'].values():
+                for digest in entry['chunks']:
+                    path = chunk_path(chunk_store, digest)
+                    # Блок адресуется своим SHA-256: имя файла и есть ожидаемая сумма
+                    items.setdefault(os.path.relpath(path, backup_dest), {
+                        'kind': 'chunk', 'path': path, 'stat_path': path,
+                        'algorithm': 'sha256', 'expected': digest})
+            continue
+        state = resolve_backup_state(backup_folder, directory_name)
+        for rel_path, entry in directory_info['files'].items():
+            if not entry.get('hash'):
+                skipped += 1
+                continue
+            source = state['files'][rel_path]
+            if source['kind'] == 'archive':
+                stat_path = archive_file_path(source['folder'])
+                key = os.path.join(os.path.relpath(source['folder'], backup_dest), source['name'])
+            elif source['kind'] == 'delta':
+                stat_path = source['patch']
+                key = os.path.relpath(stat_path, backup_dest)
+            else:
+                stat_path = source['path']
+                key = os.path.relpath(stat_path, backup_dest)
+            items.setdefault(key, {'kind': source['kind'], 'source': source, 'stat_path': stat_path,
+                                   'algorithm': manifest['hash_algorithm'], 'expected': entry['hash']})
+    return skipped
+
+def _hash_verify_item(item):
+    """
+    Считает контрольную сумму объекта проверки (кроме членов архива: они
+    читаются по порядку в _hash_archive_items).
+    """
+    if item['kind'] == 'delta':
+        # Файл собирается из базы и патча во временный файл на томе бэкапов
+        with tempfile.TemporaryDirectory(prefix='.verify-', dir=config['backup_destination']) as tmp_dir:
+            target = os.path.join(tmp_dir, 'file')
+            _materialize_file(item['source'], target)
+            return hash_file(target, item['algorithm'])
+    return hash_file(item.get('path') or item['source']['path'], item['algorithm'])
+
+def _hash_archive_items(folder, items):
+    """
+    Считает контрольные суммы членов одного архива в порядке их смещения в потоке.
+    Возвращает список (ключ, сумма или исключение).
+    """
+    results = []
+    extractor = ArchiveExtractor(folder)
+    try:
+        items.sort(key=lambda pair: extractor.reader.members[pair[1]['source']['name']][0])
+        for key, item in items:
+            try:
+                _, member = extractor.open(item['source']['name'])
+                with member:
+                    results.append((key, hash_stream(member, item['algorithm'])))
+            except Exception as e:
+                results.append((key, e))
+    finally:
+        extractor.close()
+    return results
+
+def verify_backups(backup_name=None, sample=None):
+    """
+    Проверяет целостность бэкапа backup_name (без имени — всех бэкапов):
+    пересчитывает контрольные суммы данных, нужных для восстановления,
+    в пуле потоков и сравнивает их с записанными в манифестах. Суммы
+    кешируются по размеру и mtime файла, поэтому повторная проверка
+    перечитывает только изменившиеся файлы. При sample (процент) проверяется
+    случайная доля объектов, и они перечитываются в обход кеша.
+    Возвращает True, если расхождений не найдено.
+    """
+    backup_dest = config['backup_destination']
+    if backup_name:
+        names = [backup_name]
+    else:
+        names = sorted(d for d in os.listdir(backup_dest)
+                       if os.path.isdir(os.path.join(backup_dest, d)) and d.startswith('backup_'))
+    items = {}
+    skipped = 0
+    unverifiable = 0
+    for name in names:
+        backup_folder = os.path.join(backup_dest, name)
+        if load_manifest(backup_folder) is None:
+            print(f"Бэкап {name} не найден или не содержит манифеста: проверка невозможна.")
+            logging.warning(f"Проверка: у бэкапа {name} нет манифеста.")
+            unverifiable += 1
+            continue
+        skipped += _verify_items(backup_folder, items)
+
+    keys = sorted(items)
+    if sample is not None:
+        keys = sorted(random.sample(keys, min(len(keys), math.ceil(len(keys) * sample / 100))))
+    cache = load_verify_cache()
+    results = {'ok': 0, 'cached': 0, 'mismatch': [], 'missing': [], 'error': []}
+    to_hash = []
+    for key in keys:
+        item = items[key]
+        try:
+            st = os.stat(item['stat_path'])
+        except FileNotFoundError:
+            results['missing'].append(key)
+            continue
+        item['stat'] = [st.st_size, st.st_mtime_ns, item['algorithm']]
+        cached = cache.get(key)
+        if sample is None and cached and cached[:3] == item['stat']:
+            results['cached'] += 1
+            if cached[3] == item['expected']:
+                results['ok'] += 1
+            else:
+                results['mismatch'].append(key)
+            continue
+        to_hash.append(key)
+
+    def record(key, digest):
+        item = items[key]
+        if isinstance(digest, Exception):
+            logging.error(f"Проверка {key}: {digest}")
+            results['error'].append(key)
+            return
+        cache[key] = item['stat'] + [digest]
+        if digest == item['expected']:
+            results['ok'] += 1
+        else:
+            logging.error(f"Проверка {key}: контрольная сумма не совпадает с манифестом")
+            results['mismatch'].append(key)
+
+    # Члены одного архива читаются одним потоком по порядку, остальное — независимо
+    archives = {}
+    with ThreadPoolExecutor(max_workers=config['parallel']['workers'],
+                            thread_name_prefix='backup-verify') as executor:
+        futures = {}
+        for key in to_hash:
+            item = items[key]
+            if item['kind'] == 'archive':
+                archives.setdefault(item['source']['folder'], []).append((key, item))
+            else:
+                futures[executor.submit(_hash_verify_item, item)] = key
+        archive_futures = [executor.submit(_hash_archive_items, folder, archive_items)
+                           for folder, archive_items in archives.items()]
+        for future, key in futures.items():
+            try:
+                record(key, future.result())
+            except Exception as e:
+                record(key, e)
+        for future in archive_futures:
+            for key, digest in future.result():
+                record(key, digest)
+    write_verify_cache(cache)
+
+    failed = len(results['mismatch']) + len(results['missing']) + len(results['error']) + unverifiable
+    print(f"Проверено объектов: {len(keys)} из {len(items)}; совпадают: {results['ok']} "
+          f"(из кеша: {results['cached']}); не совпадают: {len(results['mismatch'])}; "
+          f"отсутствуют: {len(results['missing'])}; ошибки чтения: {len(results['error'])}; "
+          f"без контрольной суммы в манифесте: {skipped}")
+    for status, label in (('mismatch', 'не совпадает'), ('missing', 'отсутствует'), ('error', 'ошибка чтения')):
+        for key in results[status]:
+            print(f"  {label}: {key}")
+    logging.info(f"Проверка бэкапов: объектов {len(keys)}, совпадают {results['ok']}, "
+                 f"из кеша {results['cached']}, с ошибками {failed}")
+    return failed == 0
+
+def select_retained(names):
+    """
+    Выбирает бэкапы, которые остаются по политике хранения: последние
+    keep_last, а также последний бэкап каждого из последних daily дней,
+    weekly недель и monthly месяцев.
+    """
+    policy = config['retention']
+    keep = set()
+    dated = []
+    for name in names:
+        try:
+            created = datetime.strptime(name.split('_')[1], '%Y%m%d%H%M%S')
+        except (IndexError, ValueError):
+            # Имя не нашего формата: не трогаем
+            keep.add(name)
+            continue
+        dated.append((created, name))
+    dated.sort(reverse=True)
+    # Последний бэкап нужен всегда: от него считается следующий инкрементальный
+    keep.update(name for _, name in dated[:max(1, policy['keep_last'])])
+    periods = (
+        ('daily', lambda created: created.date()),
+        ('weekly', lambda created: created.isocalendar()[:2]),
+        ('monthly', lambda created: (created.year, created.month)),
+    )
+    for key, period_of in periods:
+        seen = set()
+        for created, name in dated:
+            period = period_of(created)
+            if period in seen:
+                continue
+            if len(seen) >= policy[key]:
+                break
+            seen.add(period)
+            keep.add(name)
+    return keep
+
+def synthesize_full(backup_folder):
+    """
+    Собирает синтетический полный бэкап с состоянием backup_folder только из
+    данных на томе бэкапов, не читая источники: копии файлов связываются
+    жёсткими ссылками, дельты и члены архивов распаковываются. Новый бэкап
+    получает время исходного и ни от кого не зависит. Возвращает его имя.
+    """
+    backup_dest = config['backup_destination']
+    name = os.path.basename(backup_folder)
+    manifest = load_manifest(backup_folder)
+    timestamp, job_name, _ = parse_backup_name(name)
+    new_name = backup_folder_name(timestamp, 'full', job_name)
+    new_folder = os.path.join(backup_dest, new_name)
+    if os.path.exists(new_folder):
+        raise RuntimeError(f"Папка {new_folder} для синтетического полного бэкапа уже существует")
+    # Папка собирается под временным именем, не видимым при поиске бэкапов
+    tmp_folder = os.path.join(backup_dest, f'.{new_name}.partial')
+    if os.path.exists(tmp_folder):
+        shutil.rmtree(tmp_folder)
+
+    new_manifest = {
+        'version': MANIFEST_VERSION,
+        'method': 'full',
+        'hash_algorithm': manifest.get('hash_algorithm'),
+        'synthetic_from': name,
+        'directories': {},
+    }
+    try:
+        archive_sources = {}
+        with ThreadPoolExecutor(max_workers=config['parallel']['workers'],
+                                thread_name_prefix='backup-synthetic') as executor:
+            futures = []
+            for directory_name, directory_info in manifest['directories'].items():
+                state = resolve_backup_state(backup_folder, directory_name)
+                target_root = os.path.join(tmp_folder, directory_name)
+                os.makedirs(target_root)
+                for rel_dir in sorted(state['dirs']):
+                    os.makedirs(os.path.join(target_root, rel_dir), exist_ok=True)
+                files = {}
+                for rel_path, entry in directory_info['files'].items():
+                    source = state['files'][rel_path]
+                    target = os.path.join(target_root, rel_path)
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    if source['kind'] == 'file':
+                        try:
+                            os.link(source['path'], target)
+                        except OSError:
+                            copy_file_fast(source['path'], target)
+                    elif source['kind'] == 'archive':
+                        archive_sources.setdefault(source['folder'], []).append((source['name'], target))
+                    else:
+                        futures.append(executor.submit(_materialize_file, source, target))
+                    new_entry = {key: value for key, value in entry.items() if key != 'delta_base'}
+                    new_entry['origin'] = new_name
+                    if entry.get('signature'):
+                        # Сигнатура нужна следующему бэкапу как база для дельты
+                        signature_source = delta_paths(os.path.join(backup_dest, entry['signature']),
+                                                       directory_name, rel_path)[1]
+                        signature_target = delta_paths(tmp_folder, directory_name, rel_path)[1]
+                        os.makedirs(os.path.dirname(signature_target), exist_ok=True)
+                        os.link(signature_source, signature_target)
+                        new_entry['signature'] = new_name
+                    files[rel_path] = new_entry
+                new_manifest['directories'][directory_name] = dict(directory_info, files=files)
+            _extract_archive_members(archive_sources)
+            for future in futures:
+                future.result()
+        write_manifest(tmp_folder, new_manifest)
+        os.rename(tmp_folder, new_folder)
+    except Exception:
+        shutil.rmtree(tmp_folder, ignore_errors=True)
+        raise
+    logging.info(f"Синтетический полный бэкап {new_name} собран из {name}")
+    return new_name
+
+def collect_chunk_garbage():
+    """
+    Удаляет из хранилища блоков те, на которые не ссылается ни один бэкап
+    с дедупликацией и которые не закреплены выполняющимся бэкапом. Бэкапы
+    ищутся обходом директории, а не по каталогу: бэкап другого задания мог
+    записать манифест, но ещё не попасть в каталог.
+    """
+    backup_dest = config['backup_destination']
+    chunk_store = get_chunk_store()
+    if not os.path.isdir(chunk_store):
+        return
+    removed = 0
+    with _chunk_store_lock:
+        referenced = set(_pinned_chunks)
+        for d in os.listdir(backup_dest):
+            if not d.startswith('backup_') or parse_backup_name(d)[2] != 'dedup':
+                continue
+            manifest = load_manifest(os.path.join(backup_dest, d))
+            if manifest is None or manifest['method'] != 'dedup':
+                continue
+            for directory_info in manifest['directories'].values():
+                for entry in directory_info['files'].values():
+                    referenced.update(entry['chunks'])
+        for prefix in os.listdir(chunk_store):
+            prefix_dir = os.path.join(chunk_store, prefix)
+            for digest in os.listdir(prefix_dir):
+                if digest not in referenced and not digest.endswith('.tmp'):
+                    os.remove(os.path.join(prefix_dir, digest))
+                    removed += 1
+    logging.info(f"Из хранилища блоков удалено неиспользуемых блоков: {removed}")
+
+def apply_retention(job_names=ALL_JOBS):
+    """
+    Удаляет бэкапы заданий из списка job_names (по умолчанию всех; None в
+    списке обозначает общее задание), не попадающие под
+    политику хранения; политика применяется к каждому заданию отдельно.
+    Если оставшийся бэкап ссылается на удаляемые (инкрементальная или
+    дифференциальная цепочка), он заменяется синтетическим полным бэкапом,
+    а ссылки более поздних бэкапов на него и на поглощённые им файлы переписываются.
+    """
+    backup_dest = config['backup_destination']
+    with _catalog_lock:
+        catalog = load_catalog()
+        if catalog is None:
+            catalog = rebuild_catalog()
+        manifests = {}
+        groups = {}
+        for backup in catalog['backups']:
+            if job_names is not ALL_JOBS and backup['job'] not in job_names:
+                continue
+            manifest = load_manifest(os.path.join(backup_dest, backup['name']))
+            # Бэкапы без манифеста (старый формат) не удаляются: их зависимости неизвестны
+            if manifest is not None:
+                manifests[backup['name']] = manifest
+                groups.setdefault(backup['job'], []).append(backup['name'])
+        # Бэкапы ссылаются только на бэкапы своего задания
+        names = sorted(manifests)
+        deleted = set()
+        for group in groups.values():
+            deleted.update(set(group) - select_retained(group))
+        if not deleted:
+            logging.info("Политика хранения: устаревших бэкапов нет.")
+            return
+
+        # (директория, путь, папка origin) -> запись синтетического бэкапа с той же версией файла
+        moved = {}
+        rewrites = []
+        synthesized = []
+        try:
+            for name in names:
+                manifest = manifests[name]
+                if name in deleted or manifest['method'] == 'dedup':
+                    continue
+                changed = False
+                missing = False
+                for directory_name, directory_info in manifest['directories'].items():
+                    files = directory_info['files']
+                    for rel_path, entry in files.items():
+                        refs = {entry['origin'], entry.get('delta_base'), entry.get('signature')}
+                        if not refs & deleted:
+                            continue
+                        # В одной папке хранится одна версия файла, поэтому origin её определяет
+                        if entry['origin'] in deleted:
+                            new_entry = moved.get((directory_name, rel_path, entry['origin']))
+                        elif entry.get('delta_base') in deleted:
+                            # Удаляется только база дельты: патч остаётся, меняется папка базы
+                            base_entry = moved.get((directory_name, rel_path, entry['delta_base']))
+                            new_entry = base_entry and dict(entry, delta_base=base_entry['origin'])
+                        else:
+                            # Удаляется только сигнатура (снимки старых версий переносили её
+                            # из первого снимка): файл цел, следующий бэкап сохранит его без дельты
+                            new_entry = {key: value for key, value in entry.items() if key != 'signature'}
+                        if new_entry is None:
+                            missing = True
+                            break
+                        files[rel_path] = new_entry
+                        changed = True
+                    if missing:
+                        break
+                if missing:
+                    new_name = synthesize_full(os.path.join(backup_dest, name))
+                    synthesized.append(new_name)
+                    new_manifest = load_manifest(os.path.join(backup_dest, new_name))
+                    original = load_manifest(os.path.join(backup_dest, name))
+                    for directory_name, directory_info in original['directories'].items():
+                        new_files = new_manifest['directories'][directory_name]['files']
+                        for rel_path, entry in directory_info['files'].items():
+                            moved[(directory_name, rel_path, entry['origin'])] = new_files[rel_path]
+                    deleted.add(name)
+                elif changed:
+                    rewrites.append((name, manifest))
+        except Exception:
+            # Пока ссылки не переписаны, собранные синтетические бэкапы никому не нужны
+            for new_name in synthesized:
+                shutil.rmtree(os.path.join(backup_dest, new_name), ignore_errors=True)
+            raise
+
+        # Все папки ещё на месте: каждая ссылка остаётся верной на любом шаге
+        for name, manifest in rewrites:
+            write_manifest(os.path.join(backup_dest, name), manifest)
+        backups = [backup for backup in catalog['backups'] if backup['name'] not in deleted]
+        backups.extend({'name': new_name, 'method': 'full', 'job': parse_backup_name(new_name)[1]}
+                       for new_name in synthesized)
+        write_catalog(backups)
+        for name in sorted(deleted):
+            shutil.rmtree(os.path.join(backup_dest, name))
+        if any(manifests[name]['method'] == 'dedup' for name in deleted):
+            collect_chunk_garbage()
+        logging.info(f"Политика хранения: удалено бэкапов {len(deleted)}, собрано синтетических "
+                     f"полных {len(synthesized)}, переписано манифестов {len(rewrites)}")
 
 def main():
     parser = argparse.ArgumentParser(description='Система Автоматического Бэкапа')
-    parser.add_argument('--restore', action='store_true', help='Восстановить из бэкапа')
+    parser.add_argument('--restore', nargs='?', const='', metavar='BACKUP_NAME',
+                        help='Восстановить из бэкапа (без имени — интерактивный выбор)')
     parser.add_argument('--backup-now', action='store_true', help='Выполнить бэкап немедленно')
+    parser.add_argument('--verify', nargs='?', const='', metavar='BACKUP_NAME',
+                        help='Проверить контрольные суммы бэкапа (без имени — всех бэкапов)')
+    parser.add_argument('--sample', type=float, metavar='PERCENT',
+                        help='С --verify: перечитать случайные PERCENT%% объектов в обход кеша')
+    parser.add_argument('--prune', action='store_true',
+                        help='Удалить устаревшие бэкапы по политике хранения')
+    parser.add_argument('--daemon', action='store_true',
+                        help='Режим планировщика с журналом изменений: бэкап обрабатывает только изменённые пути')
     args = parser.parse_args()
 
-    if args.restore:
-        restore_backup()
+    if args.restore is not None:
+        restore_backup(args.restore)
     elif args.backup_now:
-        perform_backup()
+        run_all_jobs()
+    elif args.verify is not None:
+        if not verify_backups(args.verify, args.sample):
+            sys.exit(1)
+    elif args.prune:
+        apply_retention()
     else:
-        # Настройка планировщика
-        scheduler = BackgroundScheduler()
+        # Настройка планировщика: пул потоков ограничивает число одновременных заданий,
+        # пропущенные запуски одного задания сливаются в один (coalesce)
+        scheduler_config = config['scheduler']
+        scheduler = BackgroundScheduler(
+            executors={'default': SchedulerThreadPool(scheduler_config['max_concurrent_jobs'])},
+            job_defaults={
+                'coalesce': True,
+                # Второй экземпляр только отмечает повторный запуск в run_backup_job
+                'max_instances': 2,
+                'misfire_grace_time': scheduler_config['misfire_grace_time'],
+            })
+        observer = None
+        journals = []
+        if args.daemon:
+            observer = Observer()
 
-        schedule_interval = config['schedule']['interval']
-        schedule_time = config['schedule']['time']  # Формат 'HH:MM'
+        for job in get_backup_jobs():
+            job_kwargs = {'job': job}
+            if args.daemon:
+                # У каждого задания свой журнал: бэкап забирает только изменения своих директорий
+                journal_config = config['journal']
+                journal_path = journal_config['path']
+                if job['name']:
+                    journal_path = f"{journal_path}.{job['name']}"
+                journal = ChangeJournal(os.path.join(config['backup_destination'], journal_path),
+                                        journal_config['max_entries'], job['directories'])
+                journal.start()
+                journals.append(journal)
+                handler = JournalEventHandler(journal)
+                for directory in job['directories']:
+                    observer.schedule(handler, directory, recursive=True)
+                job_kwargs['journal'] = journal
 
-        hour, minute = map(int, schedule_time.split(':'))
+            schedule_interval = job['interval']
+            schedule_time = job['time']  # Формат 'HH:MM'
 
-        if schedule_interval == 'daily':
-            scheduler.add_job(perform_backup, 'cron', hour=hour, minute=minute)
-        elif schedule_interval == 'weekly':
-            scheduler.add_job(perform_backup, 'cron', day_of_week='sun', hour=hour, minute=minute)
-        elif schedule_interval == 'monthly':
-            scheduler.add_job(perform_backup, 'cron', day=1, hour=hour, minute=minute)
-        else:
-            # Для пользовательских интервалов, например, каждые N секунд
+            hour, minute = map(int, schedule_time.split(':'))
+
+            if schedule_interval == 'daily':
+                scheduler.add_job(run_backup_job, 'cron', hour=hour, minute=minute, kwargs=job_kwargs)
+            elif schedule_interval == 'weekly':
+                scheduler.add_job(run_backup_job, 'cron', day_of_week='sun', hour=hour, minute=minute,
+                                  kwargs=job_kwargs)
+            elif schedule_interval == 'monthly':
+                scheduler.add_job(run_backup_job, 'cron', day=1, hour=hour, minute=minute, kwargs=job_kwargs)
+            else:
+                # Для пользовательских интервалов, например, каждые N секунд
 
-            interval_seconds = int(schedule_interval)
-            scheduler.add_job(perform_backup, 'interval', seconds=interval_seconds)
+                interval_seconds = int(schedule_interval)
+                scheduler.add_job(run_backup_job, 'interval', seconds=interval_seconds, kwargs=job_kwargs)
 
+        if observer is not None:
+            observer.start()
         scheduler.start()
         print("Система Автоматического Бэкапа запущена. Для остановки нажмите Ctrl+C.")
         try:
             while True:
                 time.sleep(1)
+                for journal in journals:
+                    journal.sync()
         except (KeyboardInterrupt, SystemExit):
             scheduler.shutdown()
+            if observer is not None:
+                observer.stop()
+                observer.join()
+                for journal in journals:
+                    journal.close()
             print("Система остановлена.")
 
 if __name__ == '__main__':
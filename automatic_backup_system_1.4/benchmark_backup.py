@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+# benchmark_backup.py
+#
+# Нагрузочный тест backup_script.py: генерирует воспроизводимое синтетическое
+# дерево, выполняет бэкапы каждым методом с изменениями между запусками,
+# затем восстановление, и пишет метрики в JSON.
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+SOURCE_NAMES = ['bench_small', 'bench_large']
+
+# Код, выполняемый в дочернем процессе: каждый замер — отдельный процесс,
+# чтобы пиковая память (ru_maxrss) относилась только к нему.
+CHILD_CODE = r'''
+import json, os, sys
+sys.path.insert(0, sys.argv[1])
+import backup_script
+overrides = json.loads(sys.argv[2])
+for key, value in overrides.items():
+    if isinstance(value, dict) and isinstance(backup_script.config.get(key), dict):
+        backup_script.config[key].update(value)
+    else:
+        backup_script.config[key] = value
+if sys.argv[3] == 'backup':
+    backup_script.perform_backup()
+else:
+    backup_script.restore_backup(sys.argv[4])
+io_stats = {}
+if os.path.exists('/proc/self/io'):
+    with open('/proc/self/io') as f:
+        for line in f:
+            name, value = line.split(':')
+            io_stats[name] = int(value)
+print(json.dumps({'io_write_bytes': io_stats.get('write_bytes')}))
+'''
+
+
+def generate_tree(root, rng, args):
+    """
+    Создаёт синтетическое дерево: много мелких файлов в глубокой вложенности
+    и несколько крупных файлов. Возвращает список путей мелких и крупных файлов.
+    """
+    small_root = os.path.join(root, SOURCE_NAMES[0])
+    large_root = os.path.join(root, SOURCE_NAMES[1])
+    os.makedirs(small_root, exist_ok=True)
+    os.makedirs(large_root, exist_ok=True)
+
+    small_files = []
+    for i in range(args.small_files):
+        depth = rng.randint(0, args.depth)
+        parts = [f'd{rng.randint(0, args.fanout - 1)}' for _ in range(depth)]
+        directory = os.path.join(small_root, *parts)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'file_{i}.txt')
+        write_text_file(path, rng, rng.randint(1, args.small_size))
+        small_files.append(path)
+
+    large_files = []
+    for i in range(args.large_files):
+        path = os.path.join(large_root, f'large_{i}.bin')
+        with open(path, 'wb') as f:
+            remaining = args.large_size
+            while remaining > 0:
+                block = rng.randbytes(min(remaining, 1024 * 1024))
+                f.write(block)
+                remaining -= len(block)
+        large_files.append(path)
+    return small_files, large_files
+
+
+def write_text_file(path, rng, size):
+    # Текстоподобные данные: сжимаются и дедуплицируются как настоящие конфиги и логи
+    words = ['alpha', 'beta', 'gamma', 'delta', 'config', 'value', 'error', 'info', '=', '\n']
+    chunks = []
+    length = 0
+    while length < size:
+        word = rng.choice(words)
+        chunks.append(word)
+        length += len(word) + 1
+    with open(path, 'w') as f:
+        f.write(' '.join(chunks)[:size])
+
+
+def apply_churn(rng, small_files, large_files, args, run):
+    """
+    Вносит изменения между запусками: переписывает, удаляет и добавляет мелкие
+    файлы, меняет несколько блоков в крупных файлах.
+    """
+    count = int(len(small_files) * args.churn)
+    for path in rng.sample(small_files, min(count, len(small_files))):
+        write_text_file(path, rng, rng.randint(1, args.small_size))
+    for path in rng.sample(small_files, min(count // 4, len(small_files))):
+        os.remove(path)
+        small_files.remove(path)
+    for i in range(count // 4):
+        path = os.path.join(os.path.dirname(rng.choice(small_files) if small_files else large_files[0]),
+                            f'new_{run}_{i}.txt')
+        write_text_file(path, rng, rng.randint(1, args.small_size))
+        small_files.append(path)
+    for path in large_files:
+        with open(path, 'r+b') as f:
+            for _ in range(max(1, int(args.churn * 16))):
+                f.seek(rng.randrange(0, max(1, args.large_size - 4096)))
+                f.write(rng.randbytes(4096))
+
+
+def tree_stats(root):
+    files = 0
+    size = 0
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            files += 1
+            size += os.path.getsize(os.path.join(dirpath, name))
+    return files, size
+
+
+def allocated_bytes(root):
+    # Занятое место с учётом жёстких ссылок (каждый inode считается один раз)
+    seen = set()
+    total = 0
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in filenames + dirnames:
+            st = os.lstat(os.path.join(dirpath, name))
+            if (st.st_dev, st.st_ino) in seen:
+                continue
+            seen.add((st.st_dev, st.st_ino))
+            total += st.st_blocks * 512
+    return total
+
+
+def wait_next_second():
+    # Имена папок бэкапов содержат время с точностью до секунды
+    time.sleep(1.05 - (time.time() % 1))
+
+
+def run_child(workdir, overrides, action, backup_name=''):
+    """
+    Выполняет бэкап или восстановление в отдельном процессе. Возвращает время,
+    пиковый RSS процесса в КБ (из wait4) и число записанных байт из /proc.
+    """
+    stderr_path = os.path.join(workdir, 'benchmark_stderr.log')
+    with open(stderr_path, 'ab') as stderr:
+        started = time.perf_counter()
+        proc = subprocess.Popen(
+            [sys.executable, '-c', CHILD_CODE, SCRIPT_DIR, json.dumps(overrides), action, backup_name],
+            cwd=workdir, stdout=subprocess.PIPE, stderr=stderr)
+        output = proc.stdout.read()
+        # wait4 вместо proc.wait(): нужна статистика ресурсов именно этого процесса
+        _, status, rusage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        seconds = time.perf_counter() - started
+    if proc.returncode != 0:
+        raise RuntimeError(f"{action} завершился с кодом {proc.returncode}, подробности в {stderr_path}")
+    lines = output.decode(errors='replace').strip().splitlines()
+    child_stats = json.loads(lines[-1]) if lines else {}
+    return seconds, rusage.ru_maxrss, child_stats.get('io_write_bytes')
+
+
+def measurement(method, output_format, phase, run, files, size, seconds, peak_rss_kb,
+                dest_bytes_added, io_write_bytes):
+    return {
+        'method': method,
+        'output_format': output_format,
+        'phase': phase,
+        'run': run,
+        'files': files,
+        'bytes': size,
+        'seconds': round(seconds, 4),
+        'files_per_sec': round(files / seconds, 2) if seconds else None,
+        'mb_per_sec': round(size / seconds / 1024 / 1024, 2) if seconds else None,
+        'peak_rss_kb': peak_rss_kb,
+        'dest_bytes_added': dest_bytes_added,
+        'io_write_bytes': io_write_bytes,
+    }
+
+
+def benchmark_method(method, output_format, args):
+    """
+    Прогоняет один метод: начальный бэкап, args.runs бэкапов после изменений
+    и восстановление последнего бэкапа в пустые директории.
+    """
+    workdir = os.path.join(args.workdir, f'{method}_{output_format}')
+    if os.path.exists(workdir):
+        shutil.rmtree(workdir)
+    source_root = os.path.join(workdir, 'source')
+    destination = os.path.join(workdir, 'destination')
+    os.makedirs(destination)
+
+    # Одинаковое зерно: все методы получают одно и то же дерево и те же изменения
+    rng = random.Random(args.seed)
+    small_files, large_files = generate_tree(source_root, rng, args)
+    sources = [os.path.join(source_root, name) for name in SOURCE_NAMES]
+    overrides = {
+        'backup_directories': sources,
+        'backup_destination': destination,
+        'output_format': output_format,
+        'log_file': os.path.join(workdir, 'backup.log'),
+    }
+    if args.workers:
+        overrides['parallel'] = {'workers': args.workers}
+
+    results = []
+    for run in range(args.runs + 1):
+        if run > 0:
+            apply_churn(rng, small_files, large_files, args, run)
+        # Инкрементальная и дифференциальная цепочки начинаются с полного бэкапа
+        run_method = 'full' if run == 0 and method in ('incremental', 'differential') else method
+        wait_next_second()
+        before = allocated_bytes(destination)
+        seconds, peak_rss, io_write = run_child(workdir, dict(overrides, backup_method=run_method), 'backup')
+        files = size = 0
+        for source in sources:
+            source_files, source_size = tree_stats(source)
+            files += source_files
+            size += source_size
+        results.append(measurement(method, output_format, 'backup', run, files, size, seconds,
+                                   peak_rss, allocated_bytes(destination) - before, io_write))
+
+    last_backup = sorted(d for d in os.listdir(destination) if d.startswith('backup_'))[-1]
+    restore_root = os.path.join(workdir, 'restore')
+    targets = [os.path.join(restore_root, name) for name in SOURCE_NAMES]
+    for target in targets:
+        os.makedirs(target)
+    seconds, peak_rss, io_write = run_child(
+        workdir, dict(overrides, backup_directories=targets), 'restore', last_backup)
+    files = size = 0
+    for target in targets:
+        target_files, target_size = tree_stats(target)
+        files += target_files
+        size += target_size
+    results.append(measurement(method, output_format, 'restore', args.runs, files, size, seconds,
+                               peak_rss, allocated_bytes(restore_root), io_write))
+
+    if not args.keep:
+        shutil.rmtree(workdir)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест Системы Автоматического Бэкапа')
+    parser.add_argument('--workdir', default='/tmp/backup_benchmark', help='Рабочая директория теста')
+    parser.add_argument('--output', default='benchmark_results.json', help='Файл с результатами в JSON')
+    parser.add_argument('--methods', nargs='+',
+                        default=['full', 'incremental', 'differential', 'dedup', 'snapshot'],
+                        help='Проверяемые методы бэкапа')
+    parser.add_argument('--output-formats', nargs='+', default=['directory'],
+                        choices=['directory', 'archive'], help='Форматы результата бэкапа')
+    parser.add_argument('--seed', type=int, default=42, help='Зерно генератора дерева и изменений')
+    parser.add_argument('--small-files', type=int, default=5000, help='Число мелких файлов')
+    parser.add_argument('--small-size', type=int, default=8192, help='Максимальный размер мелкого файла')
+    parser.add_argument('--large-files', type=int, default=2, help='Число крупных файлов')
+    parser.add_argument('--large-size', type=int, default=128 * 1024 * 1024, help='Размер крупного файла')
+    parser.add_argument('--depth', type=int, default=8, help='Максимальная глубина вложенности')
+    parser.add_argument('--fanout', type=int, default=4, help='Число вариантов имени каталога на уровне')
+    parser.add_argument('--churn', type=float, default=0.05, help='Доля файлов, меняющихся между запусками')
+    parser.add_argument('--runs', type=int, default=3, help='Число бэкапов после изменений')
+    parser.add_argument('--workers', type=int, default=None, help='Переопределить число потоков копирования')
+    parser.add_argument('--keep', action='store_true', help='Не удалять рабочие директории')
+    args = parser.parse_args()
+
+    results = []
+    for output_format in args.output_formats:
+        for method in args.methods:
+            print(f"Метод {method}, формат {output_format}...")
+            results.extend(benchmark_method(method, output_format, args))
+
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'parameters': {key: value for key, value in vars(args).items() if key not in ('output', 'keep')},
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    for result in results:
+        print(f"{result['method']:>12} {result['output_format']:>9} {result['phase']:>7} #{result['run']}: "
+              f"{result['files_per_sec']} файл/с, {result['mb_per_sec']} МБ/с, "
+              f"RSS {result['peak_rss_kb']} КБ, записано {result['dest_bytes_added']} байт")
+    print(f"Результаты сохранены в {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -14,13 +14,13 @@ then
     exit 1
 fi
 
-# Устанавливаем необходимый Python-пакет
-echo "Устанавливаем пакет apscheduler..."
-pip3 install apscheduler
+# Устанавливаем необходимые Python-пакеты
+echo "Устанавливаем пакеты apscheduler и watchdog..."
+pip3 install apscheduler watchdog
 if [ $? -eq 0 ]; then
-    echo "Пакет apscheduler успешно установлен."
+    echo "Пакеты apscheduler и watchdog успешно установлены."
 else
-    echo "Не удалось установить пакет apscheduler. Проверьте интернет-соединение и попробуйте снова."
+    echo "Не удалось установить пакеты apscheduler и watchdog. Проверьте интернет-соединение и попробуйте снова."
     exit 1
 fi
 
@@ -133,6 +133,279 @@ else
     exit 1
 fi
 
+print_header "Тестирование методов и форматов: бэкап и восстановление"
+
+# Код запускается через -c, а не из stdin: процессы сжатия архива повторно импортируют __main__
+METHODS_ROOT=/tmp/test_backup_methods
+rm -rf $METHODS_ROOT
+mkdir -p $METHODS_ROOT
+
+print_info "Два бэкапа каждым методом в каждом формате, восстановление обоих..."
+if python3 -c "$(cat <<'EOF_PY'
+import os
+import shutil
+import sys
+import time
+import backup_script
+
+root = sys.argv[1]
+source = os.path.join(root, 'data')
+config = backup_script.config
+config['delta'].update(threshold=100 * 1024, block_size=16 * 1024)
+config['archive'].update(workers=2, chunk_size=64 * 1024)
+
+def write(rel_path, content):
+    path = os.path.join(source, rel_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(content)
+
+def read_tree():
+    tree = {}
+    for rel_dir, _, names in os.walk(source):
+        for name in names:
+            path = os.path.join(rel_dir, name)
+            with open(path, 'rb') as f:
+                tree[os.path.relpath(path, source)] = f.read()
+    return tree
+
+large = os.urandom(300 * 1024)
+failed = []
+for method in ('full', 'incremental', 'differential', 'dedup', 'snapshot'):
+    for output_format in ('directory', 'archive'):
+        shutil.rmtree(source, ignore_errors=True)
+        dest = os.path.join(root, f'{method}_{output_format}')
+        os.makedirs(dest)
+        config.update(backup_destination=dest, backup_method=method, output_format=output_format,
+                      backup_directories=[source])
+        write('a.txt', b'alpha')
+        write('sub/b.txt', b'beta')
+        write('sub/deep/c.txt', b'gamma')
+        write('large.bin', large)
+        first = read_tree()
+        backup_script.perform_backup()
+        time.sleep(1)
+
+        # Изменение, удаление и добавление файлов, перезапись одного блока большого файла
+        write('a.txt', b'alpha, second version')
+        os.remove(os.path.join(source, 'sub/b.txt'))
+        write('sub/new.txt', b'new')
+        write('large.bin', large[:64 * 1024] + os.urandom(16 * 1024) + large[80 * 1024:])
+        second = read_tree()
+        backup_script.perform_backup()
+
+        names = sorted(d for d in os.listdir(dest) if d.startswith('backup_'))
+        write('extra.txt', b'not in backup')
+        write('a.txt', b'local edit')
+        results = []
+        for name, expected in zip(names, (first, second)):
+            backup_script.restore_backup(name)
+            results.append(read_tree() == expected)
+        if len(names) != 2 or not all(results):
+            failed.append(f'{method}/{output_format}: бэкапов {len(names)}, восстановление {results}')
+print('\n'.join(failed))
+sys.exit(bool(failed))
+EOF_PY
+)" "$METHODS_ROOT"
+then
+    print_success "Все методы и форматы восстанавливают оба бэкапа"
+else
+    print_error "Ошибка: бэкап или восстановление не совпали с исходными данными"
+    exit 1
+fi
+rm -rf $METHODS_ROOT
+
+print_header "Тестирование проверки целостности"
+
+VERIFY_ROOT=/tmp/test_backup_verify
+rm -rf $VERIFY_ROOT
+mkdir -p $VERIFY_ROOT/data $VERIFY_ROOT/dest
+
+print_info "Проверка целого бэкапа и бэкапа с испорченной копией..."
+if python3 - "$VERIFY_ROOT" <<'EOF_PY'
+import os
+import sys
+import backup_script
+
+root = sys.argv[1]
+config = backup_script.config
+config.update(backup_destination=os.path.join(root, 'dest'), backup_method='full',
+              output_format='directory', backup_directories=[os.path.join(root, 'data')])
+for i in range(5):
+    with open(os.path.join(root, 'data', f'file{i}.txt'), 'w') as f:
+        f.write(f'content {i}')
+backup_script.perform_backup()
+intact = backup_script.verify_backups()
+cached = backup_script.verify_backups()
+
+# Порча без изменения размера и mtime: находит только перепроверка в обход кеша
+name = next(d for d in os.listdir(config['backup_destination']) if d.startswith('backup_'))
+copy = os.path.join(config['backup_destination'], name, 'data', 'file3.txt')
+st = os.stat(copy)
+with open(copy, 'w') as f:
+    f.write('CONTENT 3')
+os.utime(copy, ns=(st.st_atime_ns, st.st_mtime_ns))
+corrupted = backup_script.verify_backups(name, sample=100)
+print(intact, cached, corrupted)
+sys.exit(not (intact and cached and not corrupted))
+EOF_PY
+then
+    print_success "Целый бэкап проходит проверку, испорченная копия обнаружена"
+else
+    print_error "Ошибка: проверка целостности дала неверный результат"
+    exit 1
+fi
+rm -rf $VERIFY_ROOT
+
+print_header "Тестирование политики хранения инкрементальной цепочки"
+
+CHAIN_ROOT=/tmp/test_backup_chain_retention
+rm -rf $CHAIN_ROOT
+mkdir -p $CHAIN_ROOT/data $CHAIN_ROOT/dest
+
+print_info "Удаление начала цепочки со сборкой синтетического полного бэкапа..."
+if python3 - "$CHAIN_ROOT" <<'EOF_PY'
+import os
+import sys
+import time
+import backup_script
+
+root = sys.argv[1]
+source = os.path.join(root, 'data')
+config = backup_script.config
+config.update(backup_destination=os.path.join(root, 'dest'), backup_method='incremental',
+              output_format='directory', backup_directories=[source])
+config['retention'].update(enabled=False, keep_last=1, daily=0, weekly=0, monthly=0)
+for run in range(3):
+    with open(os.path.join(source, f'file{run}.txt'), 'w') as f:
+        f.write(f'run {run}')
+    backup_script.perform_backup()
+    time.sleep(1)
+expected = {name: open(os.path.join(source, name)).read() for name in os.listdir(source)}
+
+backup_script.apply_retention()
+remaining = sorted(d for d in os.listdir(config['backup_destination']) if d.startswith('backup_'))
+for name in os.listdir(source):
+    os.remove(os.path.join(source, name))
+backup_script.restore_backup(remaining[-1])
+restored = {name: open(os.path.join(source, name)).read() for name in os.listdir(source)}
+print(remaining)
+sys.exit(len(remaining) != 1 or not remaining[0].endswith('_full') or restored != expected
+         or not backup_script.verify_backups())
+EOF_PY
+then
+    print_success "Цепочка заменена синтетическим полным бэкапом, данные восстанавливаются"
+else
+    print_error "Ошибка: политика хранения испортила инкрементальную цепочку"
+    exit 1
+fi
+rm -rf $CHAIN_ROOT
+
+print_header "Тестирование политики хранения по заданиям"
+
+# Общее задание и задания etc и etc2: имя одного задания — префикс другого
+RETENTION_ROOT=/tmp/test_backup_retention
+rm -rf $RETENTION_ROOT
+mkdir -p $RETENTION_ROOT/shared $RETENTION_ROOT/etc $RETENTION_ROOT/etc2 $RETENTION_ROOT/dest
+for d in shared etc etc2; do echo "$d" > $RETENTION_ROOT/$d/file.txt; done
+
+print_info "Очистка по политике хранения одного задания..."
+if python3 - "$RETENTION_ROOT" <<'EOF_PY'
+import os
+import sys
+import time
+import backup_script
+
+root = sys.argv[1]
+config = backup_script.config
+config['backup_destination'] = os.path.join(root, 'dest')
+config['backup_method'] = 'full'
+config['backup_directories'] = [os.path.join(root, 'shared'),
+                                {'path': os.path.join(root, 'etc')},
+                                {'path': os.path.join(root, 'etc2')}]
+config['retention'].update(enabled=False, keep_last=1, daily=0, weekly=0, monthly=0)
+jobs = {job['name']: job for job in backup_script.get_backup_jobs()}
+
+def counts():
+    catalog = backup_script.load_catalog()
+    return {name: sum(backup['job'] == name for backup in catalog['backups']) for name in jobs}
+
+for _ in range(3):
+    for job in jobs.values():
+        backup_script.perform_backup(job=job)
+    time.sleep(1)
+config['retention']['enabled'] = True
+backup_script.perform_backup(job=jobs['etc2'])
+after_etc2 = counts()
+backup_script.perform_backup(job=jobs[None])
+after_shared = counts()
+print(after_etc2, after_shared)
+sys.exit(after_etc2 != {None: 3, 'etc': 3, 'etc2': 1} or after_shared != {None: 1, 'etc': 3, 'etc2': 1})
+EOF_PY
+then
+    print_success "Очистка задания не затронула бэкапы других заданий"
+else
+    print_error "Ошибка: политика хранения удалила бэкапы другого задания"
+    exit 1
+fi
+rm -rf $RETENTION_ROOT
+
+print_header "Тестирование политики хранения снимков"
+
+# Снимки с крупным неизменным файлом; манифесты старых версий несли в нём сигнатуру первого снимка
+SNAPSHOT_ROOT=/tmp/test_backup_snapshot_retention
+rm -rf $SNAPSHOT_ROOT
+mkdir -p $SNAPSHOT_ROOT/data $SNAPSHOT_ROOT/dest
+
+print_info "Удаление устаревших снимков и восстановление последнего..."
+if python3 - "$SNAPSHOT_ROOT" <<'EOF_PY'
+import os
+import sys
+import time
+import backup_script
+
+root = sys.argv[1]
+source = os.path.join(root, 'data')
+config = backup_script.config
+config['backup_destination'] = os.path.join(root, 'dest')
+config['backup_method'] = 'snapshot'
+config['backup_directories'] = [source]
+config['delta']['threshold'] = 1000
+config['retention'].update(enabled=False, keep_last=1, daily=0, weekly=0, monthly=0)
+
+with open(os.path.join(source, 'large.bin'), 'wb') as f:
+    f.write(os.urandom(5000))
+for run in range(3):
+    with open(os.path.join(source, 'small.txt'), 'w') as f:
+        f.write(f'run {run}')
+    backup_script.perform_backup()
+    time.sleep(1)
+
+names = sorted(d for d in os.listdir(config['backup_destination']) if d.startswith('backup_'))
+for name in names:
+    folder = os.path.join(config['backup_destination'], name)
+    manifest = backup_script.load_manifest(folder)
+    manifest['directories']['data']['files']['large.bin'].update(signature=names[0], mode=0o644)
+    backup_script.write_manifest(folder, manifest)
+expected = {name: open(os.path.join(source, name), 'rb').read() for name in os.listdir(source)}
+
+backup_script.apply_retention()
+remaining = sorted(d for d in os.listdir(config['backup_destination']) if d.startswith('backup_'))
+for name in os.listdir(source):
+    os.remove(os.path.join(source, name))
+backup_script.restore_backup(remaining[-1])
+restored = {name: open(os.path.join(source, name), 'rb').read() for name in os.listdir(source)}
+print(remaining)
+sys.exit(remaining != names[-1:] or restored != expected)
+EOF_PY
+then
+    print_success "Устаревшие снимки удалены, последний восстанавливается"
+else
+    print_error "Ошибка: политика хранения снимков не сработала"
+    exit 1
+fi
+rm -rf $SNAPSHOT_ROOT
+
 print_header "Проверка лог-файла"
 
 # Проверка наличия лог-файла
@@ -151,4 +424,6 @@ echo -e "\nСтатистика тестирования:"
 echo "- Создано тестовых директорий: 3"
 echo "- Выполнено бэкапов: 2 (первичный и инкрементальный)"
 echo "- Проверено восстановление: успешно"
+echo "- Проверены методы full, incremental, differential, dedup, snapshot в форматах directory и archive"
+echo "- Проверены контрольные суммы (--verify) и политика хранения: успешно"
 echo "- Проверено логирование: успешно"
@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+# benchmark_version_control.py
+#
+# Нагрузочный тест монитора version_control.py: запускает `monitor` отдельным
+# процессом, создаёт в директории конфигураций шторм событий по одному из
+# сценариев и измеряет задержку от записи файла до появления версии в базе,
+# рост базы на событие и процессорное время монитора. Результаты пишутся в JSON.
+
+import argparse
+import hashlib
+import json
+import os
+import platform
+import random
+import shutil
+import signal
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+VERSION_CONTROL = os.path.join(SCRIPT_DIR, 'version_control.py')
+PATTERNS = ['small', 'large', 'swap', 'deploy']
+READY_MARKER = 'Запущен мониторинг'
+
+
+class Driver:
+    """
+    Выполняет файловые операции сценария и запоминает, какое содержимое и
+    когда было записано в каждый файл.
+    """
+
+    def __init__(self, config_dir, rate):
+        self.config_dir = config_dir
+        self.rate = rate
+        self.operations = 0
+        self.writes = []
+        self.started = None
+
+    def pace(self):
+        # Ограничение темпа: операция номер N выполняется не раньше started + N / rate
+        if self.started is None:
+            self.started = time.monotonic()
+        if self.rate:
+            delay = self.started + self.operations / self.rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        self.operations += 1
+
+    def write(self, rel_path, data, record=True):
+        self.pace()
+        path = os.path.join(self.config_dir, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        if record:
+            self.writes.append((rel_path, hashlib.sha256(data).hexdigest(), time.time()))
+
+    def replace(self, tmp_rel_path, rel_path, data):
+        # Сохранение через временный файл и переименование, как у многих редакторов
+        self.write(tmp_rel_path, data, record=False)
+        self.pace()
+        os.replace(os.path.join(self.config_dir, tmp_rel_path), os.path.join(self.config_dir, rel_path))
+        self.writes.append((rel_path, hashlib.sha256(data).hexdigest(), time.time()))
+
+    def remove(self, rel_path):
+        self.pace()
+        os.remove(os.path.join(self.config_dir, rel_path))
+
+
+def config_text(rng, lines):
+    return ''.join(f'option_{i} = {rng.randint(0, 10 ** 6)}\n' for i in range(lines)).encode()
+
+
+def run_small(driver, rng, args):
+    # Много мелких файлов в нескольких директориях, каждый переписывается многократно
+    for i in range(args.events):
+        rel_path = os.path.join('small', f'd{i % 16}', f'file_{rng.randrange(args.files)}.conf')
+        driver.write(rel_path, config_text(rng, rng.randint(1, 40)))
+
+
+def run_large(driver, rng, args):
+    # Несколько крупных файлов: каждая запись меняет несколько строк в середине
+    contents = {}
+    for i in range(args.events):
+        rel_path = os.path.join('large', f'large_{i % args.large_files}.conf')
+        lines = contents.get(rel_path)
+        if lines is None:
+            lines = config_text(rng, args.large_lines).splitlines(keepends=True)
+            contents[rel_path] = lines
+        for _ in range(5):
+            lines[rng.randrange(len(lines))] = f'changed_{rng.randint(0, 10 ** 9)} = 1\n'.encode()
+        driver.write(rel_path, b''.join(lines))
+
+
+def run_swap(driver, rng, args):
+    # Сохранения из редактора: swap-файл рядом с конфигом (vim) или запись
+    # во временный файл с переименованием поверх исходного
+    saves = max(1, args.events // 3)
+    for i in range(saves):
+        name = f'file_{rng.randrange(args.files)}.conf'
+        rel_path = os.path.join('swap', name)
+        data = config_text(rng, rng.randint(5, 40))
+        if i % 2:
+            driver.replace(os.path.join('swap', f'.{name}.tmp'), rel_path, data)
+        else:
+            swap_path = os.path.join('swap', f'.{name}.swp')
+            driver.write(swap_path, rng.randbytes(1024), record=False)
+            driver.write(rel_path, data)
+            driver.remove(swap_path)
+
+
+def run_deploy(driver, rng, args):
+    # Массовая выкладка: все файлы переписываются разом, затем пауза
+    rounds = max(1, args.events // args.deploy_files)
+    for round_number in range(rounds):
+        for i in range(args.deploy_files):
+            rel_path = os.path.join('deploy', f'service_{i % 50}', f'config_{i}.conf')
+            driver.write(rel_path, config_text(rng, 20) + f'release = {round_number}\n'.encode())
+        time.sleep(args.deploy_interval)
+
+
+SCENARIOS = {
+    'small': run_small,
+    'large': run_large,
+    'swap': run_swap,
+    'deploy': run_deploy,
+}
+
+
+class RowWatcher(threading.Thread):
+    """
+    Опрашивает базу монитора и запоминает, когда каждая пара (файл, хеш
+    содержимого) впервые появилась в таблице versions.
+    """
+
+    def __init__(self, db_path, interval):
+        super().__init__(daemon=True)
+        self.db_path = db_path
+        self.interval = interval
+        self.seen = {}
+        self.rows = 0
+        self.last_id = 0
+        self.stop_event = threading.Event()
+
+    def run(self):
+        conn = sqlite3.connect(f'file:{self.db_path}?mode=ro', uri=True)
+        try:
+            while not self.stop_event.is_set():
+                self.poll(conn)
+                self.stop_event.wait(self.interval)
+            self.poll(conn)
+        finally:
+            conn.close()
+
+    def poll(self, conn):
+        try:
+            rows = conn.execute('''
+                SELECT id, file_path, content_hash FROM versions WHERE id > ? ORDER BY id
+            ''', (self.last_id,)).fetchall()
+        except sqlite3.OperationalError:
+            return
+        now = time.time()
+        for row_id, rel_path, digest in rows:
+            self.last_id = row_id
+            self.rows += 1
+            self.seen.setdefault((rel_path, digest), now)
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+
+
+def start_monitor(workdir, config_dir, db_path, args):
+    log_path = os.path.join(workdir, 'monitor.log')
+    command = [sys.executable, VERSION_CONTROL, 'monitor', '--config_dir', config_dir, '--db_path', db_path,
+               '--debounce', str(args.debounce), '--storage', args.storage]
+    if args.readers:
+        command += ['--readers', str(args.readers)]
+    if args.queue_size:
+        command += ['--queue_size', str(args.queue_size)]
+    log = open(log_path, 'wb')
+    proc = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT,
+                            env=dict(os.environ, PYTHONUNBUFFERED='1'))
+    log.close()
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        with open(log_path, encoding='utf-8', errors='replace') as f:
+            if READY_MARKER in f.read():
+                return proc, log_path
+        if proc.poll() is not None:
+            break
+        time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError(f'Монитор не запустился, подробности в {log_path}')
+
+
+def stop_monitor(proc):
+    """
+    Останавливает монитор по SIGTERM (с записью накопленных событий) и
+    возвращает статистику ресурсов процесса из wait4.
+    """
+    proc.send_signal(signal.SIGTERM)
+    # wait4 вместо proc.wait(): нужна статистика ресурсов именно этого процесса
+    _, status, rusage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return rusage
+
+
+def checkpoint(db_path):
+    # Переносит WAL в основной файл, чтобы размер базы не зависел от момента замера
+    conn = sqlite3.connect(db_path, timeout=5)
+    try:
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    finally:
+        conn.close()
+
+
+def db_size(db_path):
+    return sum(os.path.getsize(db_path + suffix)
+               for suffix in ('', '-wal') if os.path.exists(db_path + suffix))
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(fraction * (len(values) - 1)))))
+    return values[index]
+
+
+def benchmark_pattern(pattern, args):
+    """
+    Прогоняет один сценарий на свежей базе: запускает монитор, выполняет
+    операции, ждёт появления итоговых версий и останавливает монитор.
+    """
+    workdir = os.path.join(args.workdir, pattern)
+    if os.path.exists(workdir):
+        shutil.rmtree(workdir)
+    config_dir = os.path.join(workdir, 'configs')
+    db_path = os.path.join(workdir, 'versions.db')
+    os.makedirs(config_dir)
+
+    proc, log_path = start_monitor(workdir, config_dir, db_path, args)
+    checkpoint(db_path)
+    initial_size = db_size(db_path)
+    watcher = RowWatcher(db_path, args.poll_interval)
+    watcher.start()
+
+    rng = random.Random(args.seed)
+    driver = Driver(config_dir, args.rate)
+    started = time.monotonic()
+    try:
+        SCENARIOS[pattern](driver, rng, args)
+    except BaseException:
+        watcher.stop()
+        stop_monitor(proc)
+        raise
+    write_seconds = time.monotonic() - started
+    writes_done = time.time()
+
+    # Итоговое состояние каждого файла должно попасть в базу; промежуточные
+    # состояния внутри окна тишины монитор вправе объединить
+    final_states = {}
+    for rel_path, digest, written_at in driver.writes:
+        final_states[rel_path] = (digest, written_at)
+    deadline = time.monotonic() + args.settle_timeout
+    while time.monotonic() < deadline:
+        if all((rel_path, digest) in watcher.seen for rel_path, (digest, _) in final_states.items()):
+            break
+        time.sleep(args.poll_interval)
+    watcher.stop()
+    rusage = stop_monitor(proc)
+    checkpoint(db_path)
+    final_size = db_size(db_path)
+
+    latencies = []
+    last_seen = None
+    for rel_path, digest, written_at in driver.writes:
+        seen_at = watcher.seen.get((rel_path, digest))
+        # Более раннее появление того же содержимого - это предыдущая запись, а не эта
+        if seen_at is not None and seen_at >= written_at:
+            latencies.append((seen_at - written_at) * 1000)
+    for rel_path, (digest, _) in final_states.items():
+        seen_at = watcher.seen.get((rel_path, digest))
+        if seen_at is not None:
+            last_seen = seen_at if last_seen is None else max(last_seen, seen_at)
+    missing = sum(1 for rel_path, (digest, _) in final_states.items() if (rel_path, digest) not in watcher.seen)
+
+    monitor_stats = None
+    with open(log_path, encoding='utf-8', errors='replace') as f:
+        for line in f:
+            if line.startswith('Событий:'):
+                monitor_stats = line.strip()
+
+    cpu_seconds = rusage.ru_utime + rusage.ru_stime
+    operations = driver.operations
+    growth = final_size - initial_size
+    result = {
+        'pattern': pattern,
+        'operations': operations,
+        'writes': len(driver.writes),
+        'files': len(final_states),
+        'write_seconds': round(write_seconds, 4),
+        'offered_ops_per_sec': round(operations / write_seconds, 2) if write_seconds else None,
+        'versions_recorded': watcher.rows,
+        'final_states_missing': missing,
+        'drain_seconds': round(last_seen - writes_done, 4) if last_seen is not None else None,
+        'latency_ms': {
+            'samples': len(latencies),
+            'mean': round(sum(latencies) / len(latencies), 2) if latencies else None,
+            'p50': round(percentile(latencies, 0.5), 2) if latencies else None,
+            'p95': round(percentile(latencies, 0.95), 2) if latencies else None,
+            'p99': round(percentile(latencies, 0.99), 2) if latencies else None,
+            'max': round(max(latencies), 2) if latencies else None,
+        },
+        'db_bytes_added': growth,
+        'db_bytes_per_operation': round(growth / operations, 2) if operations else None,
+        'db_bytes_per_version': round(growth / watcher.rows, 2) if watcher.rows else None,
+        'cpu_seconds': round(cpu_seconds, 4),
+        'cpu_ms_per_operation': round(cpu_seconds * 1000 / operations, 4) if operations else None,
+        'peak_rss_kb': rusage.ru_maxrss,
+        'monitor_exit_code': proc.returncode,
+        'monitor_stats': monitor_stats,
+    }
+    if not args.keep:
+        shutil.rmtree(workdir)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест монитора Системы Контроля Версий')
+    parser.add_argument('--workdir', default='/tmp/version_control_benchmark', help='Рабочая директория теста')
+    parser.add_argument('--output', default='benchmark_results.json', help='Файл с результатами в JSON')
+    parser.add_argument('--patterns', nargs='+', default=PATTERNS, choices=PATTERNS,
+                        help='Сценарии: small - много мелких файлов, large - несколько крупных, '
+                             'swap - сохранения из редактора, deploy - массовая выкладка')
+    parser.add_argument('--events', type=int, default=2000, help='Число записей файлов в сценарии')
+    parser.add_argument('--rate', type=float, default=0, help='Темп файловых операций в секунду, 0 - без ограничения')
+    parser.add_argument('--files', type=int, default=500, help='Число различных файлов в сценариях small и swap')
+    parser.add_argument('--large-files', type=int, default=3, help='Число крупных файлов')
+    parser.add_argument('--large-lines', type=int, default=50000, help='Число строк в крупном файле')
+    parser.add_argument('--deploy-files', type=int, default=500, help='Число файлов в одной выкладке')
+    parser.add_argument('--deploy-interval', type=float, default=1.0, help='Пауза между выкладками в секундах')
+    parser.add_argument('--seed', type=int, default=42, help='Зерно генератора содержимого')
+    parser.add_argument('--debounce', type=float, default=0.5, help='Окно тишины монитора в секундах')
+    parser.add_argument('--storage', default='delta', choices=['full', 'delta'], help='Режим хранения версий')
+    parser.add_argument('--readers', type=int, default=None, help='Переопределить число потоков чтения монитора')
+    parser.add_argument('--queue-size', type=int, default=None, help='Переопределить размер очереди записи')
+    parser.add_argument('--poll-interval', type=float, default=0.005, help='Период опроса базы в секундах')
+    parser.add_argument('--settle-timeout', type=float, default=60, help='Сколько ждать записи итоговых версий')
+    parser.add_argument('--keep', action='store_true', help='Не удалять рабочие директории')
+    args = parser.parse_args()
+
+    results = []
+    for pattern in args.patterns:
+        print(f'Сценарий {pattern}...')
+        results.append(benchmark_pattern(pattern, args))
+
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'environment': {
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'parameters': {key: value for key, value in vars(args).items() if key not in ('output', 'keep')},
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    for result in results:
+        latency = result['latency_ms']
+        print(f"{result['pattern']:>7}: {result['operations']} операций ({result['offered_ops_per_sec']} оп/с), "
+              f"версий {result['versions_recorded']}, потеряно {result['final_states_missing']}, "
+              f"задержка p50 {latency['p50']} мс / p99 {latency['p99']} мс, "
+              f"база +{result['db_bytes_per_operation']} байт/оп, CPU {result['cpu_ms_per_operation']} мс/оп")
+    print(f'Результаты сохранены в {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -120,6 +120,63 @@ test_rollback() {
     fi
 }
 
+# Тест снимка состояния директории
+test_snapshot() {
+    echo "Тестирование снимка состояния..."
+    python3 $PYTHON_SCRIPT snapshot --at "$(date '+%Y-%m-%d %H:%M:%S')" \
+        --config_dir $CONFIG_DIR --db_path $DB_PATH | grep -q "test.conf"
+    check_result "Снимок состояния"
+}
+
+# Тест миграции базы в другой режим хранения
+test_migrate() {
+    echo "Тестирование миграции базы..."
+    BEFORE=$(python3 $PYTHON_SCRIPT compare --file $CONFIG_DIR/test.conf \
+        --version1 1 --version2 2 \
+        --config_dir $CONFIG_DIR --db_path $DB_PATH)
+
+    python3 $PYTHON_SCRIPT migrate --storage delta --keyframe_interval 1 \
+        --config_dir $CONFIG_DIR --db_path $DB_PATH
+    check_result "Миграция базы"
+
+    # После перекодирования версии должны восстанавливаться как прежде
+    AFTER=$(python3 $PYTHON_SCRIPT compare --file $CONFIG_DIR/test.conf \
+        --version1 1 --version2 2 \
+        --config_dir $CONFIG_DIR --db_path $DB_PATH)
+    [ "$BEFORE" = "$AFTER" ]
+    check_result "Сравнение версий после миграции"
+}
+
+# Тест перевода базы старого формата в таблицу блобов
+test_legacy_upgrade() {
+    echo "Тестирование обновления базы старого формата..."
+    LEGACY_DB="$TEST_DIR/legacy.db"
+    python3 -c "$(cat <<'EOF_PY'
+import sqlite3, sys
+db_path, file_path = sys.argv[1], sys.argv[2]
+conn = sqlite3.connect(db_path)
+conn.execute('''CREATE TABLE versions (id INTEGER PRIMARY KEY AUTOINCREMENT, file_path TEXT,
+                version_number INTEGER, timestamp TEXT, author TEXT, description TEXT,
+                file_content BLOB)''')
+for number, content in enumerate([b'legacy=1\n', b'legacy=2\n'], 1):
+    conn.execute('''INSERT INTO versions (file_path, version_number, timestamp, author,
+                    description, file_content) VALUES (?, ?, '2024-01-01 00:00:00', 'test', '', ?)''',
+                 (file_path, number, content))
+conn.commit()
+EOF_PY
+)" "$LEGACY_DB" "legacy.conf"
+    check_result "Создание базы старого формата"
+
+    python3 $PYTHON_SCRIPT compare --file $CONFIG_DIR/legacy.conf \
+        --version1 1 --version2 2 \
+        --config_dir $CONFIG_DIR --db_path $LEGACY_DB | grep -q "+legacy=2"
+    check_result "Чтение версий после обновления базы"
+
+    # Старые столбцы удаляются после переноса содержимого в блобы
+    python3 -c "import sqlite3, sys; cols = [r[1] for r in sqlite3.connect(sys.argv[1]).execute('PRAGMA table_info(versions)')]; sys.exit('file_content' in cols)" "$LEGACY_DB"
+    check_result "Удаление столбцов старого формата"
+}
+
 # Остановка мониторинга
 stop_monitoring() {
     echo "Остановка мониторинга..."
@@ -171,6 +228,9 @@ main() {
     test_history
     test_compare
     test_rollback
+    test_snapshot
+    test_migrate
+    test_legacy_upgrade
     stop_monitoring
     
     # Финальная очистка
@@ -3,32 +3,586 @@
 
 import argparse
 import difflib
+import hashlib
+import json
 import os
+import queue
+import signal
 import sqlite3
+import struct
 import sys
+import tempfile
 import time
 import threading
+import zlib
+from bisect import bisect_left
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 
+# Содержимое версий хранится в таблице blobs по SHA-256, один раз для всех
+# версий и файлов с одинаковым содержимым. Режимы хранения блоба:
+#   full     - полное несжатое содержимое
+#   keyframe - полное содержимое, сжатое zlib (опорный кадр)
+#   delta    - сжатая дельта относительно блоба base_hash (предыдущей версии файла)
+# В базах старых форматов содержимое лежало прямо в versions.file_content
+# (полностью, либо опорным кадром или дельтой с base_version); при открытии
+# такая база один раз переводится в таблицу блобов (схема версии 3)
+STORAGE_MODES = ('full', 'delta')
+DEFAULT_STORAGE = 'delta'
+DEFAULT_KEYFRAME_INTERVAL = 10
+
+# Окно тишины (в секундах): события по одному пути копятся, пока файл не
+# перестанет меняться, и записывается только итоговое состояние
+DEFAULT_DEBOUNCE = 0.5
+# Если файл меняется непрерывно, версия всё равно записывается не реже,
+# чем раз в DEBOUNCE_MAX_DELAY_FACTOR окон
+DEBOUNCE_MAX_DELAY_FACTOR = 10
+
+# Все записи в базу выполняет один поток-писатель. Файлы читают и хешируют
+# потоки-читатели и передают результат писателю через ограниченную очередь:
+# если писатель не успевает, ждут читатели, а не поток наблюдателя
+DEFAULT_QUEUE_SIZE = 1000
+DEFAULT_READERS = 4
+# Сколько версий писатель записывает одной транзакцией
+WRITER_BATCH_SIZE = 500
+
+# Версия схемы базы (PRAGMA user_version). Версия 2: уникальный индекс
+# (file_path, version_number), таблица file_heads и журнал WAL. Версия 3:
+# всё содержимое в blobs, столбцы file_content, storage и base_version удалены
+SCHEMA_VERSION = 3
+# Размер кэша страниц SQLite на соединение, в КБ
+DB_CACHE_SIZE_KB = 16 * 1024
+# Сколько ждать освобождения блокировки другой транзакцией, в мс
+DB_BUSY_TIMEOUT_MS = 5000
+
+# Формат столбца versions.timestamp; строки в нём сравниваются как текст
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+# Размер блока при потоковой записи и хешировании файлов
+IO_CHUNK_SIZE = 1024 * 1024
+
+# Пределы кэшей запросов (в байтах): восстановленное содержимое версий
+# и готовые диффы; при переполнении вытесняются давно не использованные записи
+CONTENT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+DIFF_CACHE_MAX_BYTES = 16 * 1024 * 1024
+# Начиная с этого суммарного числа строк сравнение идёт по хешам строк
+LARGE_DIFF_LINES = 5000
+# Число строк контекста в унифицированном диффе
+DIFF_CONTEXT_LINES = 3
+
+# Коды операций дельты: копирование строк базовой версии и вставка новых данных
+DELTA_COPY = b'C'
+DELTA_INSERT = b'I'
+
+
+def make_delta(base, target):
+    """
+    Строит построчную дельту, превращающую base в target, и сжимает её zlib.
+    """
+    base_lines = base.splitlines(keepends=True)
+    target_lines = target.splitlines(keepends=True)
+    matcher = difflib.SequenceMatcher(None, base_lines, target_lines, autojunk=False)
+    ops = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            ops.append(DELTA_COPY + struct.pack('>II', i1, i2 - i1))
+        elif j2 > j1:
+            data = b''.join(target_lines[j1:j2])
+            ops.append(DELTA_INSERT + struct.pack('>I', len(data)) + data)
+    return zlib.compress(b''.join(ops))
+
+
+def apply_delta(base, delta):
+    """
+    Применяет сжатую дельту из make_delta к содержимому base.
+    """
+    base_lines = base.splitlines(keepends=True)
+    data = zlib.decompress(delta)
+    result = []
+    pos = 0
+    while pos < len(data):
+        op = data[pos:pos + 1]
+        if op == DELTA_COPY:
+            start, count = struct.unpack_from('>II', data, pos + 1)
+            result.extend(base_lines[start:start + count])
+            pos += 9
+        elif op == DELTA_INSERT:
+            (length,) = struct.unpack_from('>I', data, pos + 1)
+            result.append(data[pos + 5:pos + 5 + length])
+            pos += 5 + length
+        else:
+            raise ValueError(f'Повреждённая дельта: неизвестная операция {op!r}')
+    return b''.join(result)
+
+
+def connect_db(db_path):
+    """
+    Открывает соединение с базой и настраивает его: в режиме WAL достаточно
+    synchronous=NORMAL (fsync только при контрольной точке), увеличенный кэш
+    страниц и ожидание блокировки вместо немедленной ошибки.
+    """
+    conn = sqlite3.connect(db_path, timeout=DB_BUSY_TIMEOUT_MS / 1000)
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA cache_size=-{DB_CACHE_SIZE_KB}')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    return conn
+
+
+def update_head(cursor, rel_path, version_number, digest):
+    """
+    Обновляет запись о последней версии файла в таблице file_heads.
+    """
+    cursor.execute('''
+        INSERT INTO file_heads (file_path, last_version, content_hash) VALUES (?, ?, ?)
+        ON CONFLICT(file_path) DO UPDATE SET
+            last_version=excluded.last_version, content_hash=excluded.content_hash
+    ''', (rel_path, version_number, digest))
+
+
+def rebuild_heads(cursor):
+    """
+    Заполняет file_heads заново по таблице versions.
+    """
+    cursor.execute('DELETE FROM file_heads')
+    cursor.execute('''
+        INSERT INTO file_heads (file_path, last_version, content_hash)
+        SELECT v.file_path, v.version_number, v.content_hash
+        FROM versions v
+        JOIN (SELECT file_path, MAX(version_number) AS last_version
+              FROM versions GROUP BY file_path) h
+          ON v.file_path = h.file_path AND v.version_number = h.last_version
+    ''')
+
+
+def update_file_stat(cursor, rel_path, stat):
+    """
+    Запоминает размер и mtime файла, содержимое которого обработано.
+    stat=None удаляет запись (файл удалён).
+    """
+    if stat is None:
+        cursor.execute('DELETE FROM file_stats WHERE file_path=?', (rel_path,))
+    else:
+        cursor.execute('''
+            INSERT INTO file_stats (file_path, size, mtime_ns) VALUES (?, ?, ?)
+            ON CONFLICT(file_path) DO UPDATE SET size=excluded.size, mtime_ns=excluded.mtime_ns
+        ''', (rel_path, stat.st_size, stat.st_mtime_ns))
+
+
+def scan_tree(root):
+    """
+    Обходит директорию и возвращает {относительный путь: (размер, mtime_ns)}
+    для всех файлов. Символические ссылки на файлы разыменовываются, как при
+    чтении содержимого, чтобы stat совпадал с запомненным в file_stats.
+    """
+    result = {}
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        try:
+            entries = list(os.scandir(directory))
+        except OSError as e:
+            print(f'Ошибка при чтении директории {directory}: {e}')
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                    continue
+                st = entry.stat()
+            except OSError:
+                continue
+            result[os.path.relpath(entry.path, root)] = (st.st_size, st.st_mtime_ns)
+    return result
+
+
+class LRUCache:
+    """
+    Потокобезопасный LRU-кэш с ограничением суммарного размера значений.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.items = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self.items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, value, size=None):
+        if size is None:
+            size = len(value)
+        # Значение больше всего кэша не сохраняем, чтобы не вытеснять всё остальное
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            old = self.items.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            self.items[key] = (value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted_size) = self.items.popitem(last=False)
+                self.size -= evicted_size
+
+
+def format_unified_range(start, stop):
+    # Диапазон строк заголовка @@ в том же виде, что у difflib.unified_diff
+    beginning = start + 1
+    length = stop - start
+    if length == 1:
+        return str(beginning)
+    if not length:
+        beginning -= 1
+    return f'{beginning},{length}'
+
+
+def line_hash_opcodes(ids1, ids2, offset1=0, offset2=0):
+    """
+    Операции сравнения двух списков идентификаторов строк. Опорами служат
+    строки, которые встречаются ровно один раз в каждом списке: из них
+    выбирается наибольшая возрастающая последовательность (как в patience
+    diff), и SequenceMatcher запускается только на коротких участках между
+    опорами, а не на всём файле.
+    """
+    counts1 = Counter(ids1)
+    counts2 = Counter(ids2)
+    unique2 = {line_id: j for j, line_id in enumerate(ids2)
+               if counts2[line_id] == 1 and counts1.get(line_id) == 1}
+    pairs = [(i, unique2[line_id]) for i, line_id in enumerate(ids1) if line_id in unique2]
+
+    # Наибольшая возрастающая по j подпоследовательность пар за O(n log n)
+    tails = []
+    tail_index = []
+    previous = [None] * len(pairs)
+    for k, (_, j) in enumerate(pairs):
+        position = bisect_left(tails, j)
+        if position == len(tails):
+            tails.append(j)
+            tail_index.append(k)
+        else:
+            tails[position] = j
+            tail_index[position] = k
+        previous[k] = tail_index[position - 1] if position else None
+    anchors = []
+    k = tail_index[-1] if tail_index else None
+    while k is not None:
+        anchors.append(pairs[k])
+        k = previous[k]
+    anchors.reverse()
+
+    codes = []
+    start1 = start2 = 0
+    for i, j in anchors + [(len(ids1), len(ids2))]:
+        if start1 < i and start2 < j:
+            matcher = difflib.SequenceMatcher(None, ids1[start1:i], ids2[start2:j], autojunk=False)
+            for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+                codes.append((tag, i1 + start1, i2 + start1, j1 + start2, j2 + start2))
+        elif start1 < i:
+            codes.append(('delete', start1, i, start2, start2))
+        elif start2 < j:
+            codes.append(('insert', start1, start1, start2, j))
+        if i < len(ids1):
+            codes.append(('equal', i, i + 1, j, j + 1))
+        start1, start2 = i + 1, j + 1
+
+    # Соседние совпадающие участки объединяются, индексы сдвигаются на offset
+    merged = []
+    for tag, i1, i2, j1, j2 in codes:
+        if merged and tag == 'equal' and merged[-1][0] == 'equal':
+            merged[-1] = ('equal', merged[-1][1], i2 + offset1, merged[-1][3], j2 + offset2)
+        else:
+            merged.append((tag, i1 + offset1, i2 + offset1, j1 + offset2, j2 + offset2))
+    return merged
+
+
+def line_hash_diff(lines1, lines2, fromfile, tofile, context=DIFF_CONTEXT_LINES):
+    """
+    Унифицированный дифф для больших файлов. Строки заменяются целыми
+    идентификаторами (одинаковые строки - одинаковый идентификатор), общие
+    начало и конец отбрасываются сразу, и только изменённая середина
+    сравнивается через line_hash_opcodes. Формат вывода совпадает с
+    difflib.unified_diff(lineterm=''), хотя при неоднозначности строки
+    могут быть сопоставлены иначе.
+    """
+    len1, len2 = len(lines1), len(lines2)
+    prefix = 0
+    while prefix < min(len1, len2) and lines1[prefix] == lines2[prefix]:
+        prefix += 1
+    suffix = 0
+    while (suffix < min(len1, len2) - prefix
+           and lines1[len1 - 1 - suffix] == lines2[len2 - 1 - suffix]):
+        suffix += 1
+    if prefix == len1 == len2:
+        return []
+
+    # Идентификаторы нужны только для изменённой середины
+    ids = {}
+    ids1 = [ids.setdefault(line, len(ids)) for line in lines1[prefix:len1 - suffix]]
+    ids2 = [ids.setdefault(line, len(ids)) for line in lines2[prefix:len2 - suffix]]
+    codes = []
+    if prefix:
+        codes.append(('equal', 0, prefix, 0, prefix))
+    codes.extend(line_hash_opcodes(ids1, ids2, prefix, prefix))
+    if suffix:
+        codes.append(('equal', len1 - suffix, len1, len2 - suffix, len2))
+
+    # Группировка изменений с контекстом, как в SequenceMatcher.get_grouped_opcodes
+    if codes[0][0] == 'equal':
+        tag, i1, i2, j1, j2 = codes[0]
+        codes[0] = tag, max(i1, i2 - context), i2, max(j1, j2 - context), j2
+    if codes[-1][0] == 'equal':
+        tag, i1, i2, j1, j2 = codes[-1]
+        codes[-1] = tag, i1, min(i2, i1 + context), j1, min(j2, j1 + context)
+    groups = []
+    group = []
+    for tag, i1, i2, j1, j2 in codes:
+        if tag == 'equal' and i2 - i1 > context * 2:
+            group.append((tag, i1, min(i2, i1 + context), j1, min(j2, j1 + context)))
+            groups.append(group)
+            group = []
+            i1, j1 = max(i1, i2 - context), max(j1, j2 - context)
+        group.append((tag, i1, i2, j1, j2))
+    if group and not (len(group) == 1 and group[0][0] == 'equal'):
+        groups.append(group)
+
+    result = [f'--- {fromfile}', f'+++ {tofile}']
+    for group in groups:
+        first, last = group[0], group[-1]
+        result.append(f'@@ -{format_unified_range(first[1], last[2])} '
+                      f'+{format_unified_range(first[3], last[4])} @@')
+        for tag, i1, i2, j1, j2 in group:
+            if tag == 'equal':
+                result.extend(' ' + line for line in lines1[i1:i2])
+                continue
+            if tag in ('replace', 'delete'):
+                result.extend('-' + line for line in lines1[i1:i2])
+            if tag in ('replace', 'insert'):
+                result.extend('+' + line for line in lines2[j1:j2])
+    return result
+
+
+def parse_timestamp(value):
+    """
+    Разбирает момент времени для --at: 'YYYY-MM-DD HH:MM:SS', ISO 8601 или
+    только дату (полночь). Возвращает строку в формате столбца timestamp.
+    """
+    try:
+        return datetime.fromisoformat(value.strip()).strftime(TIMESTAMP_FORMAT)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f'Неверный формат времени: {value} (ожидается ГГГГ-ММ-ДД или ГГГГ-ММ-ДД ЧЧ:ММ:СС)')
+
+
+def hash_file(file_path):
+    """
+    Считает SHA-256 файла, читая его блоками.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(IO_CHUNK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def write_blob(cursor, digest, f):
+    """
+    Записывает содержимое блоба в открытый файл. Данные строки читаются из
+    базы целиком: полный блоб записывается как есть, опорный кадр
+    распаковывается в файл блоками, так что в памяти не держится его
+    распакованная копия; дельты восстанавливаются через load_blob.
+    """
+    cursor.execute('SELECT storage, data FROM blobs WHERE hash=?', (digest,))
+    row = cursor.fetchone()
+    if row is None:
+        raise ValueError(f'Не найден блоб {digest}')
+    storage, data = row
+    if storage == 'full':
+        f.write(data)
+    elif storage == 'keyframe':
+        decompressor = zlib.decompressobj()
+        for offset in range(0, len(data), IO_CHUNK_SIZE):
+            f.write(decompressor.decompress(data[offset:offset + IO_CHUNK_SIZE]))
+        f.write(decompressor.flush())
+    else:
+        f.write(load_blob(cursor, digest))
+
+
+def hash_content(content):
+    """
+    Возвращает SHA-256 содержимого в шестнадцатеричном виде.
+    """
+    return hashlib.sha256(content).hexdigest()
+
+
+def create_versions_table(cursor, table='versions'):
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {table} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            file_path TEXT,
+            version_number INTEGER,
+            timestamp TEXT,
+            author TEXT,
+            description TEXT,
+            content_hash TEXT
+        )
+    ''')
+
+
+def create_blobs_table(cursor, table='blobs'):
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {table} (
+            hash TEXT PRIMARY KEY,
+            storage TEXT,
+            base_hash TEXT,
+            depth INTEGER,
+            size INTEGER,
+            data BLOB
+        )
+    ''')
+
+
+def store_blob(cursor, content, digest, base, storage, keyframe_interval, table='blobs'):
+    """
+    Сохраняет содержимое в таблицу блобов, если блоба с таким хешем ещё нет.
+    base - (хеш, содержимое) предыдущей версии файла или None; относительно
+    него строится дельта, пока цепочка короче интервала опорных кадров.
+    Возвращает True, если блоб был записан.
+    """
+    cursor.execute(f'SELECT 1 FROM {table} WHERE hash=?', (digest,))
+    if cursor.fetchone():
+        return False
+    if storage == 'full':
+        row = ('full', None, 0, content)
+    else:
+        row = ('keyframe', None, 0, zlib.compress(content))
+        if base is not None:
+            base_hash, base_content = base
+            cursor.execute(f'SELECT depth FROM {table} WHERE hash=?', (base_hash,))
+            base_row = cursor.fetchone()
+            # Цепочка не длиннее интервала, иначе восстановление становится дорогим
+            if base_row and base_row[0] + 1 < keyframe_interval:
+                delta = make_delta(base_content, content)
+                if len(delta) < len(row[3]):
+                    row = ('delta', base_hash, base_row[0] + 1, delta)
+    cursor.execute(f'''
+        INSERT INTO {table} (hash, storage, base_hash, depth, size, data)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (digest, row[0], row[1], row[2], len(content), row[3]))
+    return True
+
+
+def load_blob(cursor, digest, table='blobs'):
+    """
+    Восстанавливает содержимое блоба: одним рекурсивным запросом читает
+    цепочку дельт до опорного кадра и применяет её.
+    """
+    cursor.execute(f'''
+        WITH RECURSIVE chain(level, storage, base_hash, data) AS (
+            SELECT 0, storage, base_hash, data FROM {table} WHERE hash=?
+            UNION ALL
+            SELECT chain.level + 1, b.storage, b.base_hash, b.data
+            FROM {table} b JOIN chain ON b.hash = chain.base_hash
+            WHERE chain.storage = 'delta'
+        )
+        SELECT storage, data FROM chain ORDER BY level DESC
+    ''', (digest,))
+    chain = cursor.fetchall()
+    if not chain or chain[0][0] == 'delta':
+        raise ValueError(f'Не найден опорный кадр для блоба {digest}')
+    storage, data = chain[0]
+    content = zlib.decompress(data) if storage == 'keyframe' else data
+    for _, delta in chain[1:]:
+        content = apply_delta(content, delta)
+    return content
+
+
+def decode_legacy_rows(rows):
+    """
+    Восстанавливает содержимое строк versions старых форматов. rows -
+    (номер версии, хеш, storage, file_content) одного файла по порядку версий;
+    строки с хешем пропускаются. Возвращает {номер версии: содержимое}.
+    """
+    decoded = {}
+    for version_number, digest, storage, blob in rows:
+        if digest is not None or blob is None:
+            continue
+        if storage == 'keyframe':
+            decoded[version_number] = zlib.decompress(blob)
+        elif storage == 'delta':
+            # Дельта старого формата опирается на предыдущую версию файла
+            decoded[version_number] = apply_delta(decoded[version_number - 1], blob)
+        else:
+            decoded[version_number] = blob
+    return decoded
+
+
 class ConfigEventHandler(FileSystemEventHandler):
     """
     Обработчик событий файловой системы для отслеживания изменений в конфигурационных файлах.
     """
 
-    def __init__(self, config_dir, db_path):
+    def __init__(self, config_dir, db_path, storage=DEFAULT_STORAGE,
+                 keyframe_interval=DEFAULT_KEYFRAME_INTERVAL, debounce=DEFAULT_DEBOUNCE,
+                 queue_size=DEFAULT_QUEUE_SIZE, readers=DEFAULT_READERS):
         super().__init__()
         self.config_dir = config_dir
         self.db_path = db_path
-        # Создаём локальное подключение к БД для потока обработчика
+        self.storage = storage
+        self.keyframe_interval = keyframe_interval
+        self.debounce = debounce
+        self.readers = max(1, readers)
+        # Ожидающие записи пути: rel_path -> состояние накопленных событий
+        self.pending = {}
+        # Пути, которые прочитаны или читаются, но ещё не записаны: следующий
+        # сброс такого пути ждёт, чтобы более старое состояние не легло поверх нового
+        self.in_flight = set()
+        self.pending_lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.flusher = None
+        # Очередь прочитанных состояний файлов для потока-писателя
+        self.write_queue = queue.Queue(maxsize=max(1, queue_size))
+        self.reader_pool = None
+        self.writer = None
+        # Метрики очереди и записи
+        self.stats = {
+            'events': 0,
+            'versions': 0,
+            'skipped': 0,
+            'transactions': 0,
+            'max_queue_depth': 0,
+            'queue_full': 0,
+            'blocked_seconds': 0.0,
+            'write_seconds': 0.0,
+        }
+        self.stats_lock = threading.Lock()
+        # Соединение с БД используется только тем потоком, который пишет
         self.local = threading.local()
+        # Последняя записанная версия каждого файла: (номер, хеш); удалению
+        # соответствует хеш None
+        self.last_versions = {}
+        self.last_versions_lock = threading.Lock()
+        # Содержимое по хешу для построения дельт, чтобы не восстанавливать
+        # цепочку из БД при каждом событии; размер ограничен
+        self.content_cache = LRUCache(CONTENT_CACHE_MAX_BYTES)
 
     def get_db(self):
         """
         Получает соединение с БД для текущего потока
         """
         if not hasattr(self.local, 'conn'):
-            self.local.conn = sqlite3.connect(self.db_path)
+            self.local.conn = connect_db(self.db_path)
             self.local.cursor = self.local.conn.cursor()
         return self.local.conn, self.local.cursor
 
@@ -44,44 +598,383 @@ class ConfigEventHandler(FileSystemEventHandler):
         if not event.is_directory:
             self.handle_event('deleted', event.src_path)
 
+    def on_moved(self, event):
+        # Редакторы часто сохраняют файл через переименование временной копии
+        if not event.is_directory:
+            self.handle_event('deleted', event.src_path)
+            self.handle_event('created', event.dest_path)
+
     def handle_event(self, event_type, file_path):
         """
-        Обрабатывает событие изменения файла: создаёт запись в базе данных.
+        Регистрирует событие изменения файла. Запись в базу откладывается до
+        окончания окна тишины; при нулевом окне версия передаётся на запись сразу.
         """
-        conn, cursor = self.get_db()
+        with self.stats_lock:
+            self.stats['events'] += 1
+        self.add_pending(event_type, file_path, time.time())
+        if self.debounce <= 0:
+            self.flush(force=True)
+
+    def add_pending(self, event_type, file_path, changed_at):
         rel_path = os.path.relpath(file_path, self.config_dir)
-        timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
-        author = os.getenv('USER') or os.getenv('USERNAME') or 'unknown'
-        description = f'File {event_type}'
+        now = time.monotonic()
+        with self.pending_lock:
+            entry = self.pending.get(rel_path)
+            if entry is None:
+                self.pending[rel_path] = {
+                    'file_path': file_path,
+                    'first_event': event_type,
+                    'first_seen': now,
+                    'last_seen': now,
+                    'changed_at': changed_at,
+                    'events': 1,
+                }
+            else:
+                entry['last_seen'] = now
+                entry['changed_at'] = changed_at
+                entry['events'] += 1
 
-        version_number = self.get_next_version(cursor, rel_path)
+    def reconcile(self):
+        """
+        Сверяет директорию с последним сохранённым состоянием файлов после
+        простоя монитора. Файлы, размер и mtime которых совпадают с
+        запомненными в file_stats, не читаются; остальные передаются на чтение
+        и хеширование в пул читателей, и версия записывается, только если
+        содержимое изменилось. Файлы, пропавшие с диска, записываются как
+        удалённые. Возвращает (число файлов, число кандидатов, число удалённых).
+        """
+        on_disk = scan_tree(self.config_dir)
+        conn = connect_db(self.db_path)
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SELECT file_path, size, mtime_ns FROM file_stats')
+            known = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+            # Файлы, последняя версия которых не является удалением
+            cursor.execute('''
+                SELECT h.file_path FROM file_heads h
+                JOIN versions v ON v.file_path = h.file_path AND v.version_number = h.last_version
+                WHERE v.content_hash IS NOT NULL
+            ''')
+            alive = [row[0] for row in cursor.fetchall()]
+        finally:
+            conn.close()
+
+        candidates = [rel_path for rel_path, stat in on_disk.items() if known.get(rel_path) != stat]
+        deleted = [rel_path for rel_path in alive if rel_path not in on_disk]
+        for rel_path in candidates:
+            # Время версии - время последнего изменения файла, а не время сверки
+            changed_at = on_disk[rel_path][1] / 1e9
+            self.add_pending('created' if rel_path not in known else 'modified',
+                             os.path.join(self.config_dir, rel_path), changed_at)
+        for rel_path in deleted:
+            self.add_pending('deleted', os.path.join(self.config_dir, rel_path), time.time())
+        if candidates or deleted:
+            self.flush(force=True)
+        return len(on_disk), len(candidates), len(deleted)
 
-        if event_type == 'deleted':
-            file_content = None
+    def wait_idle(self, poll_interval=0.05):
+        """
+        Ждёт, пока все накопленные события не будут записаны в базу.
+        """
+        while True:
+            with self.pending_lock:
+                if not self.pending and not self.in_flight:
+                    return
+            self.flush(force=True)
+            time.sleep(poll_interval)
+
+    def start(self):
+        """
+        Запускает поток-писатель, пул читателей и поток, сбрасывающий
+        накопленные события по окну тишины.
+        """
+        if self.writer is None:
+            self.stop_event.clear()
+            self.reader_pool = ThreadPoolExecutor(max_workers=self.readers)
+            self.writer = threading.Thread(target=self.writer_loop, daemon=True)
+            self.writer.start()
+            if self.debounce > 0:
+                self.flusher = threading.Thread(target=self.flush_loop, daemon=True)
+                self.flusher.start()
+
+    def stop(self):
+        """
+        Останавливает обработку: передаёт на запись все накопленные события,
+        дожидается читателей и писателя и выводит метрики.
+        """
+        self.stop_event.set()
+        if self.flusher is not None:
+            self.flusher.join()
+            self.flusher = None
+        # Пути, которые ещё в обработке, отдаются на запись после неё
+        while True:
+            with self.pending_lock:
+                if not self.pending:
+                    break
+            if not self.flush(force=True):
+                time.sleep(0.01)
+        if self.writer is not None:
+            self.reader_pool.shutdown(wait=True)
+            self.reader_pool = None
+            self.write_queue.put(None)
+            self.writer.join()
+            self.writer = None
+        print(self.format_stats())
+
+    def flush_loop(self):
+        interval = max(0.05, self.debounce / 2)
+        while not self.stop_event.wait(interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f'Ошибка при записи версий: {e}')
+
+    def flush(self, force=False):
+        """
+        Передаёт на чтение и запись пути, у которых истекло окно тишины.
+        Без запущенного писателя (start не вызывался) читает и записывает
+        их сразу в текущем потоке. Возвращает число переданных путей.
+        """
+        now = time.monotonic()
+        max_delay = self.debounce * DEBOUNCE_MAX_DELAY_FACTOR
+        with self.pending_lock:
+            due = [rel_path for rel_path, entry in self.pending.items()
+                   if rel_path not in self.in_flight
+                   and (force
+                        or now - entry['last_seen'] >= self.debounce
+                        or now - entry['first_seen'] >= max_delay)]
+            batch = [(rel_path, self.pending.pop(rel_path)) for rel_path in sorted(due)]
+            self.in_flight.update(due)
+        if not batch:
+            return 0
+
+        if self.reader_pool is None:
+            self.write_batch([self.read_state(rel_path, entry) for rel_path, entry in batch])
         else:
+            for rel_path, entry in batch:
+                self.reader_pool.submit(self.read_and_enqueue, rel_path, entry)
+        return len(batch)
+
+    def read_state(self, rel_path, entry):
+        """
+        Читает итоговое состояние файла и считает хеш содержимого.
+        Возвращает (rel_path, entry, существует ли файл, содержимое, хеш, stat).
+        """
+        file_path = entry['file_path']
+        try:
+            # stat берётся до чтения: если файл изменится во время чтения,
+            # при следующей сверке mtime не совпадёт и файл будет прочитан снова
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            return rel_path, entry, False, None, None, None
+        except OSError as e:
+            print(f'Ошибка при чтении файла {file_path}: {e}')
+            return rel_path, entry, True, None, None, None
+        try:
+            with open(file_path, 'rb') as f:
+                file_content = f.read()
+        except Exception as e:
+            print(f'Ошибка при чтении файла {file_path}: {e}')
+            return rel_path, entry, True, None, None, None
+        return rel_path, entry, True, file_content, hash_content(file_content), stat
+
+    def read_and_enqueue(self, rel_path, entry):
+        try:
+            state = self.read_state(rel_path, entry)
+        except Exception as e:
+            print(f'Ошибка при чтении файла {rel_path}: {e}')
+            state = (rel_path, entry, True, None, None, None)
+        try:
+            self.write_queue.put_nowait(state)
+        except queue.Full:
+            # Писатель не успевает: читатель ждёт места в очереди
+            started = time.monotonic()
+            self.write_queue.put(state)
+            with self.stats_lock:
+                self.stats['queue_full'] += 1
+                self.stats['blocked_seconds'] += time.monotonic() - started
+        with self.stats_lock:
+            self.stats['max_queue_depth'] = max(self.stats['max_queue_depth'], self.write_queue.qsize())
+
+    def writer_loop(self):
+        """
+        Единственный поток, пишущий в базу: забирает из очереди всё, что
+        накопилось (до WRITER_BATCH_SIZE), и записывает одной транзакцией.
+        """
+        running = True
+        while running:
+            state = self.write_queue.get()
+            if state is None:
+                break
+            batch = [state]
+            while len(batch) < WRITER_BATCH_SIZE:
+                try:
+                    state = self.write_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if state is None:
+                    running = False
+                    break
+                batch.append(state)
             try:
-                with open(file_path, 'rb') as f:
-                    file_content = f.read()
+                self.write_batch(batch)
             except Exception as e:
-                print(f'Ошибка при чтении файла {file_path}: {e}')
-                file_content = None
+                print(f'Ошибка при записи версий: {e}')
+
+    def write_batch(self, states):
+        """
+        Записывает прочитанные состояния файлов одной транзакцией.
+        Возвращает число записанных версий.
+        """
+        started = time.monotonic()
+        conn, cursor = self.get_db()
+        saved = []
+        events = 0
+        try:
+            for state in states:
+                rel_path, entry = state[0], state[1]
+                events += entry['events']
+                try:
+                    result = self.record_version(cursor, state)
+                except (OSError, sqlite3.Error, ValueError) as e:
+                    print(f'Ошибка при сохранении версии {rel_path}: {e}')
+                    continue
+                if result:
+                    saved.append(result)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            with self.pending_lock:
+                self.in_flight.difference_update(state[0] for state in states)
+        # Кэш последних версий обновляется только после фиксации транзакции
+        with self.last_versions_lock:
+            for rel_path, version_number, digest, file_content in saved:
+                self.last_versions[rel_path] = (version_number, digest)
+        for _, _, digest, file_content in saved:
+            if file_content is not None:
+                self.content_cache.put(digest, file_content)
+        with self.stats_lock:
+            self.stats['versions'] += len(saved)
+            self.stats['skipped'] += len(states) - len(saved)
+            self.stats['transactions'] += 1
+            self.stats['write_seconds'] += time.monotonic() - started
+        for rel_path, version_number, _, _ in saved:
+            print(f'Версия {version_number} сохранена для {rel_path}')
+        if events > len(saved) and len(states) > 1:
+            print(f'Объединено событий: {events}, сохранено версий: {len(saved)}')
+        return len(saved)
+
+    def get_stats(self):
+        """
+        Возвращает копию метрик обработки с текущей глубиной очереди.
+        """
+        with self.stats_lock:
+            stats = dict(self.stats)
+        with self.pending_lock:
+            stats['pending'] = len(self.pending)
+        stats['queue_depth'] = self.write_queue.qsize()
+        stats['queue_size'] = self.write_queue.maxsize
+        return stats
+
+    def format_stats(self):
+        stats = self.get_stats()
+        return (f"Событий: {stats['events']}, сохранено версий: {stats['versions']}, "
+                f"пропущено: {stats['skipped']}, транзакций: {stats['transactions']}, "
+                f"макс. очередь: {stats['max_queue_depth']}/{stats['queue_size']}, "
+                f"ожиданий при полной очереди: {stats['queue_full']} "
+                f"({stats['blocked_seconds']:.2f} с), время записи: {stats['write_seconds']:.2f} с")
+
+    def record_version(self, cursor, state):
+        """
+        Добавляет в текущую транзакцию версию с итоговым состоянием файла.
+        Возвращает (rel_path, номер версии, хеш, содержимое) или None, если
+        записывать нечего: содержимое не изменилось (touch, chmod, повторное
+        сохранение), файл не удалось прочитать или временный файл создан и
+        удалён внутри одного окна.
+        """
+        rel_path, entry, exists, file_content, digest, stat = state
+        if exists and file_content is None:
+            return None
+        update_file_stat(cursor, rel_path, stat)
+        version_number = self.get_next_version(cursor, rel_path)
+        previous = self.get_previous_version(cursor, rel_path, version_number - 1)
+
+        if exists:
+            event_type = 'created' if entry['first_event'] == 'created' and previous is None else 'modified'
+            if previous is not None and previous[1] == digest:
+                return None
+            base = self.get_base(cursor, rel_path, previous)
+            store_blob(cursor, file_content, digest, base, self.storage, self.keyframe_interval)
+        else:
+            event_type = 'deleted'
+            # Удаление файла, которого нет в истории или который уже удалён, не версионируем
+            if previous is None or previous[1] is None:
+                return None
+
+        timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry['changed_at']))
+        author = os.getenv('USER') or os.getenv('USERNAME') or 'unknown'
+        description = f'File {event_type}'
 
         cursor.execute('''
-            INSERT INTO versions (file_path, version_number, timestamp, author, description, file_content)
+            INSERT INTO versions (file_path, version_number, timestamp, author, description, content_hash)
             VALUES (?, ?, ?, ?, ?, ?)
-        ''', (rel_path, version_number, timestamp, author, description, file_content))
-        conn.commit()
-        print(f'Версия {version_number} сохранена для {rel_path}')
+        ''', (rel_path, version_number, timestamp, author, description, digest))
+        update_head(cursor, rel_path, version_number, digest)
+        return rel_path, version_number, digest, file_content
+
+    def get_previous_version(self, cursor, rel_path, version_number):
+        """
+        Возвращает (номер, хеш) предыдущей версии файла: из памяти, если она
+        записана этим процессом, иначе из БД. У удаления хеш None.
+        """
+        if version_number < 1:
+            return None
+        with self.last_versions_lock:
+            cached = self.last_versions.get(rel_path)
+        if cached and cached[0] == version_number:
+            return cached
+        cursor.execute('''
+            SELECT content_hash FROM versions WHERE file_path=? AND version_number=?
+        ''', (rel_path, version_number))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return version_number, row[0]
+
+    def get_base(self, cursor, rel_path, previous):
+        """
+        Возвращает (хеш, содержимое) предыдущей версии как основу дельты или
+        None, если её нет или её не удалось восстановить.
+        """
+        if previous is None or previous[1] is None:
+            return None
+        digest = previous[1]
+        content = self.content_cache.get(digest)
+        if content is None:
+            try:
+                content = load_blob(cursor, digest)
+            except (ValueError, KeyError, zlib.error) as e:
+                print(f'Ошибка при восстановлении версии {previous[0]} для {rel_path}: {e}')
+                return None
+            self.content_cache.put(digest, content)
+        return digest, content
 
     def get_next_version(self, cursor, file_path):
         """
-        Получает следующий номер версии для указанного файла.
+        Получает следующий номер версии для указанного файла из file_heads.
         """
         cursor.execute('''
-            SELECT MAX(version_number) FROM versions WHERE file_path=?
+            SELECT last_version FROM file_heads WHERE file_path=?
         ''', (file_path,))
-
         result = cursor.fetchone()
+        if result is None:
+            # Файл мог быть записан в обход file_heads: проверяем по индексу versions
+            cursor.execute('''
+                SELECT MAX(version_number) FROM versions WHERE file_path=?
+            ''', (file_path,))
+            result = cursor.fetchone()
         return (result[0] or 0) + 1
 
 
@@ -90,128 +983,499 @@ class VersionControl:
     Класс, реализующий систему контроля версий для конфигурационных файлов.
     """
 
-    def __init__(self, config_dir, db_path):
+    def __init__(self, config_dir, db_path, storage=DEFAULT_STORAGE,
+                 keyframe_interval=DEFAULT_KEYFRAME_INTERVAL, debounce=DEFAULT_DEBOUNCE,
+                 queue_size=DEFAULT_QUEUE_SIZE, readers=DEFAULT_READERS, reconcile=True):
         self.config_dir = os.path.abspath(config_dir)
         self.db_path = os.path.abspath(db_path)
+        self.storage = storage
+        self.keyframe_interval = max(1, keyframe_interval)
+        self.debounce = max(0.0, debounce)
+        self.queue_size = queue_size
+        self.readers = readers
+        self.reconcile = reconcile
+        self.conn = None
+        self.content_cache = LRUCache(CONTENT_CACHE_MAX_BYTES)
+        self.diff_cache = LRUCache(DIFF_CACHE_MAX_BYTES)
         self.init_db()
 
     def init_db(self):
         """
         Инициализирует базу данных SQLite для хранения версий файлов.
         """
-        with sqlite3.connect(self.db_path) as conn:
+        with connect_db(self.db_path) as conn:
             cursor = conn.cursor()
+            # Режим журнала сохраняется в файле базы: читатели не блокируют запись
+            cursor.execute('PRAGMA journal_mode=WAL')
+            create_versions_table(cursor)
+            # Базам, созданным до появления таблицы блобов, нужен столбец хеша;
+            # их содержимое переносится в блобы при обновлении схемы
+            cursor.execute('PRAGMA table_info(versions)')
+            if 'content_hash' not in {row[1] for row in cursor.fetchall()}:
+                cursor.execute('ALTER TABLE versions ADD COLUMN content_hash TEXT')
+            create_blobs_table(cursor)
             cursor.execute('''
-                CREATE TABLE IF NOT EXISTS versions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    file_path TEXT,
-                    version_number INTEGER,
-                    timestamp TEXT,
-                    author TEXT,
-                    description TEXT,
-                    file_content BLOB
+                CREATE TABLE IF NOT EXISTS file_heads (
+                    file_path TEXT PRIMARY KEY,
+                    last_version INTEGER,
+                    content_hash TEXT
+                )
+            ''')
+            # Размер и mtime последнего обработанного содержимого каждого файла
+            # для быстрой сверки директории при запуске монитора
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS file_stats (
+                    file_path TEXT PRIMARY KEY,
+                    size INTEGER,
+                    mtime_ns INTEGER
                 )
             ''')
             conn.commit()
+            cursor.execute('PRAGMA user_version')
+            if cursor.fetchone()[0] < SCHEMA_VERSION:
+                self.upgrade_schema(conn)
 
-    def compare_versions(self, file_path, version1, version2):
+    def upgrade_schema(self, conn):
         """
-        Сравнивает содержимое двух версий файла и возвращает разницу.
+        Обновляет схему существующей базы до SCHEMA_VERSION: перенумеровывает
+        версии файлов с повторяющимися номерами (их могли создать параллельные
+        обработчики старых версий), переносит содержимое строк старых форматов
+        в блобы, строит уникальный индекс и заполняет file_heads. Выполняется
+        одной транзакцией.
         """
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            rel_path = os.path.relpath(file_path, self.config_dir)
-
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT DISTINCT file_path FROM versions
+            GROUP BY file_path, version_number HAVING COUNT(*) > 1
+        ''')
+        duplicated = [row[0] for row in cursor.fetchall()]
+        for rel_path in duplicated:
             cursor.execute('''
-                SELECT file_content FROM versions 
-                WHERE file_path=? AND version_number=?
-            ''', (rel_path, version1))
-            result1 = cursor.fetchone()
-            if not result1 or not result1[0]:
-                print(f'Нет содержимого для {rel_path} версии {version1}')
-                return
+                SELECT id FROM versions WHERE file_path=? ORDER BY version_number, id
+            ''', (rel_path,))
+            ids = [row[0] for row in cursor.fetchall()]
+            cursor.executemany('UPDATE versions SET version_number=? WHERE id=?',
+                               [(number, row_id) for number, row_id in enumerate(ids, 1)])
+            print(f'Версии {rel_path} перенумерованы: найдены повторяющиеся номера')
+        cursor.execute('PRAGMA table_info(versions)')
+        if 'file_content' in {row[1] for row in cursor.fetchall()}:
+            self.convert_legacy_versions(cursor)
+        cursor.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_versions_path_version
+            ON versions (file_path, version_number)
+        ''')
+        rebuild_heads(cursor)
+        cursor.execute(f'PRAGMA user_version={SCHEMA_VERSION}')
+        conn.commit()
 
-            cursor.execute('''
-                SELECT file_content FROM versions 
-                WHERE file_path=? AND version_number=?
-            ''', (rel_path, version2))
-            result2 = cursor.fetchone()
-            if not result2 or not result2[0]:
-                print(f'Нет содержимого для {rel_path} версии {version2}')
-                return
-
-            content1 = result1[0].decode('utf-8', errors='replace').splitlines()
-            content2 = result2[0].decode('utf-8', errors='replace').splitlines()
-
-            diff = difflib.unified_diff(
-                content1,
-                content2,
-                fromfile=f'Version {version1}',
-                tofile=f'Version {version2}',
-                lineterm=''
-            )
-            return '\n'.join(diff)
+    def convert_legacy_versions(self, cursor):
+        """
+        Переносит содержимое строк старых форматов (file_content) в таблицу
+        блобов в текущем режиме хранения и пересоздаёт versions без столбцов
+        file_content, storage и base_version.
+        """
+        cursor.execute('PRAGMA table_info(versions)')
+        columns = {row[1] for row in cursor.fetchall()}
+        storage_column = 'storage' if 'storage' in columns else 'NULL'
+        cursor.execute('''
+            SELECT DISTINCT file_path FROM versions
+            WHERE content_hash IS NULL AND file_content IS NOT NULL
+        ''')
+        file_paths = [row[0] for row in cursor.fetchall()]
+        converted = 0
+        for rel_path in file_paths:
+            cursor.execute(f'''
+                SELECT id, version_number, content_hash, {storage_column}, file_content FROM versions
+                WHERE file_path=? ORDER BY version_number, id
+            ''', (rel_path,))
+            rows = cursor.fetchall()
+            decoded = decode_legacy_rows([row[1:] for row in rows])
+            updates = []
+            base = None
+            for row_id, version_number, digest, _, _ in rows:
+                if version_number in decoded:
+                    content = decoded[version_number]
+                    digest = hash_content(content)
+                    store_blob(cursor, content, digest, base, self.storage, self.keyframe_interval)
+                    updates.append((digest, row_id))
+                    base = (digest, content)
+                elif digest is not None:
+                    base = (digest, load_blob(cursor, digest))
+            cursor.executemany('UPDATE versions SET content_hash=? WHERE id=?', updates)
+            converted += len(updates)
+
+        cursor.execute('DROP TABLE IF EXISTS versions_new')
+        create_versions_table(cursor, 'versions_new')
+        cursor.execute('''
+            INSERT INTO versions_new (id, file_path, version_number, timestamp, author, description, content_hash)
+            SELECT id, file_path, version_number, timestamp, author, description, content_hash FROM versions
+        ''')
+        cursor.execute('DROP TABLE versions')
+        cursor.execute('ALTER TABLE versions_new RENAME TO versions')
+        print(f'Содержимое старого формата перенесено в блобы: версий {converted} ({len(file_paths)} файлов)')
+
+    def get_connection(self):
+        """
+        Возвращает соединение для запросов, открытое один раз на экземпляр.
+        """
+        if self.conn is None:
+            self.conn = connect_db(self.db_path)
+        return self.conn
+
+    def get_content(self, cursor, rel_path, version_number):
+        """
+        Возвращает (найдена ли версия, содержимое, хеш) через кэш
+        восстановленного содержимого. Блоб неизменяем, поэтому кэш по хешу
+        не требует сброса.
+        """
+        cursor.execute('''
+            SELECT content_hash FROM versions WHERE file_path=? AND version_number=?
+        ''', (rel_path, version_number))
+        row = cursor.fetchone()
+        if row is None:
+            return False, None, None
+        digest = row[0]
+        if digest is None:
+            return True, None, None
+        content = self.content_cache.get(digest)
+        if content is None:
+            content = load_blob(cursor, digest)
+            self.content_cache.put(digest, content)
+        return True, content, digest
+
+    def diff_versions(self, rel_path, version1, version2):
+        """
+        Возвращает строки унифицированного диффа двух версий файла (пустой
+        список, если они совпадают). Если у версии нет содержимого, бросает
+        LookupError с текстом ошибки.
+        """
+        cursor = self.get_connection().cursor()
+        # Версии с одинаковым хешем совпадают: содержимое можно не читать
+        cursor.execute('''
+            SELECT version_number, content_hash FROM versions
+            WHERE file_path=? AND version_number IN (?, ?)
+        ''', (rel_path, version1, version2))
+        hashes = dict(cursor.fetchall())
+        if hashes.get(version1) and hashes.get(version1) == hashes.get(version2):
+            return []
+
+        _, content1, digest1 = self.get_content(cursor, rel_path, version1)
+        if not content1:
+            raise LookupError(f'Нет содержимого для {rel_path} версии {version1}')
+        _, content2, digest2 = self.get_content(cursor, rel_path, version2)
+        if not content2:
+            raise LookupError(f'Нет содержимого для {rel_path} версии {version2}')
+
+        # Дифф однозначно определяется парой содержимых и подписями версий
+        cache_key = (digest1, digest2, version1, version2)
+        cached = self.diff_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        lines1 = content1.decode('utf-8', errors='replace').splitlines()
+        lines2 = content2.decode('utf-8', errors='replace').splitlines()
+        fromfile = f'Version {version1}'
+        tofile = f'Version {version2}'
+        if len(lines1) + len(lines2) >= LARGE_DIFF_LINES:
+            diff = line_hash_diff(lines1, lines2, fromfile, tofile)
+        else:
+            diff = list(difflib.unified_diff(lines1, lines2, fromfile=fromfile, tofile=tofile, lineterm=''))
+        self.diff_cache.put(cache_key, diff, sum(len(line) + 1 for line in diff))
+        return diff
+
+    def compare_versions(self, file_path, version1, version2):
+        """
+        Сравнивает содержимое двух версий файла и возвращает разницу.
+        """
+        rel_path = os.path.relpath(file_path, self.config_dir)
+        try:
+            return '\n'.join(self.diff_versions(rel_path, version1, version2))
+        except LookupError as e:
+            print(e)
+            return None
 
     def rollback(self, file_path, version_number):
         """
         Откатывает файл к указанной версии.
         """
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            rel_path = os.path.relpath(file_path, self.config_dir)
+        cursor = self.get_connection().cursor()
+        rel_path = os.path.relpath(file_path, self.config_dir)
 
-            cursor.execute('''
-                SELECT file_content FROM versions 
-                WHERE file_path=? AND version_number=?
-            ''', (rel_path, version_number))
-            result = cursor.fetchone()
-            if result and result[0]:
-                abs_file_path = os.path.join(self.config_dir, rel_path)
-                os.makedirs(os.path.dirname(abs_file_path), exist_ok=True)
-                with open(abs_file_path, 'wb') as f:
-                    f.write(result[0])
-                print(f'Файл {rel_path} откатан к версии {version_number}')
-            else:
-                print(f'Нет содержимого для {rel_path} версии {version_number}')
+        _, content, _ = self.get_content(cursor, rel_path, version_number)
+        if content:
+            abs_file_path = os.path.join(self.config_dir, rel_path)
+            os.makedirs(os.path.dirname(abs_file_path), exist_ok=True)
+            with open(abs_file_path, 'wb') as f:
+                f.write(content)
+            print(f'Файл {rel_path} откатан к версии {version_number}')
+        else:
+            print(f'Нет содержимого для {rel_path} версии {version_number}')
 
-    def show_history(self, file_path):
+    def get_history(self, rel_path, limit=None, since=None):
+        """
+        Возвращает историю файла по возрастанию номера версии: не раньше
+        момента since и не более limit последних версий.
+        """
+        cursor = self.get_connection().cursor()
+        query = '''
+            SELECT v.version_number, v.timestamp, v.author, v.description, v.content_hash,
+                   b.size
+            FROM versions v LEFT JOIN blobs b ON b.hash = v.content_hash
+            WHERE v.file_path=?
+        '''
+        params = [rel_path]
+        if since is not None:
+            query += ' AND v.timestamp >= ?'
+            params.append(since)
+        # Последние версии берутся с конца индекса (file_path, version_number)
+        query += ' ORDER BY v.version_number DESC'
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(limit)
+        cursor.execute(query, params)
+        return [
+            {
+                'version': version_number,
+                'timestamp': timestamp,
+                'author': author,
+                'description': description,
+                'content_hash': digest,
+                'size': size,
+            }
+            for version_number, timestamp, author, description, digest, size in reversed(cursor.fetchall())
+        ]
+
+    def show_history(self, file_path, limit=None, since=None, as_json=False):
         """
         Выводит историю изменений для указанного файла.
         """
-        with sqlite3.connect(self.db_path) as conn:
+        rel_path = os.path.relpath(file_path, self.config_dir)
+        history = self.get_history(rel_path, limit, since)
+        if as_json:
+            print_json({'file': rel_path, 'versions': history})
+        elif history:
+            print(f'История изменений для {rel_path}:')
+            for record in history:
+                print(f"  Версия: {record['version']}, Время: {record['timestamp']}, "
+                      f"Автор: {record['author']}, Описание: {record['description']}")
+        else:
+            print(f'Нет истории изменений для {rel_path}')
+
+    def resolve_tree(self, cursor, at):
+        """
+        Одним запросом находит последнюю версию каждого файла на момент at.
+        Возвращает список (путь, номер версии, время, хеш, размер, есть ли
+        содержимое); для удалённых файлов содержимого нет.
+        """
+        cursor.execute('''
+            SELECT v.file_path, v.version_number, v.timestamp, v.content_hash,
+                   b.size, v.content_hash IS NOT NULL
+            FROM versions v
+            JOIN (SELECT file_path, MAX(version_number) AS version_number
+                  FROM versions WHERE timestamp <= ? GROUP BY file_path) last
+              ON v.file_path = last.file_path AND v.version_number = last.version_number
+            LEFT JOIN blobs b ON b.hash = v.content_hash
+            ORDER BY v.file_path
+        ''', (at,))
+        return cursor.fetchall()
+
+    def snapshot(self, at, as_json=False):
+        """
+        Выводит состояние всех файлов на момент at.
+        """
+        tree = self.resolve_tree(self.get_connection().cursor(), at)
+        if as_json:
+            print_json({
+                'at': at,
+                'files': [
+                    {
+                        'file': rel_path,
+                        'version': version_number,
+                        'timestamp': timestamp,
+                        'content_hash': digest,
+                        'size': size if has_content else None,
+                        'deleted': not has_content,
+                    }
+                    for rel_path, version_number, timestamp, digest, size, has_content in tree
+                ],
+            })
+            return
+        if not tree:
+            print(f'Нет версий на момент {at}')
+            return
+        print(f'Состояние на {at}:')
+        for rel_path, version_number, timestamp, _, size, has_content in tree:
+            state = f'{size} байт' if has_content else 'удалён'
+            print(f'  {rel_path}: версия {version_number} ({timestamp}), {state}')
+
+    def rollback_tree(self, at, delete=False, dry_run=False):
+        """
+        Откатывает всю директорию к состоянию на момент at. Файлы, совпадающие
+        с нужной версией, пропускаются; остальные записываются атомарно (во
+        временный файл рядом и переименование). С delete=True также удаляются
+        файлы, которые на момент at были удалены или ещё не существовали.
+        """
+        restored = unchanged = removed = failed = 0
+        cursor = self.get_connection().cursor()
+        tree = self.resolve_tree(cursor, at)
+        if not tree:
+            print(f'Нет версий на момент {at}')
+            return
+        known = set()
+        for rel_path, version_number, _, digest, size, has_content in tree:
+            abs_file_path = os.path.join(self.config_dir, rel_path)
+            known.add(rel_path)
+            if not has_content:
+                if delete and os.path.lexists(abs_file_path):
+                    if not dry_run:
+                        os.remove(abs_file_path)
+                    print(f'Удалён {rel_path}')
+                    removed += 1
+                continue
+            try:
+                if self.file_matches(abs_file_path, digest, size):
+                    unchanged += 1
+                    continue
+                if not dry_run:
+                    self.write_version_atomic(cursor, abs_file_path, digest)
+                print(f'Файл {rel_path} откатан к версии {version_number}')
+                restored += 1
+            except (OSError, ValueError, zlib.error) as e:
+                print(f'Ошибка при откате {rel_path}: {e}')
+                failed += 1
+
+        if delete:
+            # Файлы, появившиеся после момента at
+            for rel_path in sorted(set(scan_tree(self.config_dir)) - known):
+                if not dry_run:
+                    os.remove(os.path.join(self.config_dir, rel_path))
+                print(f'Удалён {rel_path}')
+                removed += 1
+        prefix = 'Пробный запуск, без изменений. ' if dry_run else ''
+        print(f'{prefix}Откат к {at}: восстановлено {restored}, совпадает {unchanged}, '
+              f'удалено {removed}, ошибок {failed}')
+
+    def file_matches(self, abs_file_path, digest, size):
+        """
+        Проверяет, совпадает ли файл на диске с версией: сначала по размеру,
+        и только при совпадении размера - по хешу содержимого.
+        """
+        try:
+            if not os.path.isfile(abs_file_path) or os.path.getsize(abs_file_path) != size:
+                return False
+        except OSError:
+            return False
+        return hash_file(abs_file_path) == digest
+
+    def write_version_atomic(self, cursor, abs_file_path, digest):
+        """
+        Записывает версию во временный файл в той же директории и заменяет
+        им целевой файл, сохраняя права доступа существующего файла.
+        """
+        directory = os.path.dirname(abs_file_path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=f'.{os.path.basename(abs_file_path)}.', suffix='.tmp',
+                                        dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write_blob(cursor, digest, f)
+                f.flush()
+                os.fsync(f.fileno())
+            try:
+                os.chmod(tmp_path, os.stat(abs_file_path).st_mode & 0o7777)
+            except FileNotFoundError:
+                os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, abs_file_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def migrate_storage(self):
+        """
+        Перекодирует все блобы в текущем режиме хранения: восстанавливает
+        содержимое версий каждого файла по порядку и записывает его один раз
+        на хеш как опорный кадр, дельту или полное содержимое. Блобы, на
+        которые не ссылается ни одна версия, при этом удаляются. После
+        миграции база сжимается VACUUM. Размер базы измеряется после
+        контрольной точки, переносящей журнал WAL в основной файл.
+        """
+        with connect_db(self.db_path) as conn:
             cursor = conn.cursor()
-            rel_path = os.path.relpath(file_path, self.config_dir)
-            cursor.execute('''
-                SELECT version_number, timestamp, author, description 
-                FROM versions 
-                WHERE file_path=?
-                ORDER BY version_number
-            ''', (rel_path,))
-            history = cursor.fetchall()
-            if history:
-                print(f'История изменений для {rel_path}:')
-                for record in history:
-                    print(f'  Версия: {record[0]}, Время: {record[1]}, Автор: {record[2]}, Описание: {record[3]}')
-            else:
-                print(f'Нет истории изменений для {rel_path}')
+            cursor.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            size_before = os.path.getsize(self.db_path)
+            cursor.execute('DROP TABLE IF EXISTS blobs_new')
+            create_blobs_table(cursor, 'blobs_new')
+            cursor.execute('SELECT DISTINCT file_path FROM versions')
+            file_paths = [row[0] for row in cursor.fetchall()]
+            converted = 0
+            for rel_path in file_paths:
+                cursor.execute('''
+                    SELECT content_hash FROM versions WHERE file_path=? ORDER BY version_number
+                ''', (rel_path,))
+                base = None
+                for (digest,) in cursor.fetchall():
+                    # Записи об удалении не прерывают цепочку: база - последнее содержимое
+                    if digest is None:
+                        continue
+                    content = load_blob(cursor, digest)
+                    store_blob(cursor, content, digest, base, self.storage,
+                               self.keyframe_interval, 'blobs_new')
+                    base = (digest, content)
+                    converted += 1
+            cursor.execute('DROP TABLE blobs')
+            cursor.execute('ALTER TABLE blobs_new RENAME TO blobs')
+            cursor.execute('SELECT COUNT(*) FROM blobs')
+            blob_count = cursor.fetchone()[0]
+            conn.commit()
+            cursor.execute('VACUUM')
+            # В режиме WAL VACUUM пишет новые страницы в журнал
+            cursor.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        size_after = os.path.getsize(self.db_path)
+        print(f'Перекодировано версий: {converted} ({len(file_paths)} файлов), '
+              f'уникальных блобов: {blob_count}, размер базы: {size_before} -> {size_after} байт')
 
     def start_monitoring(self):
         """
         Запускает мониторинг директории конфигурационных файлов.
         """
-        event_handler = ConfigEventHandler(self.config_dir, self.db_path)
+        event_handler = ConfigEventHandler(self.config_dir, self.db_path, self.storage,
+                                           self.keyframe_interval, self.debounce,
+                                           self.queue_size, self.readers)
         observer = Observer()
         observer.schedule(event_handler, self.config_dir, recursive=True)
+        event_handler.start()
+        # Наблюдатель запускается до сверки: изменения во время неё не теряются
         observer.start()
-        print(f'Запущен мониторинг директории: {self.config_dir}')
-        print('Нажмите Ctrl+C для остановки.')
+        # SIGTERM (docker stop, kill) завершает мониторинг так же корректно, как Ctrl+C
+        previous_handler = signal.signal(signal.SIGTERM, raise_keyboard_interrupt)
         try:
+            if self.reconcile:
+                started = time.monotonic()
+                files, candidates, deleted = event_handler.reconcile()
+                event_handler.wait_idle()
+                print(f'Сверка директории: файлов {files}, прочитано {candidates}, '
+                      f'удалено {deleted}, за {time.monotonic() - started:.2f} с')
+            print(f'Запущен мониторинг директории: {self.config_dir}')
+            print('Нажмите Ctrl+C для остановки.')
             while True:
                 time.sleep(1)
         except KeyboardInterrupt:
             observer.stop()
             print('\nМониторинг остановлен.')
+        finally:
+            signal.signal(signal.SIGTERM, previous_handler)
         observer.join()
+        # Записываем события, окно тишины которых ещё не истекло, и дожидаемся писателя
+        event_handler.stop()
+
+
+def raise_keyboard_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def print_json(data):
+    print(json.dumps(data, ensure_ascii=False, indent=2))
 
 
 def main():
@@ -233,11 +1497,48 @@ def main():
         help='Путь к базе данных SQLite (по умолчанию ./versions.db)'
     )
 
+    monitor_parser.add_argument(
+        '--storage',
+        choices=STORAGE_MODES,
+        default=DEFAULT_STORAGE,
+        help=f'Режим хранения версий: full - полные копии, delta - опорные кадры и дельты (по умолчанию {DEFAULT_STORAGE})'
+    )
+    monitor_parser.add_argument(
+        '--keyframe_interval',
+        type=int,
+        default=DEFAULT_KEYFRAME_INTERVAL,
+        help=f'Интервал опорных кадров в версиях для режима delta (по умолчанию {DEFAULT_KEYFRAME_INTERVAL})'
+    )
+    monitor_parser.add_argument(
+        '--debounce',
+        type=float,
+        default=DEFAULT_DEBOUNCE,
+        help=f'Окно тишины в секундах: события одного файла объединяются в одну версию, 0 - без задержки (по умолчанию {DEFAULT_DEBOUNCE})'
+    )
+    monitor_parser.add_argument(
+        '--queue_size',
+        type=int,
+        default=DEFAULT_QUEUE_SIZE,
+        help=f'Размер очереди версий, ожидающих записи в базу (по умолчанию {DEFAULT_QUEUE_SIZE})'
+    )
+    monitor_parser.add_argument(
+        '--readers',
+        type=int,
+        default=DEFAULT_READERS,
+        help=f'Число потоков чтения и хеширования файлов (по умолчанию {DEFAULT_READERS})'
+    )
+    monitor_parser.add_argument(
+        '--no_reconcile',
+        action='store_true',
+        help='Не сверять директорию с базой при запуске (изменения, сделанные пока монитор не работал, не будут сохранены)'
+    )
+
     # Команда compare
     compare_parser = subparsers.add_parser('compare', help='Сравнить две версии файла')
     compare_parser.add_argument('--file', required=True, help='Путь к файлу для сравнения')
     compare_parser.add_argument('--version1', type=int, required=True, help='Первая версия для сравнения')
     compare_parser.add_argument('--version2', type=int, required=True, help='Вторая версия для сравнения')
+    compare_parser.add_argument('--json', action='store_true', help='Вывести результат в JSON')
     compare_parser.add_argument(
         '--config_dir',
         default='./configs',
@@ -267,6 +1568,10 @@ def main():
     # Команда history
     history_parser = subparsers.add_parser('history', help='Показать историю изменений файла')
     history_parser.add_argument('--file', required=True, help='Путь к файлу для просмотра истории')
+    history_parser.add_argument('--limit', type=int, default=None, help='Показать только N последних версий')
+    history_parser.add_argument('--since', type=parse_timestamp, default=None,
+                                help='Показать версии не раньше момента: ГГГГ-ММ-ДД или "ГГГГ-ММ-ДД ЧЧ:ММ:СС"')
+    history_parser.add_argument('--json', action='store_true', help='Вывести результат в JSON')
     history_parser.add_argument(
         '--config_dir',
         default='./configs',
@@ -278,10 +1583,78 @@ def main():
         help='Путь к базе данных SQLite (по умолчанию ./versions.db)'
     )
 
+    # Команда snapshot
+    snapshot_parser = subparsers.add_parser('snapshot', help='Показать состояние всех файлов на момент времени')
+    snapshot_parser.add_argument('--at', required=True, type=parse_timestamp,
+                                 help='Момент времени: ГГГГ-ММ-ДД или "ГГГГ-ММ-ДД ЧЧ:ММ:СС"')
+    snapshot_parser.add_argument('--json', action='store_true', help='Вывести результат в JSON')
+    snapshot_parser.add_argument(
+        '--config_dir',
+        default='./configs',
+        help='Директория с конфигурационными файлами (по умолчанию ./configs)'
+    )
+    snapshot_parser.add_argument(
+        '--db_path',
+        default='./versions.db',
+        help='Путь к базе данных SQLite (по умолчанию ./versions.db)'
+    )
+
+    # Команда rollback-tree
+    rollback_tree_parser = subparsers.add_parser('rollback-tree', help='Откатить всю директорию к моменту времени')
+    rollback_tree_parser.add_argument('--at', required=True, type=parse_timestamp,
+                                      help='Момент времени: ГГГГ-ММ-ДД или "ГГГГ-ММ-ДД ЧЧ:ММ:СС"')
+    rollback_tree_parser.add_argument(
+        '--delete',
+        action='store_true',
+        help='Удалить файлы, которых на этот момент не было или которые были удалены'
+    )
+    rollback_tree_parser.add_argument(
+        '--dry_run',
+        action='store_true',
+        help='Только показать, какие файлы будут изменены'
+    )
+    rollback_tree_parser.add_argument(
+        '--config_dir',
+        default='./configs',
+        help='Директория с конфигурационными файлами (по умолчанию ./configs)'
+    )
+    rollback_tree_parser.add_argument(
+        '--db_path',
+        default='./versions.db',
+        help='Путь к базе данных SQLite (по умолчанию ./versions.db)'
+    )
+
+    # Команда migrate
+    migrate_parser = subparsers.add_parser('migrate', help='Перекодировать существующую базу в выбранный режим хранения')
+    migrate_parser.add_argument(
+        '--config_dir',
+        default='./configs',
+        help='Директория с конфигурационными файлами (по умолчанию ./configs)'
+    )
+    migrate_parser.add_argument(
+        '--db_path',
+        default='./versions.db',
+        help='Путь к базе данных SQLite (по умолчанию ./versions.db)'
+    )
+    migrate_parser.add_argument(
+        '--storage',
+        choices=STORAGE_MODES,
+        default=DEFAULT_STORAGE,
+        help=f'Режим хранения версий после миграции (по умолчанию {DEFAULT_STORAGE})'
+    )
+    migrate_parser.add_argument(
+        '--keyframe_interval',
+        type=int,
+        default=DEFAULT_KEYFRAME_INTERVAL,
+        help=f'Интервал опорных кадров в версиях (по умолчанию {DEFAULT_KEYFRAME_INTERVAL})'
+    )
+
     args = parser.parse_args()
 
     if args.command == 'monitor':
-        vc = VersionControl(args.config_dir, args.db_path)
+        vc = VersionControl(args.config_dir, args.db_path, args.storage,
+                            args.keyframe_interval, args.debounce,
+                            args.queue_size, args.readers, not args.no_reconcile)
         try:
             vc.start_monitoring()
         except KeyboardInterrupt:
@@ -289,9 +1662,23 @@ def main():
 
     elif args.command == 'compare':
         vc = VersionControl(args.config_dir, args.db_path)
-        diff = vc.compare_versions(args.file, args.version1, args.version2)
-        if diff:
-            print(diff)
+        if args.json:
+            rel_path = os.path.relpath(args.file, vc.config_dir)
+            result = {'file': rel_path, 'version1': args.version1, 'version2': args.version2}
+            try:
+                diff = vc.diff_versions(rel_path, args.version1, args.version2)
+                result.update(identical=not diff, diff=diff)
+            except LookupError as e:
+                result['error'] = str(e)
+            print_json(result)
+            if 'error' in result:
+                sys.exit(1)
+        else:
+            diff = vc.compare_versions(args.file, args.version1, args.version2)
+            if diff:
+                print(diff)
+            elif diff == '':
+                print(f'Версии {args.version1} и {args.version2} не различаются')
 
     elif args.command == 'rollback':
         vc = VersionControl(args.config_dir, args.db_path)
@@ -299,7 +1686,19 @@ def main():
 
     elif args.command == 'history':
         vc = VersionControl(args.config_dir, args.db_path)
-        vc.show_history(args.file)
+        vc.show_history(args.file, args.limit, args.since, args.json)
+
+    elif args.command == 'snapshot':
+        vc = VersionControl(args.config_dir, args.db_path)
+        vc.snapshot(args.at, args.json)
+
+    elif args.command == 'rollback-tree':
+        vc = VersionControl(args.config_dir, args.db_path)
+        vc.rollback_tree(args.at, args.delete, args.dry_run)
+
+    elif args.command == 'migrate':
+        vc = VersionControl(args.config_dir, args.db_path, args.storage, args.keyframe_interval)
+        vc.migrate_storage()
 
     else:
         parser.print_help()
@@ -0,0 +1,353 @@
+import asyncio
+import json
+import os
+import socket
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import quote, urlencode
+
+# Constants
+DOCKER_SOCKET = '/var/run/docker.sock'
+DOCKER_API_VERSION = '1.41'
+DOCKER_POOL_SIZE = 8  # Keep-alive connections (and concurrent requests) per client
+DOCKER_TIMEOUT = 10  # Default timeout in seconds for a single Engine API call
+PULL_TIMEOUT = 600  # Pulling an image may take minutes
+REAPER_WORKERS = 2
+REAPER_RETRIES = 3
+REAPER_RETRY_DELAY = 2
+
+class DockerError(Exception):
+    """Engine API call failed: error status, timeout or broken connection"""
+
+    def __init__(self, status: Optional[int], message: str):
+        super().__init__(f"{status} {message}" if status else message)
+        self.status = status
+        self.message = message
+
+class Container:
+    """Handle of a container created through AsyncDockerClient"""
+
+    def __init__(self, id: str, name: str):
+        self.id = id
+        self.name = name
+
+def socket_path_from_env() -> str:
+    """Docker socket path, honouring DOCKER_HOST=unix://... like the docker CLI"""
+    host = os.environ.get('DOCKER_HOST', '')
+    if host.startswith('unix://'):
+        return host[len('unix://'):]
+    return DOCKER_SOCKET
+
+def parse_bytes(value) -> int:
+    """Convert a docker size such as '512m' into bytes"""
+    if isinstance(value, int):
+        return value
+    units = {'b': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+    value = value.strip().lower()
+    if value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+async def read_response(reader: asyncio.StreamReader) -> Tuple[int, Dict[str, str], bytes, bool]:
+    """Read one HTTP/1.1 response: status, headers, body and whether the connection stays open"""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionResetError('connection closed by the Docker daemon')
+    status = int(status_line.split(b' ', 2)[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    keep_alive = headers.get('connection', '').lower() != 'close'
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        body = bytearray()
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            if size == 0:
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                break
+            body += await reader.readexactly(size)
+            await reader.readexactly(2)
+        body = bytes(body)
+    elif 'content-length' in headers:
+        body = await reader.readexactly(int(headers['content-length']))
+    elif status in (204, 304) or status < 200:
+        body = b''
+    else:
+        body = await reader.read()
+        keep_alive = False
+    return status, headers, body, keep_alive
+
+def error_message(body: bytes) -> str:
+    try:
+        return json.loads(body)['message']
+    except (ValueError, KeyError, TypeError):
+        return body.decode(errors='replace').strip()
+
+class AsyncDockerClient:
+    """
+    Minimal Docker Engine API client over the unix socket. Requests reuse a
+    small pool of keep-alive connections and every call has a timeout, so a
+    slow daemon delays only the sessions that wait for it.
+    """
+
+    def __init__(self, socket_path: Optional[str] = None, pool_size: int = DOCKER_POOL_SIZE,
+                 timeout: float = DOCKER_TIMEOUT, api_version: str = DOCKER_API_VERSION):
+        self.socket_path = socket_path or socket_path_from_env()
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.prefix = f'/v{api_version}' if api_version else ''
+        self._idle: List[Tuple[asyncio.StreamReader, asyncio.StreamWriter]] = []
+        self._slots = None
+
+    def _request_head(self, method: str, path: str, params: Optional[dict], length: int,
+                      extra_headers: str = '') -> bytes:
+        url = self.prefix + path
+        if params:
+            url += '?' + urlencode(params)
+        return (f"{method} {url} HTTP/1.1\r\n"
+                f"Host: docker\r\n"
+                f"Content-Type: application/json\r\n"
+                f"Content-Length: {length}\r\n"
+                f"{extra_headers}\r\n").encode()
+
+    async def _connection(self):
+        while self._idle:
+            reader, writer = self._idle.pop()
+            if not reader.at_eof() and not writer.is_closing():
+                return reader, writer, True
+            writer.close()
+        reader, writer = await asyncio.open_unix_connection(self.socket_path)
+        return reader, writer, False
+
+    async def _request(self, method, path, params, payload):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.pool_size)
+        request = self._request_head(method, path, params, len(payload)) + payload
+        async with self._slots:
+            while True:
+                reader, writer, reused = await self._connection()
+                try:
+                    writer.write(request)
+                    await writer.drain()
+                    status, headers, body, keep_alive = await read_response(reader)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    writer.close()
+                    # The daemon may drop an idle keep-alive connection at any
+                    # time; only a reused connection gets a second attempt
+                    if reused:
+                        continue
+                    raise
+                except BaseException:
+                    # Cancelled or timed out mid-response: the stream is unusable
+                    writer.close()
+                    raise
+                if keep_alive and len(self._idle) < self.pool_size:
+                    self._idle.append((reader, writer))
+                else:
+                    writer.close()
+                return status, headers, body
+
+    async def request(self, method: str, path: str, params: Optional[dict] = None, body=None,
+                      timeout: Optional[float] = None):
+        """Perform an API call and return the decoded JSON body (raw bytes for other content)"""
+        payload = json.dumps(body).encode() if body is not None else b''
+        timeout = timeout or self.timeout
+        try:
+            status, headers, data = await asyncio.wait_for(
+                self._request(method, path, params, payload), timeout)
+        except asyncio.TimeoutError:
+            raise DockerError(None, f"{method} {path} timed out after {timeout} seconds") from None
+        except (OSError, asyncio.IncompleteReadError) as e:
+            raise DockerError(None, f"{method} {path} failed: {e}") from None
+        if status >= 400:
+            raise DockerError(status, error_message(data))
+        if data and headers.get('content-type', '').startswith('application/json'):
+            return json.loads(data)
+        return data
+
+    async def ping(self):
+        await self.request('GET', '/_ping')
+
+    async def pull_image(self, image: str):
+        name, tag = image, 'latest'
+        if ':' in image.split('/')[-1]:
+            name, tag = image.rsplit(':', 1)
+        print(f"Pulling image '{image}'...")
+        await self.request('POST', '/images/create', params={'fromImage': name, 'tag': tag},
+                           timeout=PULL_TIMEOUT)
+
+    async def create_container(self, name: str, image: str, command: List[str], environment: Dict[str, str],
+                               mem_limit=None, nano_cpus: Optional[int] = None,
+                               labels: Optional[Dict[str, str]] = None, tty: bool = True,
+                               stdin_open: bool = True) -> str:
+        """Create a container, pulling the image if it is missing. Returns the container id"""
+        body = {
+            'Image': image,
+            'Cmd': command,
+            'Tty': tty,
+            'OpenStdin': stdin_open,
+            'AttachStdin': stdin_open,
+            'AttachStdout': True,
+            'AttachStderr': True,
+            'Env': [f'{key}={value}' for key, value in environment.items()],
+            'Labels': labels or {},
+            'HostConfig': {},
+        }
+        if mem_limit is not None:
+            body['HostConfig']['Memory'] = parse_bytes(mem_limit)
+        if nano_cpus is not None:
+            body['HostConfig']['NanoCpus'] = nano_cpus
+        try:
+            result = await self.request('POST', '/containers/create', params={'name': name}, body=body)
+        except DockerError as e:
+            if e.status != 404:
+                raise
+            await self.pull_image(image)
+            result = await self.request('POST', '/containers/create', params={'name': name}, body=body)
+        return result['Id']
+
+    async def start_container(self, container_id: str):
+        await self.request('POST', f'/containers/{quote(container_id)}/start')
+
+    async def inspect_container(self, container_id: str) -> dict:
+        return await self.request('GET', f'/containers/{quote(container_id)}/json')
+
+    async def rename_container(self, container_id: str, name: str):
+        await self.request('POST', f'/containers/{quote(container_id)}/rename', params={'name': name})
+
+    async def list_containers(self, all: bool = False, label: Optional[str] = None) -> List[dict]:
+        params = {'all': '1' if all else '0'}
+        if label:
+            params['filters'] = json.dumps({'label': [label]})
+        return await self.request('GET', '/containers/json', params=params)
+
+    async def remove_container(self, container_id: str, force: bool = True):
+        """Remove a container; force also kills it if it is still running"""
+        await self.request('DELETE', f'/containers/{quote(container_id)}', params={'force': '1' if force else '0'})
+
+    async def exec_create(self, container_id: str, command: List[str], environment: Dict[str, str],
+                          tty: bool = True) -> str:
+        result = await self.request('POST', f'/containers/{quote(container_id)}/exec', body={
+            'AttachStdin': True,
+            'AttachStdout': True,
+            'AttachStderr': True,
+            'Tty': tty,
+            'Cmd': command,
+            'Env': [f'{key}={value}' for key, value in environment.items()],
+        })
+        return result['Id']
+
+    async def exec_start(self, exec_id: str, tty: bool = True,
+                         timeout: Optional[float] = None) -> Tuple[socket.socket, bytes]:
+        """
+        Start an exec instance and take over its connection. Returns the raw
+        non-blocking socket and any stream bytes already read with the headers.
+        The socket is not pooled; the caller owns and closes it.
+        """
+        loop = asyncio.get_event_loop()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        payload = json.dumps({'Detach': False, 'Tty': tty}).encode()
+        request = self._request_head('POST', f'/exec/{quote(exec_id)}/start', None, len(payload),
+                                     'Connection: Upgrade\r\nUpgrade: tcp\r\n') + payload
+
+        async def hijack():
+            await loop.sock_connect(sock, self.socket_path)
+            await loop.sock_sendall(sock, request)
+            response = b''
+            while b'\r\n\r\n' not in response:
+                chunk = await loop.sock_recv(sock, 4096)
+                if not chunk:
+                    raise ConnectionResetError('connection closed by the Docker daemon')
+                response += chunk
+            head, rest = response.split(b'\r\n\r\n', 1)
+            status = int(head.split(b' ', 2)[1])
+            if status not in (101, 200):
+                raise DockerError(status, error_message(rest))
+            return sock, rest
+
+        timeout = timeout or self.timeout
+        try:
+            return await asyncio.wait_for(hijack(), timeout)
+        except asyncio.TimeoutError:
+            sock.close()
+            raise DockerError(None, f"exec start timed out after {timeout} seconds") from None
+        except OSError as e:
+            sock.close()
+            raise DockerError(None, f"exec start failed: {e}") from None
+        except BaseException:
+            sock.close()
+            raise
+
+    async def exec_resize(self, exec_id: str, height: int, width: int):
+        await self.request('POST', f'/exec/{quote(exec_id)}/resize', params={'h': height, 'w': width})
+
+    async def close(self):
+        while self._idle:
+            _, writer = self._idle.pop()
+            writer.close()
+
+class ContainerReaper:
+    """
+    Removes finished containers in the background so that session teardown
+    never waits for the daemon. Failed removals are retried a few times.
+    """
+
+    def __init__(self, client: AsyncDockerClient, workers: int = REAPER_WORKERS,
+                 retries: int = REAPER_RETRIES, retry_delay: float = REAPER_RETRY_DELAY):
+        self.client = client
+        self.workers = workers
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.removed = 0
+        self.failed = 0
+        self._queue = None
+        self._tasks = []
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def reap(self, container: Container):
+        """Queue a container for removal; safe to call from synchronous callbacks"""
+        self._queue.put_nowait(container)
+
+    async def _worker(self):
+        while True:
+            container = await self._queue.get()
+            try:
+                await self._remove(container)
+            finally:
+                self._queue.task_done()
+
+    async def _remove(self, container: Container):
+        for attempt in range(1, self.retries + 1):
+            try:
+                await self.client.remove_container(container.id, force=True)
+                print(f"Removed container '{container.name}'.")
+                self.removed += 1
+                return
+            except DockerError as e:
+                if e.status == 404:
+                    return
+                print(f"Error removing container '{container.name}' (attempt {attempt}/{self.retries}): {e}")
+            if attempt < self.retries:
+                await asyncio.sleep(self.retry_delay)
+        self.failed += 1
+
+    async def close(self, timeout: Optional[float] = None):
+        """Wait for queued removals to finish, then stop the workers"""
+        if self._queue is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            print(f"Container reaper stopped with {self._queue.qsize()} containers left")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -0,0 +1,332 @@
+import argparse
+import asyncio
+import fcntl
+import json
+import os
+import pty
+import re
+import shutil
+import signal
+import struct
+import tempfile
+import termios
+import uuid
+from urllib.parse import parse_qs, urlsplit
+
+# Local stand-in for the Docker Engine API, for testing virtual_terminal.py
+# without a Docker daemon. It implements the calls made by docker_api.py on a
+# unix socket. Containers are only records; an exec runs its command on this
+# host in a pseudo-terminal, with a temporary directory as HOME and cwd.
+# Start it and point the server at it:
+#   python3 fake_docker_engine.py --socket /tmp/fake-docker.sock
+#   DOCKER_HOST=unix:///tmp/fake-docker.sock python3 virtual_terminal.py
+
+DEFAULT_SOCKET = '/tmp/fake-docker.sock'
+REASONS = {200: 'OK', 201: 'Created', 204: 'No Content', 304: 'Not Modified', 400: 'Bad Request',
+           404: 'Not Found', 409: 'Conflict', 500: 'Internal Server Error'}
+
+class ApiError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+def has_label(labels: dict, spec: str) -> bool:
+    """Match a label filter given as 'key' or 'key=value'"""
+    key, sep, value = spec.partition('=')
+    return key in labels and (not sep or labels[key] == value)
+
+class PtyOutput(asyncio.Protocol):
+    """Copies pseudo-terminal output to the hijacked client connection"""
+
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self.closed = asyncio.Event()
+
+    def data_received(self, data):
+        self.writer.write(data)
+
+    def connection_lost(self, exc):
+        # EIO on the master side means the process has exited
+        self.closed.set()
+
+class FakeEngine:
+    def __init__(self, images, delay: float = 0):
+        self.images = set(images)
+        self.delay = delay
+        self.containers = {}
+        self.execs = {}
+        self.requests = 0
+        self.routes = [
+            ('GET', r'/_ping', self.ping),
+            ('POST', r'/images/create', self.pull_image),
+            ('GET', r'/containers/json', self.list_containers),
+            ('POST', r'/containers/create', self.create_container),
+            ('POST', r'/containers/(?P<ref>[^/]+)/start', self.start_container),
+            ('POST', r'/containers/(?P<ref>[^/]+)/kill', self.kill_container),
+            ('POST', r'/containers/(?P<ref>[^/]+)/rename', self.rename_container),
+            ('GET', r'/containers/(?P<ref>[^/]+)/json', self.inspect_container),
+            ('DELETE', r'/containers/(?P<ref>[^/]+)', self.remove_container),
+            ('POST', r'/containers/(?P<ref>[^/]+)/exec', self.create_exec),
+            ('POST', r'/exec/(?P<ref>[^/]+)/resize', self.resize_exec),
+        ]
+
+    def find(self, ref: str) -> dict:
+        container = self.containers.get(ref)
+        if container is None:
+            for candidate in self.containers.values():
+                if candidate['Name'] == '/' + ref or candidate['Id'].startswith(ref):
+                    container = candidate
+                    break
+        if container is None:
+            raise ApiError(404, f'No such container: {ref}')
+        return container
+
+    def ping(self, params, body):
+        return 200, 'OK'
+
+    def pull_image(self, params, body):
+        image = f"{params['fromImage']}:{params.get('tag', 'latest')}"
+        self.images.add(image)
+        return 200, {'status': f'Downloaded newer image for {image}'}
+
+    def create_container(self, params, body):
+        image = body['Image'] if ':' in body['Image'] else body['Image'] + ':latest'
+        if image not in self.images:
+            raise ApiError(404, f"No such image: {body['Image']}")
+        name = params.get('name') or uuid.uuid4().hex[:12]
+        if any(c['Name'] == '/' + name for c in self.containers.values()):
+            raise ApiError(409, f'Conflict. The container name "/{name}" is already in use')
+        container_id = uuid.uuid4().hex + uuid.uuid4().hex
+        self.containers[container_id] = {
+            'Id': container_id,
+            'Name': '/' + name,
+            'Image': body['Image'],
+            'Config': {'Env': body.get('Env') or [], 'Labels': body.get('Labels') or {}, 'Cmd': body.get('Cmd')},
+            'HostConfig': body.get('HostConfig') or {},
+            'State': {'Running': False, 'Status': 'created'},
+            'root': tempfile.mkdtemp(prefix='fake_container_'),
+            'processes': [],
+        }
+        return 201, {'Id': container_id, 'Warnings': []}
+
+    def start_container(self, params, body, ref):
+        container = self.find(ref)
+        container['State'] = {'Running': True, 'Status': 'running'}
+        return 204, None
+
+    def kill_container(self, params, body, ref):
+        container = self.find(ref)
+        for process in container['processes']:
+            if process.returncode is None:
+                process.kill()
+        container['State'] = {'Running': False, 'Status': 'exited'}
+        return 204, None
+
+    def rename_container(self, params, body, ref):
+        container = self.find(ref)
+        if any(c['Name'] == '/' + params['name'] for c in self.containers.values()):
+            raise ApiError(409, f"Conflict. The container name \"/{params['name']}\" is already in use")
+        container['Name'] = '/' + params['name']
+        return 204, None
+
+    def inspect_container(self, params, body, ref):
+        container = self.find(ref)
+        return 200, {key: value for key, value in container.items() if key not in ('root', 'processes')}
+
+    def remove_container(self, params, body, ref):
+        container = self.find(ref)
+        if container['State']['Running']:
+            if params.get('force') not in ('1', 'true', 'True'):
+                raise ApiError(409, 'You cannot remove a running container. Stop the container before attempting removal')
+            self.kill_container(params, body, ref)
+        shutil.rmtree(container['root'], ignore_errors=True)
+        del self.containers[container['Id']]
+        return 204, None
+
+    def list_containers(self, params, body):
+        filters = json.loads(params.get('filters', '{}'))
+        result = []
+        for container in self.containers.values():
+            if not container['State']['Running'] and params.get('all') not in ('1', 'true', 'True'):
+                continue
+            labels = container['Config']['Labels']
+            if not all(has_label(labels, spec) for spec in filters.get('label', [])):
+                continue
+            result.append({'Id': container['Id'], 'Names': [container['Name']], 'Image': container['Image'],
+                           'Labels': labels, 'State': container['State']['Status']})
+        return 200, result
+
+    def create_exec(self, params, body, ref):
+        container = self.find(ref)
+        if not container['State']['Running']:
+            raise ApiError(409, f"Container {container['Id']} is not running")
+        exec_id = uuid.uuid4().hex + uuid.uuid4().hex
+        self.execs[exec_id] = {'container': container, 'Cmd': body['Cmd'], 'Env': body.get('Env') or [],
+                               'Tty': body.get('Tty', False), 'master': None}
+        return 201, {'Id': exec_id}
+
+    def resize_exec(self, params, body, ref):
+        instance = self.execs.get(ref)
+        if instance is None:
+            raise ApiError(404, f'No such exec instance: {ref}')
+        if instance['master'] is not None:
+            size = struct.pack('HHHH', int(params['h']), int(params['w']), 0, 0)
+            fcntl.ioctl(instance['master'], termios.TIOCSWINSZ, size)
+        return 201, None
+
+    async def start_exec(self, exec_id, reader, writer):
+        """Hijack the connection and attach it to the command running in a pty"""
+        instance = self.execs.get(exec_id)
+        if instance is None:
+            raise ApiError(404, f'No such exec instance: {exec_id}')
+        container = instance['container']
+        writer.write(b'HTTP/1.1 101 UPGRADED\r\nContent-Type: application/vnd.docker.raw-stream\r\n'
+                     b'Connection: Upgrade\r\nUpgrade: tcp\r\n\r\n')
+
+        env = {'HOME': container['root']}
+        for item in container['Config']['Env'] + instance['Env']:
+            key, _, value = item.partition('=')
+            env[key] = value
+        master, slave = pty.openpty()
+        instance['master'] = master
+
+        def make_controlling_tty():
+            fcntl.ioctl(0, termios.TIOCSCTTY, 0)
+
+        loop = asyncio.get_event_loop()
+        process = await asyncio.create_subprocess_exec(
+            *instance['Cmd'], stdin=slave, stdout=slave, stderr=slave, env=env, cwd=container['root'],
+            start_new_session=True, preexec_fn=make_controlling_tty)
+        os.close(slave)
+        container['processes'].append(process)
+
+        output = PtyOutput(writer)
+        out_transport, _ = await loop.connect_read_pipe(lambda: output, os.fdopen(master, 'rb', 0))
+        in_transport, _ = await loop.connect_write_pipe(asyncio.Protocol, os.fdopen(os.dup(master), 'wb', 0))
+
+        async def copy_input():
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    return
+                in_transport.write(data)
+
+        input_task = asyncio.create_task(copy_input())
+        await output.closed.wait()
+        input_task.cancel()
+        in_transport.close()
+        out_transport.close()
+        if process.returncode is None:
+            process.kill()
+        await process.wait()
+        instance['master'] = None
+        container['processes'].remove(process)
+        print(f"exec {exec_id[:12]} exited with code {process.returncode}")
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                method, target, _ = line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    header = await reader.readline()
+                    if header in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = header.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                raw_body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                self.requests += 1
+                if self.delay:
+                    await asyncio.sleep(self.delay)
+                url = urlsplit(target)
+                path = re.sub(r'^/v[0-9.]+', '', url.path)
+                params = {key: values[0] for key, values in parse_qs(url.query).items()}
+                body = json.loads(raw_body) if raw_body else {}
+
+                match = re.fullmatch(r'/exec/([^/]+)/start', path)
+                if method == 'POST' and match:
+                    try:
+                        await self.start_exec(match.group(1), reader, writer)
+                    except ApiError as e:
+                        self.respond(writer, e.status, {'message': e.message})
+                        await writer.drain()
+                        continue
+                    break
+
+                status, payload = self.dispatch(method, path, params, body)
+                print(f"{method} {path} -> {status}")
+                self.respond(writer, status, payload)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def dispatch(self, method, path, params, body):
+        for route_method, pattern, handler in self.routes:
+            match = re.fullmatch(pattern, path)
+            if match and method == route_method:
+                try:
+                    return handler(params, body, **match.groupdict())
+                except ApiError as e:
+                    return e.status, {'message': e.message}
+                except (KeyError, ValueError) as e:
+                    return 400, {'message': f'bad request: {e}'}
+        return 404, {'message': f'page not found: {method} {path}'}
+
+    @staticmethod
+    def respond(writer, status, payload):
+        if payload is None:
+            data, content_type = b'', None
+        elif isinstance(payload, str):
+            data, content_type = payload.encode(), 'text/plain; charset=utf-8'
+        else:
+            data, content_type = json.dumps(payload).encode(), 'application/json'
+        head = f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+        if content_type:
+            head += f"Content-Type: {content_type}\r\n"
+        if status != 204:
+            head += f"Content-Length: {len(data)}\r\n"
+        writer.write(head.encode() + b'\r\n' + data)
+
+    def cleanup(self):
+        for container in list(self.containers.values()):
+            for process in container['processes']:
+                if process.returncode is None:
+                    process.kill()
+            shutil.rmtree(container['root'], ignore_errors=True)
+
+async def serve(args):
+    engine = FakeEngine(args.images, args.delay)
+    if os.path.exists(args.socket):
+        os.remove(args.socket)
+    server = await asyncio.start_unix_server(engine.handle, path=args.socket)
+    print(f"Fake Docker Engine API listening on {args.socket}")
+    loop = asyncio.get_event_loop()
+    stop = loop.create_future()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, lambda: stop.done() or stop.set_result(None))
+    try:
+        await stop
+        print("Shutting down fake engine...")
+    finally:
+        server.close()
+        engine.cleanup()
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake Docker Engine API server for tests')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET, help='Unix socket to listen on')
+    parser.add_argument('--delay', type=float, default=0, help='Extra latency in seconds added to every API call')
+    parser.add_argument('--images', nargs='*', default=['ubuntu:20.04'], help='Images present without a pull')
+    args = parser.parse_args()
+    asyncio.get_event_loop().run_until_complete(serve(args))
+
+if __name__ == '__main__':
+    main()
@@ -120,7 +120,7 @@ install_centos() {
 # Установка Python пакетов
 install_python_packages() {
     print_status "Установка Python пакетов..."
-    pip3 install asyncssh asyncio bcrypt docker
+    pip3 install asyncssh asyncio bcrypt
     check_status "Python пакеты установлены" "Ошибка при установке Python пакетов"
 }
 
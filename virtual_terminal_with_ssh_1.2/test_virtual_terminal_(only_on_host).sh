@@ -24,6 +24,7 @@ cleanup() {
     
     # Cleanup any remaining docker containers
     docker ps -a | grep "session_${TEST_USER}" | awk '{print $1}' | xargs -r docker rm -f
+    docker ps -aq --filter "label=virtual_terminal.pool" | xargs -r docker rm -f
 }
 
 # Function to check if a command was successful
@@ -0,0 +1,108 @@
+#!/bin/bash
+
+# Runs the virtual terminal against fake_docker_engine.py instead of a Docker
+# daemon: no containers are started, the session shell runs on this host.
+
+# Colors for output
+GREEN='\033[0;32m'
+RED='\033[0;31m'
+NC='\033[0m' # No Color
+
+# Test user credentials
+TEST_USER="testuser"
+TEST_PASS="testpass"
+SSH_PORT=2222
+FAKE_SOCKET=/tmp/fake-docker-test.sock
+
+# Cleanup function
+cleanup() {
+    echo "Cleaning up..."
+    # Stop virtual terminal and fake engine if running
+    if [ -f ".vt.pid" ]; then
+        kill $(cat .vt.pid) 2>/dev/null
+        rm .vt.pid
+    fi
+    if [ -f ".engine.pid" ]; then
+        kill $(cat .engine.pid) 2>/dev/null
+        rm .engine.pid
+    fi
+
+    # Remove generated files
+    rm -f ssh_host_key ssh_host_key.pub users.txt test_ssh.exp vt_test.log
+}
+
+# Function to check if a command was successful
+check_status() {
+    if [ $? -eq 0 ]; then
+        echo -e "${GREEN}[✓] $1${NC}"
+    else
+        echo -e "${RED}[✗] $1${NC}"
+        cleanup
+        exit 1
+    fi
+}
+
+# Query the fake Engine API
+engine_api() {
+    curl -s --unix-socket $FAKE_SOCKET "http://localhost/v1.41$1"
+}
+
+# Set trap for cleanup on script exit
+trap cleanup EXIT
+
+echo "Starting virtual terminal tests with the fake Docker Engine API..."
+
+# Start fake engine
+echo "Starting fake Docker Engine API..."
+python3 fake_docker_engine.py --socket $FAKE_SOCKET > /dev/null 2>&1 & echo $! > .engine.pid
+sleep 1
+[ "$(engine_api /_ping)" = "OK" ]
+check_status "Fake engine is answering"
+
+# Generate SSH host keys
+echo "Generating SSH host keys..."
+ssh-keygen -t rsa -b 4096 -f ssh_host_key -N '' 2>/dev/null
+check_status "SSH host key generation"
+
+# Create test user
+echo "Creating test user..."
+python3 manage_users.py $TEST_USER $TEST_PASS
+check_status "Test user creation"
+
+# Start virtual terminal in background
+echo "Starting virtual terminal..."
+DOCKER_HOST=unix://$FAKE_SOCKET python3 virtual_terminal.py > vt_test.log 2>&1 & echo $! > .vt.pid
+sleep 3 # Wait for server to start and warm the pool
+
+# Check that the pool has been filled
+POOL_COUNT=$(engine_api '/containers/json?all=1' | grep -o '"/pool_' | wc -l)
+[ $POOL_COUNT -gt 0 ]
+check_status "Warm container pool filled ($POOL_COUNT containers)"
+
+# Test SSH connection
+echo "Testing SSH connection..."
+cat > test_ssh.exp << EOF
+#!/usr/bin/expect -f
+set timeout 10
+spawn ssh -o PreferredAuthentications=password -o PubkeyAuthentication=no -o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null -p $SSH_PORT $TEST_USER@localhost
+expect "password:"
+send "$TEST_PASS\r"
+send "echo TEST_\\\$USER\r"
+expect "TEST_$TEST_USER"
+send "exit\r"
+expect eof
+EOF
+
+expect -f test_ssh.exp
+check_status "SSH connection and shell through the fake engine"
+
+# Session containers are removed by the background reaper
+sleep 1
+SESSION_COUNT=$(engine_api '/containers/json?all=1' | grep -o "\"/session_${TEST_USER}" | wc -l)
+[ $SESSION_COUNT -eq 0 ]
+check_status "Session container removed after logout"
+
+grep -q "pool hits: 1" vt_test.log
+check_status "Session served from the warm pool"
+
+echo -e "\n${GREEN}All tests completed successfully!${NC}"
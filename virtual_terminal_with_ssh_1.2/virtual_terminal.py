@@ -1,11 +1,14 @@
 import asyncssh
 import asyncio
 import bcrypt
-import docker
 import sys
 import os
+import socket
 import uuid
-from typing import Dict
+from collections import deque
+from typing import Dict, Optional
+
+from docker_api import AsyncDockerClient, Container, ContainerReaper, DockerError
 
 # Constants
 SSH_HOST_KEY = 'ssh_host_key'
@@ -14,13 +17,28 @@ DOCKER_IMAGE = 'ubuntu:20.04'
 MEMORY_LIMIT = '512m'
 CPU_QUOTA = 500000000
 USERS_FILE = 'users.txt'
-IO_TIMEOUT = 60  # Timeout in seconds for I/O operations
+IO_TIMEOUT = 60  # Seconds a container may refuse session input before the session is closed
+RECV_BUFFER_MIN = 4096  # Container output read size for interactive traffic
+RECV_BUFFER_MAX = 256 * 1024  # Read size limit reached during bulk output
+CHANNEL_HIGH_WATER = 256 * 1024  # Buffered bytes at which the other side is paused
+CHANNEL_LOW_WATER = 64 * 1024  # Buffered bytes at which it is resumed
+SHUTDOWN_TIMEOUT = 30  # Seconds to wait for container removal on shutdown
+CONTAINER_ENVIRONMENT = {
+    "TERM": "xterm",
+    "PATH": "/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin",
+    "SHELL": "/bin/bash"
+}
+
+# Warm container pool
+POOL_SIZE = 4  # Idle containers kept ready for new sessions, 0 disables the pool
+POOL_MAX_STARTING = 2  # Containers being created for the pool at the same time
+POOL_REFILL_RATE = 2.0  # Pool containers started per second at most
+POOL_RETRY_DELAY = 5  # Seconds to wait after a failed pool container start
+POOL_LABEL = 'virtual_terminal.pool'
 
-try:
-    docker_client = docker.from_env()
-except docker.errors.DockerException as e:
-    print(f"Docker initialization error: {e}")
-    sys.exit(1)
+# Engine API client over the unix socket (DOCKER_HOST=unix://... overrides the path)
+docker_client = AsyncDockerClient()
+reaper = ContainerReaper(docker_client)
 
 users_db: Dict[str, bytes] = {}
 
@@ -51,216 +69,444 @@ def verify_user(username: str, password: str) -> bool:
         return result
     return False
 
-def create_container(username: str) -> docker.models.containers.Container:
-    container_name = f'session_{username}_{uuid.uuid4()}'
+def session_environment(username: str) -> Dict[str, str]:
+    """Environment of the user's shell inside the session container"""
+    return dict(CONTAINER_ENVIRONMENT, USER=username, LOGNAME=username)
+
+def session_container_name(username: str) -> str:
+    return f'session_{username}_{uuid.uuid4()}'
+
+async def run_container(name: str, environment: Dict[str, str],
+                        labels: Optional[Dict[str, str]] = None) -> Container:
+    """Start a detached shell container with the session resource limits"""
+    container_id = await docker_client.create_container(
+        name=name,
+        image=DOCKER_IMAGE,
+        command=["/bin/bash"],
+        environment=environment,
+        mem_limit=MEMORY_LIMIT,
+        nano_cpus=CPU_QUOTA,
+        labels=labels,
+        tty=True,
+        stdin_open=True
+    )
+    container = Container(container_id, name)
+    try:
+        await docker_client.start_container(container_id)
+    except DockerError:
+        cleanup_container(container)
+        raise
+    return container
+
+async def create_container(username: str) -> Optional[Container]:
+    container_name = session_container_name(username)
     try:
-        container = docker_client.containers.run(
-            image=DOCKER_IMAGE,
-            command="/bin/bash",
-            tty=True,
-            stdin_open=True,
-            detach=True,
-            name=container_name,
-            mem_limit=MEMORY_LIMIT,
-            nano_cpus=CPU_QUOTA,
-            environment={
-                "TERM": "xterm",
-                "PATH": "/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin",
-                "SHELL": "/bin/bash"
-            }
-        )
+        container = await run_container(container_name, session_environment(username))
         print(f"Created container '{container_name}' for user '{username}'.")
         return container
-    except docker.errors.DockerException as e:
+    except DockerError as e:
         print(f"Error creating container: {e}")
         return None
 
-def cleanup_container(container: docker.models.containers.Container):
+async def create_pool_container() -> Optional[Container]:
+    container_name = f'pool_{uuid.uuid4()}'
     try:
-        print(f"Stopping container '{container.name}'.")
-        container.kill()
-    except docker.errors.DockerException as e:
-        print(f"Error stopping container '{container.name}': {e}")
-    
+        container = await run_container(container_name, CONTAINER_ENVIRONMENT, labels={POOL_LABEL: 'idle'})
+        print(f"Created warm container '{container_name}'.")
+        return container
+    except DockerError as e:
+        print(f"Error creating warm container: {e}")
+        return None
+
+async def remove_stale_pool_containers():
+    """Remove idle pool containers left over by a previous server run"""
     try:
-        print(f"Removing container '{container.name}'.")
-        container.remove()
-    except docker.errors.DockerException as e:
-        print(f"Error removing container '{container.name}': {e}")
+        containers = await docker_client.list_containers(all=True, label=POOL_LABEL)
+    except DockerError as e:
+        print(f"Error listing pool containers: {e}")
+        return
+    for info in containers:
+        name = info['Names'][0].lstrip('/') if info.get('Names') else info['Id']
+        # Claimed containers are renamed to session_*; those belong to live sessions
+        if name.startswith('pool_'):
+            cleanup_container(Container(info['Id'], name))
+
+def cleanup_container(container: Container):
+    """Hand the container to the background reaper (kill and remove)"""
+    print(f"Removing container '{container.name}'.")
+    reaper.reap(container)
+
+class ContainerPool:
+    """
+    Keeps up to `size` idle containers running so that a login does not wait
+    for `docker run`. A claimed container is renamed for its user and leaves
+    the pool for good; it is removed when the session ends like any other.
+    """
+
+    def __init__(self, size: int = POOL_SIZE, max_starting: int = POOL_MAX_STARTING,
+                 refill_rate: float = POOL_REFILL_RATE):
+        self.size = size
+        self.max_starting = max_starting
+        self.refill_interval = 1 / refill_rate if refill_rate > 0 else 0
+        self.idle = deque()
+        self.starting = 0
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+        self.closed = False
+        self._wakeup = asyncio.Event()
+        self._refill_task = None
+        self._tasks = set()
+
+    def start(self):
+        """Start the background task that tops the pool up"""
+        if self.size > 0:
+            self._refill_task = asyncio.create_task(self._refill())
+
+    async def _refill(self):
+        while not self.closed:
+            if len(self.idle) + self.starting < self.size and self.starting < self.max_starting:
+                self.starting += 1
+                self._spawn(self._warm_one())
+                await asyncio.sleep(self.refill_interval)
+            else:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _warm_one(self):
+        try:
+            container = await create_pool_container()
+            if container is None:
+                self.failures += 1
+                await asyncio.sleep(POOL_RETRY_DELAY)
+            elif self.closed:
+                cleanup_container(container)
+            else:
+                self.idle.append(container)
+        finally:
+            self.starting -= 1
+            self._wakeup.set()
+
+    async def claim(self, username: str) -> Optional[Container]:
+        """
+        Hand out a warm container bound to the user, or create a fresh one
+        when the pool is empty.
+        """
+        while self.idle:
+            container = self.idle.popleft()
+            self._wakeup.set()
+            try:
+                await docker_client.rename_container(container.id, session_container_name(username))
+                info = await docker_client.inspect_container(container.id)
+            except DockerError as e:
+                print(f"Error claiming warm container '{container.name}': {e}")
+                cleanup_container(container)
+                continue
+            container.name = info['Name'].lstrip('/')
+            if not info['State']['Running']:
+                print(f"Warm container '{container.name}' is {info['State']['Status']}, discarding it.")
+                cleanup_container(container)
+                continue
+            self.hits += 1
+            print(f"Claimed warm container '{container.name}' for user '{username}' ({self.stats()}).")
+            return container
+
+        self.misses += 1
+        print(f"Container pool is empty, creating a container for user '{username}' ({self.stats()}).")
+        return await create_container(username)
+
+    def stats(self) -> str:
+        return (f"pool hits: {self.hits}, misses: {self.misses}, idle: {len(self.idle)}, "
+                f"starting: {self.starting}, failed starts: {self.failures}")
+
+    async def close(self):
+        """Stop refilling and remove the idle containers"""
+        self.closed = True
+        if self._refill_task:
+            self._refill_task.cancel()
+            try:
+                await self._refill_task
+            except asyncio.CancelledError:
+                pass
+        while self.idle:
+            cleanup_container(self.idle.popleft())
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        print(f"Container pool closed ({self.stats()}).")
 
 class SSHServerSession(asyncssh.SSHServerSession):
-    def __init__(self, container: docker.models.containers.Container):
+    def __init__(self, container: Container, environment: Dict[str, str]):
         super().__init__()
         self.container = container
+        self.environment = environment
         self.loop = asyncio.get_event_loop()
         self.transport_closed = False
         self._chan = None
-        self.exec_sock = None
         self.exec_id = None
-        self._stdout_task = None
+        self._sock = None
+        self._fd = None
+        self._recv_size = RECV_BUFFER_MIN
+        self._reading = False
+        self._output_eof = False
+        self._input = bytearray()
+        self._input_paused = False
+        self._input_eof = False
+        self._stall_handle = None
+        self._term_size = None
+        self._start_task = None
+        self._tasks = set()
 
     def connection_made(self, chan):
         """Called when the SSH connection is established"""
+        self._chan = chan
+        print(f"SSH session started for container '{self.container.name}'.")
+        chan.set_write_buffer_limits(high=CHANNEL_HIGH_WATER, low=CHANNEL_LOW_WATER)
+        # The shell is started in the background; client input that arrives
+        # meanwhile is buffered and delivered once the exec socket is ready
+        self._start_task = asyncio.create_task(self._start_shell())
+
+    async def _start_shell(self):
         try:
-            self._chan = chan
-            print(f"SSH session started for container '{self.container.name}'.")
-            
             # Create interactive shell exec instance
-            self.exec_id = self.container.client.api.exec_create(
+            self.exec_id = await docker_client.exec_create(
                 self.container.id,
-                cmd=["/bin/bash"],
-                tty=True,
-                stdin=True,
-                stdout=True,
-                stderr=True,
-                environment={
-                    "TERM": "xterm",
-                    "PATH": "/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin",
-                    "SHELL": "/bin/bash"
-                }
+                command=["/bin/bash"],
+                environment=self.environment,
+                tty=True
             )
             
             print("Successfully created exec instance")
             
             # Start the interactive shell
-            self.exec_sock = self.container.client.api.exec_start(
-                self.exec_id['Id'],
-                socket=True,
-                tty=True
-            )
+            sock, initial_output = await docker_client.exec_start(self.exec_id, tty=True)
             
             print("Successfully started exec instance")
-            
-            # Start background task for handling I/O
-            self._stdout_task = asyncio.create_task(self._handle_output())
-            print("Started output handling task")
-            
-        except Exception as e:
-            print(f"Error in connection_made: {e}")
-            if self.container:
-                cleanup_container(self.container)
-            if chan:
-                chan.exit(1)
-
-    async def _read_with_timeout(self, sock):
-        """Read from socket with timeout"""
+        except DockerError as e:
+            print(f"Error starting shell: {e}")
+            if not self.transport_closed:
+                self._chan.exit(1)
+            return
+
+        if self._term_size:
+            # Resize before any input reaches the shell so it starts with the client's size
+            try:
+                await self._resize_exec(*self._term_size)
+            except asyncio.CancelledError:
+                sock.close()
+                raise
+        if self.transport_closed:
+            sock.close()
+            return
+
+        # The exec socket is driven by the event loop itself: no blocking
+        # calls and no thread pool hops per read or write
+        self._sock = sock
+        self._fd = sock.fileno()
+        if initial_output:
+            self._chan.write(initial_output)
+        if self._input:
+            self._start_writing()
+        elif self._input_eof:
+            self._shutdown_input()
+        self._start_reading()
+        print("Started output relay")
+
+    def _start_reading(self):
+        if not self._reading and self._sock and not self._output_eof and not self.transport_closed:
+            self.loop.add_reader(self._fd, self._on_container_readable)
+            self._reading = True
+
+    def _stop_reading(self):
+        if self._reading:
+            self.loop.remove_reader(self._fd)
+            self._reading = False
+
+    def _on_container_readable(self):
+        """Relay one chunk of container output to the SSH channel"""
         try:
-            data = await asyncio.wait_for(
-                self.loop.run_in_executor(None, sock.recv, 4096),
-                timeout=IO_TIMEOUT
-            )
-            return data
-        except asyncio.TimeoutError:
-            return None
-        except Exception as e:
+            data = self._sock.recv(self._recv_size)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
             print(f"Error reading from socket: {e}")
-            return None
+            data = b''
+
+        if not data:
+            print("No more data from container")
+            self._output_eof = True
+            self._stop_reading()
+            if not self.transport_closed:
+                try:
+                    self._chan.exit(0)
+                except Exception:
+                    pass
+            return
+
+        # Adapt the read size: grow while reads fill the buffer (bulk output),
+        # shrink back for interactive traffic
+        if len(data) == self._recv_size and self._recv_size < RECV_BUFFER_MAX:
+            self._recv_size *= 2
+        elif len(data) < self._recv_size // 4 and self._recv_size > RECV_BUFFER_MIN:
+            self._recv_size //= 2
 
-    def _write_to_channel(self, data):
-        """Write data to SSH channel"""
         try:
-            if isinstance(self._chan, (asyncssh.SSHServerChannel, asyncssh.editor.SSHLineEditorChannel)):
-                self._chan.write(data)
-            else:
-                print(f"Warning: Unsupported channel type: {type(self._chan)}")
+            self._chan.write(data)
         except Exception as e:
             print(f"Error writing to channel: {e}")
-            raise
+            self._stop_reading()
 
-    async def _handle_output(self):
-        """Handle output from the container"""
-        try:
-            while not self.transport_closed and self.exec_sock and self._chan:
-                try:
-                    data = await self._read_with_timeout(self.exec_sock._sock)
-                    if data is None:
-                        # Timeout occurred, but connection is still active
-                        continue
-                    if not data:
-                        print("No more data from container")
-                        break
-                    
-                    # Write data to the channel
-                    await self.loop.run_in_executor(None, self._write_to_channel, data)
-                        
-                except Exception as e:
-                    print(f"Error processing container output: {e}")
-                    break
-        except Exception as e:
-            print(f"Error in _handle_output: {e}")
-        finally:
-            if not self.transport_closed and self._chan:
-                try:
-                    self._chan.exit(0)
-                except:
-                    pass
+    def pause_writing(self):
+        """The SSH client is not keeping up: stop reading container output"""
+        self._stop_reading()
+
+    def resume_writing(self):
+        self._start_reading()
 
     def data_received(self, data, datatype=None):
         """Handle data received from the SSH client"""
-        if not self.transport_closed and self.exec_sock:
+        if self.transport_closed:
+            return
+        # Ensure data is in bytes
+        if isinstance(data, str):
+            data = data.encode()
+        if self._sock and not self._input:
             try:
-                # Ensure data is in bytes
-                if isinstance(data, str):
-                    data = data.encode()
-                self.exec_sock._sock.send(data)
-            except Exception as e:
+                sent = self._sock.send(data)
+            except (BlockingIOError, InterruptedError):
+                sent = 0
+            except OSError as e:
                 print(f"Error in data_received: {e}")
+                return
+            data = data[sent:]
+            if not data:
+                return
+            self._start_writing()
+        self._input.extend(data)
+        if len(self._input) >= CHANNEL_HIGH_WATER and not self._input_paused:
+            # The container is not consuming input: stop the SSH window from
+            # growing so the client backs off instead of filling our memory
+            self._chan.pause_reading()
+            self._input_paused = True
+
+    def _on_container_writable(self):
+        """Flush buffered client input into the container"""
+        try:
+            sent = self._sock.send(self._input)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            print(f"Error writing to container: {e}")
+            self._input.clear()
+            sent = 0
+        del self._input[:sent]
+        if sent and self._stall_handle:
+            self._stall_handle.cancel()
+            self._stall_handle = self.loop.call_later(IO_TIMEOUT, self._on_input_stalled)
+
+        if self._input_paused and len(self._input) <= CHANNEL_LOW_WATER:
+            self._chan.resume_reading()
+            self._input_paused = False
+        if not self._input:
+            self._stop_writing()
+            if self._input_eof:
+                self._shutdown_input()
+
+    def _start_writing(self):
+        self.loop.add_writer(self._fd, self._on_container_writable)
+        self._stall_handle = self.loop.call_later(IO_TIMEOUT, self._on_input_stalled)
+
+    def _stop_writing(self):
+        self.loop.remove_writer(self._fd)
+        if self._stall_handle:
+            self._stall_handle.cancel()
+            self._stall_handle = None
+
+    def _on_input_stalled(self):
+        print(f"Container '{self.container.name}' has not accepted input for {IO_TIMEOUT} seconds, closing session")
+        self._stall_handle = None
+        self._chan.exit(1)
+
+    def _shutdown_input(self):
+        try:
+            self._sock.shutdown(socket.SHUT_WR)
+        except OSError as e:
+            print(f"Error in eof_received: {e}")
 
     def eof_received(self):
         """Called when EOF is received"""
         print("EOF received")
-        if self.exec_sock:
-            try:
-                self.exec_sock._sock.shutdown(2)
-            except Exception as e:
-                print(f"Error in eof_received: {e}")
+        # Buffered input is delivered before the container sees EOF
+        self._input_eof = True
+        if self._sock and not self._input:
+            self._shutdown_input()
         return True
 
     def connection_lost(self, exc):
         """Called when the connection is lost"""
         print(f"Connection lost for container '{self.container.name}'" + (f": {exc}" if exc else ""))
         self.transport_closed = True
+
+        if self._start_task and not self._start_task.done():
+            self._start_task.cancel()
+        for task in self._tasks:
+            task.cancel()
         
-        if self.exec_sock:
+        if self._sock:
+            self._stop_reading()
+            if self._input:
+                self._stop_writing()
+                self._input.clear()
             try:
-                self.exec_sock._sock.close()
+                self._sock.close()
             except Exception as e:
                 print(f"Error closing exec socket: {e}")
-
-        if self._stdout_task and not self._stdout_task.done():
-            self._stdout_task.cancel()
-            try:
-                self.loop.run_until_complete(self._stdout_task)
-            except (asyncio.CancelledError, RuntimeError):
-                pass
             
         cleanup_container(self.container)
 
     def shell_requested(self):
         """Called when a shell is requested"""
         print("Shell requested")
+        width, height = self._chan.get_terminal_size()[:2]
+        if width and height:
+            # Size from the client's pty request
+            self.terminal_size_changed(width, height, 0, 0)
         return True
 
     def terminal_size_changed(self, width, height, pixwidth, pixheight):
         """Called when the terminal size changes"""
-        if self.exec_sock and self.exec_id:
-            try:
-                self.container.client.api.exec_resize(
-                    self.exec_id['Id'],
-                    height=height,
-                    width=width
-                )
-            except Exception as e:
-                print(f"Error resizing terminal: {e}")
+        self._term_size = (width, height)
+        if self._sock:
+            self._resize(width, height)
+
+    def _resize(self, width, height):
+        task = asyncio.create_task(self._resize_exec(width, height))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _resize_exec(self, width, height):
+        try:
+            await docker_client.exec_resize(self.exec_id, height=height, width=width)
+        except DockerError as e:
+            print(f"Error resizing terminal: {e}")
 
 class SSHServer(asyncssh.SSHServer):
+    def __init__(self, pool: ContainerPool):
+        self.pool = pool
+
     def connection_made(self, conn):
         print(f"Connection received from {conn.get_extra_info('peername')}.")
         self.conn = conn
         self.username = None
+        self.closed = False
 
     def connection_lost(self, exc):
         print(f"Connection closed{': ' + str(exc) if exc else ''}")
+        self.closed = True
 
     def begin_auth(self, username):
         """Called when auth begins for a user"""
@@ -277,20 +523,32 @@ class SSHServer(asyncssh.SSHServer):
     def session_requested(self):
         """Called when a new session is requested"""
         if self.username:
-            container = create_container(self.username)
-            if container:
-                return SSHServerSession(container)
-            print(f"Failed to create container for user {self.username}")
+            # The session is finished asynchronously so that waiting for a
+            # container does not block other connections
+            chan = self.conn.create_server_channel(encoding=None)
+            return chan, self._create_session(self.username)
         return None
 
-async def start_server():
+    async def _create_session(self, username):
+        container = await self.pool.claim(username)
+        if container and self.closed:
+            # The client went away while the container was being prepared
+            cleanup_container(container)
+            raise asyncssh.ChannelOpenError(asyncssh.OPEN_CONNECT_FAILED, 'SSH connection closed')
+        if container:
+            return SSHServerSession(container, session_environment(username))
+        print(f"Failed to create container for user {username}")
+        raise asyncssh.ChannelOpenError(asyncssh.OPEN_CONNECT_FAILED, 'Container creation failed')
+
+async def start_server(pool: ContainerPool):
     """Start the SSH server."""
     if not os.path.exists(SSH_HOST_KEY):
         print(f"SSH host key '{SSH_HOST_KEY}' not found. Generate it using ssh-keygen.")
         sys.exit(1)
 
+    pool.start()
     server = await asyncssh.create_server(
-        lambda: SSHServer(),
+        lambda: SSHServer(pool),
         '',
         SSH_PORT,
         server_host_keys=[SSH_HOST_KEY],
@@ -306,14 +564,36 @@ async def start_server():
         server.close()
         await server.wait_closed()
 
+async def prepare_docker():
+    """Start the container reaper and remove pool containers of a previous run"""
+    reaper.start()
+    await remove_stale_pool_containers()
+
+async def shutdown(pool: ContainerPool):
+    """Remove idle pool containers and wait for queued removals"""
+    await pool.close()
+    await reaper.close(timeout=SHUTDOWN_TIMEOUT)
+    await docker_client.close()
+
 def main():
+    loop = asyncio.get_event_loop()
+    try:
+        loop.run_until_complete(docker_client.ping())
+    except DockerError as e:
+        print(f"Docker initialization error: {e}")
+        sys.exit(1)
+
     load_users()
+    loop.run_until_complete(prepare_docker())
+    pool = ContainerPool()
     try:
-        asyncio.get_event_loop().run_until_complete(start_server())
+        loop.run_until_complete(start_server(pool))
     except (OSError, asyncssh.Error) as exc:
         sys.exit(f"SSH server failed: {str(exc)}")
     except KeyboardInterrupt:
         print("\nShutting down server...")
+    finally:
+        loop.run_until_complete(shutdown(pool))
 
 if __name__ == '__main__':
     main()